@@ -1,12 +1,23 @@
 import asyncio
 import logging
+import signal
+import time
+from functools import partial
+from aiohttp import web
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
 from dotenv import load_dotenv
 import os
 
-from .handlers import router
-from .middleware import RateLimitMiddleware, get_operator_ids
+from .handlers import router, users_data, user_access, tickets, inbox, history, check_timeout
+from .scheduler import scheduler
+from .storage import SQLiteStorage
+from .timeouts import timeouts
+from .middleware import AccessMiddleware, RateLimitMiddleware, OperatorRegistry
+from .outbound import OutboundLimiter
+from .updates import UpdateTracker, UserSerializer
+from .fanout import fanout
+from .metrics import metrics, ApiMetricsMiddleware, HandlerMetricsMiddleware, UpdateMetricsMiddleware
 
 # Налаштування логування
 logging.basicConfig(level=logging.INFO,
@@ -21,14 +32,41 @@ TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 if not TOKEN:
     raise ValueError("Токен не надано. Встановіть змінну середовища TELEGRAM_BOT_TOKEN.")
 
-# Перевірка наявності операторів
-operator_ids = get_operator_ids()
+# Режим отримання оновлень: polling (за замовчуванням) або webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Налаштування вебхука
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # Публічна адреса бота, наприклад https://example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('PORT', 8080))
+
+# Час очікування завершення обробки оновлень при зупинці у секундах
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', 20))
+
+# Метрики у форматі Prometheus: в обох режимах на окремому порту, якщо його задано
+METRICS_PATH = os.getenv('METRICS_PATH', '/metrics')
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+
+# Стан запуску: оновлення обробляються лише після відкриття баз та прогріву кешів
+ready = False
+startup_seconds = 0.0
+
+# Реєстр операторів (створюється один раз, передається в обробники через config)
+operator_ids = OperatorRegistry()
 if not operator_ids:
     raise ValueError("Не знайдено жодного оператора. Встановіть змінну середовища OPERATOR_IDS у форматі: id1,id2,id3")
 
 # Ініціалізація бота та диспетчера
 bot = Bot(token=TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+# Усі запити до Bot API проходять через чергу з обмеженням швидкості
+outbound = OutboundLimiter(operator_ids)
+bot.session.middleware(outbound)
+# Час самого запиту до Bot API (без очікування в черзі)
+bot.session.middleware(ApiMetricsMiddleware(metrics))
+storage = SQLiteStorage()
+dp = Dispatcher(storage=storage)
 
 # Конфігурація для middleware та handlers
 config = {
@@ -36,24 +74,181 @@ config = {
 }
 
 # Реєстрація middleware
-dp.message.middleware(RateLimitMiddleware())
+# Час обробки оновлення від отримання до завершення обробника
+dp.update.outer_middleware(UpdateMetricsMiddleware(metrics))
+update_tracker = UpdateTracker(users_data)
+dp.update.outer_middleware(update_tracker)
+# Оновлення одного користувача обробляються по черзі, різних - паралельно
+user_serializer = UserSerializer()
+dp.update.outer_middleware(user_serializer)
+# Перевірка блокування та отримання запису користувача до вибору обробника
+rate_limiter = RateLimitMiddleware()
+dp.message.outer_middleware(AccessMiddleware(users_data, user_access, rate_limiter))
+dp.message.middleware(rate_limiter)
+# Час роботи обробників та станів FSM
+dp.message.middleware(HandlerMetricsMiddleware(metrics))
+
+# Показники компонентів, що читаються під час запиту метрик
+metrics.gauges("bot_outbound", "Черга запитів до Bot API", outbound.stats)
+metrics.gauges("bot_fanout", "Надсилання операторам", fanout.stats)
+metrics.gauges("bot_timeouts", "Тайм-аути неактивності", timeouts.stats)
+metrics.gauges("bot_user_cache", "Кеш записів користувачів", users_data.cache_stats)
+metrics.gauges("bot_user_queues", "Черги оновлень користувачів", user_serializer.stats)
+metrics.gauges("bot_tickets", "Відкриті звернення", tickets.stats)
+metrics.gauge("bot_inbox_pending", "Анкети, що очікують на дайджест", lambda: inbox.pending)
+metrics.gauge("bot_updates_in_flight", "Оновлення в обробці", lambda: update_tracker.in_flight)
+metrics.gauge("bot_ready", "Бот завершив запуск та прогрів кешів", lambda: int(ready))
+metrics.gauge("bot_startup_seconds", "Час запуску бота", lambda: startup_seconds)
 
 # Реєстрація обробників
 dp.include_router(router)
 
+async def start_metrics_server() -> web.AppRunner:
+    """
+    Запуск окремого HTTP сервера метрик
+
+    Метрики не публікуються на сервері вебхука, щоб не відкривати їх разом з ним
+
+    :return: runner сервера для зупинки
+    """
+    app = web.Application()
+    app.router.add_get(METRICS_PATH, metrics.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=METRICS_HOST, port=METRICS_PORT).start()
+    logging.info(f"Метрики доступні на {METRICS_HOST}:{METRICS_PORT}{METRICS_PATH}")
+    return runner
+
+
+async def run_polling() -> None:
+    """Отримання оновлень через long polling"""
+    # Видалення вебхука перед початком опитування, накопичені оновлення зберігаються
+    # та обробляються з обмеженою швидкістю (див. UpdateTracker)
+    await bot.delete_webhook(drop_pending_updates=False)
+    # Початок опитування з передачою конфігурації
+    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types(), config=config)
+
+
+async def run_webhook() -> None:
+    """Отримання оновлень через вебхук (aiohttp сервер)"""
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise ValueError("Для режиму webhook встановіть змінні середовища WEBHOOK_URL та WEBHOOK_SECRET.")
+
+    app = web.Application()
+    # Оновлення обробляються у фоні, тому Telegram одразу отримує відповідь,
+    # а оновлення різних користувачів обробляються паралельно
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET,
+        handle_in_background=True,
+        config=config,
+    ).register(app, path=WEBHOOK_PATH)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    await site.start()
+    # Вебхук встановлюється без видалення накопичених оновлень,
+    # тому повідомлення, надіслані під час перезапуску, не втрачаються
+    await bot.set_webhook(
+        f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=False,
+    )
+    logging.info(f"Вебхук слухає {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    # Очікуємо сигналу зупинки
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+    try:
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def startup() -> float:
+    """
+    Відкриття баз даних та прогрів кешів перед отриманням оновлень
+
+    Компоненти завантажуються паралельно: запити до бази користувачів
+    чекають, поки пул з'єднань відкриється та застосуються міграції.
+
+    :return: час запуску у секундах
+    """
+    global ready
+    started = time.perf_counter()
+    await asyncio.gather(
+        # Пул з'єднань з базою данних та міграції
+        users_data.open(),
+        # Останні відповідності повідомлень та записи користувачів з відкритими зверненнями
+        users_data.warm_up(),
+        # Список заблокованих користувачів
+        user_access.load(),
+        # Відкриті звернення
+        tickets.load(operator_ids),
+        # Анкети, що очікують на дайджест
+        inbox.load(),
+        # Сховище станів FSM
+        storage.open(),
+        # Останній оброблений update_id
+        update_tracker.load(),
+    )
+    elapsed = time.perf_counter() - started
+    ready = True
+    logging.info(f"Бот готовий до роботи, запуск зайняв {elapsed:.3f} с")
+    return elapsed
+
+
 async def main():
+    global startup_seconds
     logging.info("Запуск бота...")
+    # Відстеження змін файлу операторів
+    operators_watch = asyncio.create_task(operator_ids.watch())
+    metrics_runner = None
     try:
-        # Видалення вебхука перед початком опитування
-        await bot.delete_webhook(drop_pending_updates=True)
-        # Початок опитування з передачою конфігурації
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types(), config=config)
+        if METRICS_PORT:
+            # сервер метрик запускається першим, щоб було видно стан запуску
+            metrics_runner = await start_metrics_server()
+        # Оновлення починають надходити лише після прогріву
+        startup_seconds = await startup()
+        # Запуск планувальника відкладених повідомлень
+        scheduler.start(bot)
+        # Запуск менеджера тайм-аутів неактивності
+        timeouts.start(partial(check_timeout, bot, dp.storage))
+        # Доставка дайджесту анкет за неробочий час на початку зміни
+        inbox.start(bot, operator_ids)
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            await run_polling()
     except Exception as e:
         logging.error(f"Критична помилка: {e}")
         raise
     finally:
-        logging.info("Бот зупинений")
+        # Дочікуємося завершення обробників, що виконуються
+        await update_tracker.drain(SHUTDOWN_TIMEOUT)
+        operators_watch.cancel()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await timeouts.stop()
+        await inbox.stop()
+        await scheduler.stop()
+        # Дочікуємося фонових надсилань операторам (вони записують відповідності в базу)
+        await fanout.drain(SHUTDOWN_TIMEOUT)
+        # Зберігаємо останній update_id, історію та буфер змін перед закриттям бази
+        await update_tracker.persist()
+        await history.close()
+        await users_data.close()
+        await storage.close()
         await bot.session.close()
+        logging.info("Бот зупинений")
 
 if __name__ == '__main__':
     try:
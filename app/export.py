@@ -0,0 +1,156 @@
+"""
+Потоковий експорт анкет користувачів у CSV або JSONL
+
+Записи читаються з бази пакетами та одразу дописуються у файл, тому пам'ять
+не залежить від розміру таблиці. Помилка читання бази перериває експорт,
+а не залишає обрізаний файл. Використовується командою /export та з
+командного рядка:
+
+    python -m app.export [--format csv|jsonl] [--from ДД/ММ/РРРР] [--to ДД/ММ/РРРР] [--db шлях] [-o файл]
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import sys
+from contextlib import aclosing, redirect_stdout
+from datetime import datetime
+from typing import IO, Optional
+
+from .users_data import UsersData
+
+
+# Формати експорту
+EXPORT_FORMATS = ("csv", "jsonl")
+# Колонки експорту в порядку виводу
+EXPORT_FIELDS = (
+    "id", "uuid", "telegram_user_id", "date_created", "name", "age", "location",
+    "event_details", "help_type", "description", "blocked",
+)
+# Початкові символи формул у табличних редакторах
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@")
+
+
+def parse_date(text: str) -> str:
+    """
+    Перетворення дати ДД/ММ/РРРР (або ДД.ММ.РРРР) у ключ РРРРММДД для фільтра
+
+    :param text: дата
+    :return: ключ дати
+    :raises ValueError: якщо дата некоректна
+    """
+    return datetime.strptime(text.replace(".", "/"), "%d/%m/%Y").strftime("%Y%m%d")
+
+
+def _csv_safe(value):
+    """
+    Екранування значення клітинки CSV, яке табличний редактор сприйняв би як формулу
+
+    :param value: значення поля
+    :return: значення з префіксом ' для тексту, що починається з =, +, - або @
+    """
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _format_chunk(rows, export_format: str, header: bool) -> str:
+    """Текст одного пакета записів"""
+    if export_format == "jsonl":
+        return "".join(
+            json.dumps({field: row.get(field) for field in EXPORT_FIELDS}, ensure_ascii=False) + "\n"
+            for row in rows
+        )
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+    if header:
+        writer.writeheader()
+    # анкети містять довільний текст користувачів
+    writer.writerows({field: _csv_safe(value) for field, value in row.items()} for row in rows)
+    return buffer.getvalue()
+
+
+async def write_export(
+    users_data: UsersData,
+    output: IO[str],
+    export_format: str = "csv",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    chunk_size: int = 500,
+) -> int:
+    """
+    Запис анкет у файл пакетами
+
+    :param users_data: сховище анкет
+    :param output: текстовий файл для запису
+    :param export_format: csv або jsonl
+    :param date_from: перша дата створення у форматі РРРРММДД (включно)
+    :param date_to: остання дата створення у форматі РРРРММДД (включно)
+    :param chunk_size: кількість записів у пакеті
+    :return: кількість експортованих записів
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Невідомий формат експорту: {export_format}")
+    # відкладені зміни полів мають потрапити в експорт
+    await users_data.flush()
+    if export_format == "csv":
+        await asyncio.to_thread(output.write, _format_chunk([], export_format, header=True))
+    exported = 0
+    async with aclosing(users_data.iter_users(date_from, date_to, chunk_size)) as chunks:
+        async for rows in chunks:
+            await asyncio.to_thread(output.write, _format_chunk(rows, export_format, header=False))
+            exported += len(rows)
+    return exported
+
+
+async def export_to_file(
+    users_data: UsersData,
+    path: str,
+    export_format: str = "csv",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+) -> int:
+    """
+    Експорт анкет у файл
+
+    :param users_data: сховище анкет
+    :param path: шлях до файлу
+    :param export_format: csv або jsonl
+    :param date_from: перша дата створення у форматі РРРРММДД (включно)
+    :param date_to: остання дата створення у форматі РРРРММДД (включно)
+    :return: кількість експортованих записів
+    """
+    # utf-8-sig, щоб Excel правильно показував кирилицю в CSV
+    encoding = "utf-8-sig" if export_format == "csv" else "utf-8"
+    output = await asyncio.to_thread(open, path, "w", encoding=encoding, newline="")
+    try:
+        return await write_export(users_data, output, export_format, date_from, date_to)
+    finally:
+        await asyncio.to_thread(output.close)
+
+
+async def main(args: argparse.Namespace) -> None:
+    users_data = UsersData(args.db)
+    stdout = sys.stdout
+    # повідомлення бази (міграції, помилки) - в stderr, щоб не змішувати їх з експортом у stdout
+    with redirect_stdout(sys.stderr):
+        try:
+            if args.output == "-":
+                exported = await write_export(users_data, stdout, args.format, args.date_from, args.date_to)
+            else:
+                exported = await export_to_file(users_data, args.output, args.format, args.date_from, args.date_to)
+            print(f"Експортовано записів: {exported}")
+        finally:
+            await users_data.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Експорт анкет користувачів")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv", help="формат файлу (за замовчуванням csv)")
+    parser.add_argument("--from", dest="date_from", type=parse_date, metavar="ДД/ММ/РРРР", help="перша дата створення ДД/ММ/РРРР (включно)")
+    parser.add_argument("--to", dest="date_to", type=parse_date, metavar="ДД/ММ/РРРР", help="остання дата створення ДД/ММ/РРРР (включно)")
+    parser.add_argument("--db", default=os.path.join("data", "users_data.sqlite"), help="файл бази данних")
+    parser.add_argument("-o", "--output", default="-", help="файл для запису (за замовчуванням stdout)")
+    asyncio.run(main(parser.parse_args()))
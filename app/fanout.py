@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set
+
+
+class OperatorFanout:
+    """
+    Паралельне надсилання повідомлень операторам
+
+    Надсилає всім операторам одночасно з обмеженою кількістю паралельних запитів.
+    Помилка надсилання одному оператору не впливає на інших. Обробники
+    повідомлень користувачів передають надсилання у фон (submit), тому відповідь
+    користувачу не чекає на інтервал між повідомленнями в чатах операторів.
+    """
+
+    def __init__(self, concurrency: int = None) -> None:
+        """
+        Ініціалізація
+
+        Використовує змінні середовища:
+        FANOUT_CONCURRENCY: Максимальна кількість паралельних надсилань (за замовчуванням 10)
+
+        :param concurrency: максимальна кількість паралельних надсилань
+        """
+        self.concurrency = concurrency or int(os.getenv('FANOUT_CONCURRENCY', 10))
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # Фонові надсилання, що ще виконуються
+        self._background: Set[asyncio.Task] = set()
+        # Метрики
+        self.sent = 0
+        self.failed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    async def send(
+        self,
+        operators: Iterable[int],
+        send: Callable[[int], Awaitable[Any]],
+    ) -> Dict[int, Any]:
+        """
+        Надсилання всім операторам
+
+        :param operators: ID операторів
+        :param send: корутина, що надсилає повідомлення одному оператору
+        :return: результат надсилання для кожного оператора (None при помилці)
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        operators = list(operators)
+        results = await asyncio.gather(*(self._send_one(operator_id, send) for operator_id in operators))
+        return dict(zip(operators, results))
+
+    def submit(
+        self,
+        operators: Iterable[int],
+        send: Callable[[int], Awaitable[Any]],
+        done: Optional[Callable[[Dict[int, Any]], Awaitable[None]]] = None,
+    ) -> None:
+        """
+        Надсилання всім операторам у фоні
+
+        :param operators: ID операторів
+        :param send: корутина, що надсилає повідомлення одному оператору
+        :param done: корутина, що отримує результати після надсилання всім операторам
+        """
+        task = asyncio.create_task(self._submit(list(operators), send, done))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _submit(
+        self,
+        operators: Iterable[int],
+        send: Callable[[int], Awaitable[Any]],
+        done: Optional[Callable[[Dict[int, Any]], Awaitable[None]]],
+    ) -> None:
+        """Фонове надсилання з обробкою результатів"""
+        results = await self.send(operators, send)
+        if done is not None:
+            try:
+                await done(results)
+            except Exception as e:
+                logging.error(f"Помилка при обробці результатів надсилання операторам: {e}")
+
+    async def drain(self, timeout: float) -> None:
+        """
+        Очікування фонових надсилань (викликається при зупинці бота)
+
+        Надсилання, що не завершились за timeout, скасовуються, щоб вони не
+        записували відповідності в базу після її закриття.
+
+        :param timeout: максимальний час очікування у секундах
+        """
+        if self._background:
+            _, pending = await asyncio.wait(set(self._background), timeout=timeout)
+            if pending:
+                logging.warning(f"Не завершено фонових надсилань операторам: {len(pending)}, їх скасовано")
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _send_one(self, operator_id: int, send: Callable[[int], Awaitable[Any]]) -> Any:
+        """Надсилання одному оператору з ізоляцією помилок"""
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                result = await send(operator_id)
+                self.sent += 1
+                return result
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"Помилка при надсиланні повідомлення оператору {operator_id}: {e}")
+                return None
+            finally:
+                latency = time.perf_counter() - started
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Метрики надсилання
+
+        :return: кількість успішних та невдалих надсилань, середня та максимальна затримка у секундах,
+            кількість фонових надсилань
+        """
+        total = self.sent + self.failed
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "latency_avg": self.latency_total / total if total else 0.0,
+            "latency_max": self.latency_max,
+            "background": len(self._background),
+        }
+
+
+# Створюємо глобальний екземпляр для надсилання операторам
+fanout = OperatorFanout()
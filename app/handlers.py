@@ -1,123 +1,241 @@
 from datetime import datetime
+from functools import partial
+import html
+from typing import Any, Dict, Iterable, List, Optional
 import os
 import logging
-import asyncio
-from aiogram import F, Router, types
-from aiogram.types import Message, ReplyKeyboardRemove
+import tempfile
+import aiosqlite
+from aiogram import Bot, F, Router, types
+from aiogram.enums import ContentType
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message, ReplyKeyboardRemove
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.filters import StateFilter
 from static import messages
 from .keyboard import get_main_keyboard, get_yes_no_keyboard, get_continue_keyboard, get_back_keyboard
 from .fsm import UserForm, ChatMode, MediaForm, OtherPeopleHelpForm
-from .middleware import get_operator_ids
-from .user_access import user_access
+from .user_access import UserAccess
 from .users_data import UsersData
+from .scheduler import scheduler
+from .export import EXPORT_FORMATS, export_to_file, parse_date
+from .fanout import fanout
+from .history import MessageHistory, INCOMING, OUTGOING
+from .inbox import OffHoursInbox, is_working_hours
+from .tickets import TicketManager
+from .timeouts import timeouts, FORM_TIMEOUT, HELP_TIMEOUT, TICKET_TIMEOUT
 
 users_data = UsersData()
+user_access = UserAccess(users_data)
+tickets = TicketManager(users_data)
+inbox = OffHoursInbox(users_data)
+history = MessageHistory(users_data)
 
 
 
 # Роутер для обробки повідомлень
 router = Router()
 
-# Словник для зберігання таймерів користувачів
-user_timers = {}
+# Тайм-аут неактивності користувача у секундах
+INACTIVITY_TIMEOUT = 180  # 3 хвилини
+
+# Ліміти довжини тексту повідомлення та підпису до медіа в Telegram (у кодових одиницях UTF-16)
+MESSAGE_LIMIT = 4096
+CAPTION_LIMIT = 1024
+# Типи повідомлень, які можна скопіювати з підписом
+CAPTION_CONTENT_TYPES = {
+    ContentType.PHOTO, ContentType.VIDEO, ContentType.ANIMATION,
+    ContentType.AUDIO, ContentType.DOCUMENT, ContentType.VOICE,
+}
+
+# Максимальний розмір файлу, який бот може надіслати через Bot API (50 МБ)
+EXPORT_UPLOAD_LIMIT = 50 * 1024 * 1024
+
+# Відповідь оператору, якщо не вдалося визначити користувача за повідомленням, на яке він відповів
+REPLY_TARGET_UNKNOWN = (
+    "❌ <b>Не вдалося визначити користувача для відповіді.</b>\n"
+    "Відповідайте на повідомлення користувача, переслане ботом, "
+    "або відкрийте анкету командою /form ID і відповідайте на неї"
+)
 
 # Повернення до говоловного меню
 @router.message(F.text[0] == "🔙")
 async def back_to_main_menu(message: Message, state: FSMContext):
     """Повернення до головного меню"""
+    scheduler.cancel(message.from_user.id)
+    timeouts.cancel(message.from_user.id)
     await state.clear()
     await state.set_state(ChatMode.automated)
     await message.answer(messages.menu_message, reply_markup=get_main_keyboard(), parse_mode="HTML")
 
 
 
-async def check_timeout(user_id: int, state: FSMContext, message: Message):
-    """Перевірка тайм-ауту користувача"""
-    await asyncio.sleep(180)  # 3 минуты
+async def check_timeout(bot: Bot, storage: BaseStorage, user_id: int, chat_id: int, kind: str):
+    """Обробка тайм-ауту користувача (викликається менеджером тайм-аутів)"""
+    state = FSMContext(storage=storage, key=StorageKey(bot_id=bot.id, chat_id=chat_id, user_id=user_id))
     current_state = await state.get_state()
 
     # Перевіряємо, чи користувач все ще в процесі заповнення форми
-    if current_state in [
+    if kind == FORM_TIMEOUT and current_state in [
         UserForm.waiting_for_name,
         UserForm.waiting_for_age,
         UserForm.waiting_for_location,
         UserForm.waiting_for_event_details,
         UserForm.waiting_for_help_type,
     ]:
-        await message.answer(
-            messages.ask_description_form_message, parse_mode="HTML"
-        )
-        await asyncio.sleep(15)
-        await message.answer(
+        await bot.send_message(chat_id, messages.ask_description_form_message, parse_mode="HTML")
+        # Встановлюємо стан очікування відповіді про продовження
+        await state.set_state("waiting_continue")
+        scheduler.send_later(
+            user_id, 15, chat_id,
             "❓ <b>Продовжимо?</b>",
             reply_markup=get_yes_no_keyboard(),
             parse_mode="HTML"
         )
-        # Встановлюємо стан очікування відповіді про продовження
-        await state.set_state("waiting_continue")
-    if current_state == ChatMode.waiting_continue_help:
-        await message.answer(
-            messages.cancel_waiting_help_message, parse_mode="HTML", reply_markup=get_back_keyboard()
+    if kind == HELP_TIMEOUT and current_state == ChatMode.waiting_continue_help:
+        await bot.send_message(
+            chat_id, messages.cancel_waiting_help_message, parse_mode="HTML", reply_markup=get_back_keyboard()
         )
         await state.clear()
+    if kind == TICKET_TIMEOUT:
+        # Оператор не відповів вчасно - передаємо звернення іншому
+        ticket = await tickets.reassign(user_id)
+        if ticket is None:
+            return
+        user_data = await users_data.get_user_data(str(user_id))
+        await notify_operators(
+            bot, user_id, tickets.recipients(ticket),
+            f"🎫 <b>Звернення передано вам:</b> попередній координатор не відповів вчасно\n"
+            f"📋 <b>ID:</b> <code>{user_data['uuid'] if user_data else '—'}</code>\n"
+            f"Відповідайте на це повідомлення, щоб написати користувачу"
+        )
+        if ticket.operator_id is not None:
+            timeouts.schedule(user_id, chat_id, TICKET_TIMEOUT, tickets.reply_timeout)
 
 
 
 async def extract_user_id(message: Message) -> int and str:
     """Отримати ID користувача з повідомлення або пересланого повідомлення"""
     try:
+        # Повідомлення, надіслані ботом операторам, знаходимо за збереженою відповідністю
+        telegram_user_id = await users_data.get_message_route(message.chat.id, message.message_id)
+        if telegram_user_id is not None:
+            user_data = await users_data.get_user_data(telegram_user_id)
+            return int(telegram_user_id), user_data['uuid'] if user_data else None
         if message.forward_from:
-            return message.forward_from.id
+            return message.forward_from.id, None
         if message.text and "ID: " in message.text:
             uuid_user = message.text.split("ID: ")[1].split("\n")[0]
             user_data = await users_data.get_user_data_by_uuid(uuid_user)
-            id_user = user_data['telegram_user_id']
-            return int(id_user), uuid_user
+            if user_data is None:
+                return None, None
+            return int(user_data['telegram_user_id']), uuid_user
     except (IndexError, ValueError, AttributeError):
         print(f"Помилка при отриманні ID користувача з повідомлення: {message}")
         return None, None
     return None, None
 
 
-async def forward_to_operators(message: Message, user_context: str = None):
-    """Переслати повідомлення всім операторам з контекстом користувача"""
-    operator_ids = get_operator_ids()
+def telegram_length(text: str) -> int:
+    """
+    Довжина тексту так, як її рахує Telegram (кодові одиниці UTF-16)
+
+    Для HTML-тексту це верхня межа: теги та сутності після розбору лише скорочують текст
+    """
+    return len(text.encode("utf-16-le")) // 2
 
-    for operator_id in operator_ids:
+
+async def forward_to_operators(
+    message: Message,
+    operators: Iterable[int],
+    user_context: str = None,
+    user_record: Optional[Dict[str, Any]] = None,
+):
+    """
+    Переслати повідомлення всім операторам з контекстом користувача
+
+    Надсилання виконується у фоні, тому обробник одразу відповідає користувачу
+    """
+    # Контекст користувача отримуємо один раз для всіх операторів
+    # (обробники передають запис, отриманий AccessMiddleware)
+    user_data = user_record or await users_data.get_user_data(str(message.from_user.id))
+    notification = (
+        f"<b>Повідомлення від користувача:</b>\n"
+        f"📋 <b>ID:</b> <code>{user_data['uuid'] if user_data else '—'}</code>\n"
+        f"👤 <b>Ім'я:</b> {html.escape(message.from_user.full_name)}\n"
+        f"📱 <b>Username:</b> @{message.from_user.username}"
+    )
+    if user_context:
+        notification += f"\n📝 <b>Контекст:</b> <i>{html.escape(user_context)}</i>"
+    # Заголовок і повідомлення надсилаються одним повідомленням, якщо вміщуються в ліміт Telegram
+    combined = f"{notification}\n\n{message.html_text}" if message.html_text else notification
+
+    async def send(operator_id: int):
         try:
-            user_data = await users_data.get_user_data(str(message.from_user.id))
-            forwarded = await message.forward(operator_id)
-            notification = (
-                f"<b>Повідомлення від користувача:</b>\n"
-                f"📋 <b>ID:</b> <code>{user_data['uuid']}</code>\n"
-                f"👤 <b>Ім'я:</b> {message.from_user.full_name}\n"
-                f"📱 <b>Username:</b> @{message.from_user.username}"
-            )
-            if user_context:
-                notification += f"\n📝 <b>Контекст:</b> <i>{user_context}</i>"
-            await message.bot.send_message(operator_id, notification, parse_mode="HTML")
-        except Exception as e:
-            logging.error(f"Помилка при пересиланні повідомлення оператору {operator_id}: {e}")
+            if message.text is not None and telegram_length(combined) <= MESSAGE_LIMIT:
+                return (await message.bot.send_message(operator_id, combined, parse_mode="HTML"),)
+            if message.content_type in CAPTION_CONTENT_TYPES and telegram_length(combined) <= CAPTION_LIMIT:
+                return (await message.copy_to(operator_id, caption=combined, parse_mode="HTML"),)
+        except TelegramBadRequest as e:
+            # Telegram не прийняв об'єднаний текст - повідомлення все одно має дійти до оператора
+            logging.warning(f"Не вдалося надіслати оператору {operator_id} повідомлення з заголовком: {e}")
+        forwarded = await message.forward(operator_id)
+        sent = await message.bot.send_message(operator_id, notification, parse_mode="HTML")
+        return forwarded, sent
+
+    history.add(message.from_user.id, message, INCOMING)
+    fanout.submit(operators, send, partial(record_routes, message.from_user.id))
+
+
+async def notify_operators(bot: Bot, user_id: int, operators: Iterable[int], notification: str):
+    """Надіслати сповіщення про користувача операторам (у фоні)"""
+    fanout.submit(
+        operators,
+        lambda operator_id: bot.send_message(operator_id, notification, parse_mode="HTML"),
+        partial(record_routes, user_id)
+    )
+
+
+async def record_routes(user_id: int, results: Dict[int, Any]):
+    """Збереження відповідностей надісланих операторам повідомлень користувачу"""
+    # Відповідь оператора на будь-яке з цих повідомлень буде надіслана цьому користувачу
+    await users_data.add_message_routes(user_id, [
+        (operator_id, sent_message.message_id)
+        for operator_id, result in results.items() if result is not None
+        for sent_message in (result if isinstance(result, tuple) else (result,))
+    ])
+
+
+async def ticket_recipients(message: Message) -> List[int]:
+    """Оператори звернення користувача (звернення відкривається, якщо його ще немає)"""
+    ticket = await tickets.open(message.from_user.id)
+    if ticket.operator_id is not None and not timeouts.is_active(message.from_user.id, TICKET_TIMEOUT):
+        # якщо оператор не відповість вчасно, звернення буде передано іншому
+        timeouts.schedule(message.from_user.id, message.chat.id, TICKET_TIMEOUT, tickets.reply_timeout)
+    return tickets.recipients(ticket)
 
 
 async def forward_to_user(message: Message, user_id: int):
     """Переслати повідомлення оператора користувачу"""
-    user_data = await users_data.get_user_data(str(user_id))
-    if user_access.is_blocked(user_data['uuid']):
+    if user_access.is_blocked(user_id):
         await message.answer(
             f"❌ <b>Неможливо надіслати повідомлення. Користувач</b> <code>{user_id}</code> <b>заблокований.</b>",
             parse_mode="HTML"
         )
         return
     await message.copy_to(user_id)
+    history.add(user_id, message, OUTGOING, message.from_user.id)
+    # Оператор, що відповів, закріплюється за зверненням
+    await tickets.claim(user_id, message.from_user.id)
+    timeouts.cancel(user_id, TICKET_TIMEOUT)
 
 
 @router.message(Command("form"))
-async def show_user_form_handler(message: Message):
+async def show_user_form_handler(message: Message, config: Dict[str, Any]):
     """Обробка команди відображення анкети користувача"""
-    if message.from_user.id not in get_operator_ids():
+    if message.from_user.id not in config["OPERATOR_IDS"]:
         return
 
     try:
@@ -149,7 +267,9 @@ async def show_user_form_handler(message: Message):
             f"📝 <b>Деталі події:</b> {user_data['event_details']}\n"
             f"🆘 <b>Тип допомоги:</b> {user_data['help_type']}\n"
         )
-        await message.answer(user_info, parse_mode="HTML")
+        sent = await message.answer(user_info, parse_mode="HTML")
+        # Відповідь оператора на анкету буде надіслана цьому користувачу
+        await users_data.add_message_routes(user_data['telegram_user_id'], [(sent.chat.id, sent.message_id)])
 
     except ValueError:
         await message.answer(
@@ -158,9 +278,9 @@ async def show_user_form_handler(message: Message):
         )
 
 @router.message(Command("block"))
-async def block_user_handler(message: Message):
+async def block_user_handler(message: Message, config: Dict[str, Any]):
     """Обробка команди блокування користувача"""
-    if message.from_user.id not in get_operator_ids():
+    if message.from_user.id not in config["OPERATOR_IDS"]:
         return
 
     try:
@@ -174,7 +294,13 @@ async def block_user_handler(message: Message):
             return
 
         user_uuid = str(args[1] + " " + args[2])
-        if user_access.block_user(user_uuid):
+        result = await user_access.block_user(user_uuid)
+        if result is None:
+            await message.answer(
+                f"❌ <b>Користувача з ID</b> <code>{user_uuid}</code> <b>не знайдено</b>",
+                parse_mode="HTML"
+            )
+        elif result:
             await message.answer(
                 f"✅ <b>Користувача з ID</b> <code>{user_uuid}</code> <b>заблоковано</b>",
                 parse_mode="HTML"
@@ -192,9 +318,9 @@ async def block_user_handler(message: Message):
 
 
 @router.message(Command("unblock"))
-async def unblock_user_handler(message: Message):
+async def unblock_user_handler(message: Message, config: Dict[str, Any]):
     """Обробка команди розблокування користувача"""
-    if message.from_user.id not in get_operator_ids():
+    if message.from_user.id not in config["OPERATOR_IDS"]:
         return
 
     try:
@@ -208,7 +334,7 @@ async def unblock_user_handler(message: Message):
             return
 
         user_uuid = str(args[1] + " " + args[2])
-        if user_access.unblock_user(user_uuid):
+        if await user_access.unblock_user(user_uuid):
             await message.answer(
                 f"✅ <b>Користувача з ID</b> <code>{user_uuid}</code> <b>розблоковано</b>",
                 parse_mode="HTML"
@@ -226,9 +352,9 @@ async def unblock_user_handler(message: Message):
 
 
 @router.message(Command("blocked_list"))
-async def blocked_list_handler(message: Message):
+async def blocked_list_handler(message: Message, config: Dict[str, Any]):
     """Обробка команди перегляду списку заблокованих користувачів"""
-    if message.from_user.id not in get_operator_ids():
+    if message.from_user.id not in config["OPERATOR_IDS"]:
         return
 
     blocked_users = user_access.get_blocked_users()
@@ -246,8 +372,211 @@ async def blocked_list_handler(message: Message):
     )
 
 
+@router.message(Command("queue"))
+async def queue_handler(message: Message, config: Dict[str, Any]):
+    """Обробка команди перегляду черги звернень"""
+    if message.from_user.id not in config["OPERATOR_IDS"]:
+        return
+
+    open_tickets = await users_data.get_open_tickets()
+    if not open_tickets:
+        await message.answer("ℹ️ <b>Відкритих звернень немає</b>", parse_mode="HTML")
+        return
+
+    now = datetime.now().timestamp()
+    lines = []
+    for ticket in open_tickets:
+        operator = f"👤 <code>{ticket['operator_id']}</code>" if ticket['operator_id'] else "⏳ не призначено"
+        minutes = int(now - ticket['created_at']) // 60
+        lines.append(f"• #{ticket['id']} <code>{ticket['uuid']}</code> — {operator} ({minutes} хв)")
+    load = "\n".join(
+        f"• <code>{operator_id}</code>: {count}" for operator_id, count in tickets.load_by_operator().items()
+    )
+    await message.answer(
+        f"📋 <b>Черга звернень ({len(open_tickets)}):</b>\n\n" + "\n".join(lines) +
+        f"\n\n👥 <b>Навантаження операторів:</b>\n{load}",
+        parse_mode="HTML"
+    )
+
+
+@router.message(Command("close"))
+async def close_ticket_handler(message: Message, config: Dict[str, Any]):
+    """Обробка команди закриття звернення"""
+    if message.from_user.id not in config["OPERATOR_IDS"]:
+        return
+
+    args = message.text.split()
+    if len(args) == 3:
+        user_uuid = str(args[1] + " " + args[2])
+        user_data = await users_data.get_user_data_by_uuid(user_uuid)
+        user_id = int(user_data['telegram_user_id']) if user_data else None
+    elif len(args) == 1 and message.reply_to_message:
+        user_id, user_uuid = await extract_user_id(message.reply_to_message)
+    else:
+        await message.answer(
+            "❌ <b>Використання:</b> /close ID_користувача\n"
+            "Наприклад: /close 01/01/2025 1\n"
+            "Або надішліть /close у відповідь на повідомлення користувача",
+            parse_mode="HTML"
+        )
+        return
+
+    if user_id is None:
+        await message.answer("❌ <b>Користувача не знайдено</b>", parse_mode="HTML")
+        return
+    timeouts.cancel(user_id, TICKET_TIMEOUT)
+    if await tickets.close(user_id) is None:
+        await message.answer(
+            f"ℹ️ <b>У користувача</b> <code>{user_uuid}</code> <b>немає відкритого звернення</b>",
+            parse_mode="HTML"
+        )
+    else:
+        await message.answer(
+            f"✅ <b>Звернення користувача</b> <code>{user_uuid}</code> <b>закрито</b>",
+            parse_mode="HTML"
+        )
+
+
+@router.message(Command("history"))
+async def history_handler(message: Message, config: Dict[str, Any]):
+    """Обробка команди перегляду історії переписки з користувачем"""
+    if message.from_user.id not in config["OPERATOR_IDS"]:
+        return
+
+    args = message.text.split()[1:]
+    if len(args) not in (2, 3) or (len(args) == 3 and not args[2].isdigit()):
+        await message.answer(
+            "❌ <b>Використання:</b> /history ID_користувача [сторінка]\n"
+            "Наприклад: /history 01/01/2025 1 2",
+            parse_mode="HTML"
+        )
+        return
+
+    user_uuid = args[0] + " " + args[1]
+    page = max(1, int(args[2])) if len(args) == 3 else 1
+    user_data = await users_data.get_user_data_by_uuid(user_uuid)
+    if user_data is None:
+        await message.answer(
+            f"❌ <b>Користувача з ID</b> <code>{user_uuid}</code> <b>не знайдено</b>",
+            parse_mode="HTML"
+        )
+        return
+
+    pages, entries = await history.page(user_data['telegram_user_id'], page)
+    if not entries:
+        await message.answer(
+            f"ℹ️ <b>Немає повідомлень з користувачем</b> <code>{user_uuid}</code> <b>на сторінці {page}</b>",
+            parse_mode="HTML"
+        )
+        return
+    # на сторінці новіші повідомлення першими, показуємо в хронологічному порядку
+    lines = [history.format_entry(entry) for entry in reversed(entries)]
+    footer = f"\n\n➡️ Старіші повідомлення: /history {user_uuid} {page + 1}" if page < pages else ""
+    await message.answer(
+        f"📜 <b>Історія переписки</b> <code>{user_uuid}</code> (сторінка {page}/{pages}):\n\n" +
+        "\n".join(lines) + footer,
+        parse_mode="HTML"
+    )
+
+
+@router.message(Command("search"))
+async def search_handler(message: Message, config: Dict[str, Any]):
+    """Обробка команди пошуку в історії переписки"""
+    if message.from_user.id not in config["OPERATOR_IDS"]:
+        return
+
+    args = message.text.split()[1:]
+    page = 1
+    if len(args) > 1 and args[-1].isdigit():
+        # число в кінці запиту - номер сторінки
+        page = max(1, int(args.pop()))
+    text = " ".join(args)
+    if not text:
+        await message.answer(
+            "❌ <b>Використання:</b> /search текст [сторінка]\n"
+            "Наприклад: /search психолог 2\n"
+            "Слово з * в кінці шукається за початком: /search психолог*",
+            parse_mode="HTML"
+        )
+        return
+
+    entries, has_next = await history.search(text, page)
+    if not entries and page > 1:
+        await message.answer(
+            f"ℹ️ <b>Більше результатів за запитом</b> <i>{html.escape(text)}</i> <b>немає</b>",
+            parse_mode="HTML"
+        )
+        return
+    if not entries:
+        await message.answer(
+            f"ℹ️ <b>Нічого не знайдено за запитом</b> <i>{html.escape(text)}</i>",
+            parse_mode="HTML"
+        )
+        return
+    lines = [history.format_entry(entry, with_uuid=True) for entry in entries]
+    footer = f"\n\n➡️ Наступна сторінка: /search {html.escape(text)} {page + 1}" if has_next else ""
+    await message.answer(
+        f"🔎 <b>Результати пошуку</b> <i>{html.escape(text)}</i> (сторінка {page}):\n\n" +
+        "\n".join(lines) + footer,
+        parse_mode="HTML"
+    )
+
+
+@router.message(Command("export"))
+async def export_handler(message: Message, config: Dict[str, Any]):
+    """Обробка команди експорту анкет у файл"""
+    if message.from_user.id not in config["OPERATOR_IDS"]:
+        return
+
+    args = message.text.split()[1:]
+    export_format = args.pop(0).lower() if args and args[0].lower() in EXPORT_FORMATS else "csv"
+    try:
+        if len(args) > 2:
+            raise ValueError
+        dates = [parse_date(arg) for arg in args]
+    except ValueError:
+        await message.answer(
+            "❌ <b>Використання:</b> /export [csv|jsonl] [з ДД/ММ/РРРР] [по ДД/ММ/РРРР]\n"
+            "Наприклад: /export jsonl 01/01/2025 31/01/2025",
+            parse_mode="HTML"
+        )
+        return
+    date_from = dates[0] if dates else None
+    date_to = dates[1] if len(dates) > 1 else None
+
+    fd, path = tempfile.mkstemp(suffix=f".{export_format}")
+    os.close(fd)
+    try:
+        try:
+            exported = await export_to_file(users_data, path, export_format, date_from, date_to)
+        except (aiosqlite.Error, OSError) as e:
+            logging.error(f"Помилка при експорті анкет: {e}")
+            await message.answer(
+                "❌ <b>Не вдалося експортувати анкети.</b> Спробуйте пізніше",
+                parse_mode="HTML"
+            )
+            return
+        if not exported:
+            await message.answer("ℹ️ <b>Немає анкет за вказаний період</b>", parse_mode="HTML")
+            return
+        if os.path.getsize(path) > EXPORT_UPLOAD_LIMIT:
+            await message.answer(
+                "❌ <b>Файл експорту завеликий для надсилання в Telegram.</b>\n"
+                "Вкажіть коротший період або скористайтесь python -m app.export на сервері",
+                parse_mode="HTML"
+            )
+            return
+        filename = f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+        await message.answer_document(
+            FSInputFile(path, filename=filename),
+            caption=f"📦 Експортовано анкет: {exported}"
+        )
+    finally:
+        os.remove(path)
+
+
 @router.message(Command("help"))
-async def help_handler(message: Message):
+async def help_handler(message: Message, config: Dict[str, Any]):
     """Обробка команди /help"""
     help_text = (
         "🤖 <b>Допомога з використання бота:</b>\n\n"
@@ -258,13 +587,18 @@ async def help_handler(message: Message):
     )
 
     # Додаткові команди для операторів
-    if message.from_user.id in get_operator_ids():
+    if message.from_user.id in config["OPERATOR_IDS"]:
         help_text += (
             "\n📋 <b>Команди для операторів:</b>\n"
             "/block ID - Заблокувати користувача\n"
             "/unblock ID - Розблокувати користувача\n"
             "/blocked_list - Показати список заблокованих користувачів\n"
             "/form ID - Показати анкету користувача\n"
+            "/queue - Показати чергу звернень\n"
+            "/close ID - Закрити звернення користувача (або у відповідь на його повідомлення)\n"
+            "/history ID [сторінка] - Показати історію переписки з користувачем\n"
+            "/search текст [сторінка] - Пошук в історії переписки\n"
+            "/export [csv|jsonl] [з] [по] - Експорт анкет у файл (дати ДД/ММ/РРРР)\n"
         )
 
     help_text += (
@@ -281,22 +615,13 @@ async def help_handler(message: Message):
 @router.message(Command("cancel"))
 async def cancel_handler(message: Message, state: FSMContext):
     """Обробка команди /cancel"""
-    user_data = await users_data.get_user_data(str(message.from_user.id))
-    if user_access.is_blocked(user_data['uuid']):
-        await message.answer(
-            "❌ <b>На жаль, ваш доступ до бота обмежено.</b>",
-            parse_mode="HTML"
-        )
-        return
-
     current_state = await state.get_state()
     if current_state is None:
         return
 
     # Скасуємо таймер, якщо він існує
-    if message.from_user.id in user_timers:
-        user_timers[message.from_user.id].cancel()
-        del user_timers[message.from_user.id]
+    timeouts.cancel(message.from_user.id)
+    scheduler.cancel(message.from_user.id)
 
     await state.clear()
     await message.answer(
@@ -307,19 +632,11 @@ async def cancel_handler(message: Message, state: FSMContext):
 
 
 @router.message(CommandStart())
-async def start_handler(message: Message, state: FSMContext):
+async def start_handler(message: Message, state: FSMContext, config: Dict[str, Any],
+                        user_record: Optional[Dict[str, Any]]):
     """Обробка команди /start"""
-    user_data = await users_data.get_user_data(str(message.from_user.id))
-    if user_data is not None:
-        if user_access.is_blocked(user_data['uuid']):
-            await message.answer(
-                "❌ <b>На жаль, ваш доступ до бота обмежено.</b>",
-                parse_mode="HTML"
-            )
-            return
-
     # Перевірка чи це оператор
-    if message.from_user.id in get_operator_ids():
+    if message.from_user.id in config["OPERATOR_IDS"]:
         await message.answer(
             "👋 <b>Вітаємо!</b>\n\n"
             "Для перегляду доступних команд використовуйте /help\n"
@@ -328,30 +645,25 @@ async def start_handler(message: Message, state: FSMContext):
         )
         return
 
-    current_hour = datetime.now().hour
-
-    add_user = await users_data.add_user(str(message.from_user.id))
-    if add_user:
-        user_data = await users_data.get_user_data(str(message.from_user.id))
+    # запис існуючого користувача вже отримано в AccessMiddleware
+    new_user_data = await users_data.add_user(str(message.from_user.id)) if user_record is None else None
+    if new_user_data is not None:
+        user_data = new_user_data
         # Сповіщення операторів про новий чат
         notification = (
             f"🆕 <b>Новий чат створено:</b>\n"
             f"📋 <b>ID:</b> <code>{user_data['uuid']}</code>\n"
-            f"👤 <b>Ім'я:</b> {message.from_user.full_name}\n"
+            f"👤 <b>Ім'я:</b> {html.escape(message.from_user.full_name)}\n"
             f"📱 <b>Username:</b> @{message.from_user.username}"
         )
-        for operator_id in get_operator_ids():
-            try:
-                await message.bot.send_message(operator_id, notification, parse_mode="HTML")
-            except Exception as e:
-                logging.error(f"Помилка при надсиланні сповіщення оператору {operator_id}: {e}")
+        await notify_operators(message.bot, message.from_user.id, config["OPERATOR_IDS"], notification)
 
-    if 9 <= int(current_hour)+2 <= 20:
+    if is_working_hours():
         # Робочі години
         await state.set_state(ChatMode.automated)
         await message.answer(messages.main_message_online, parse_mode="HTML", reply_markup=ReplyKeyboardRemove())
-        await asyncio.sleep(30) # замінити на 30
-        await message.answer(messages.menu_message, reply_markup=get_main_keyboard(), parse_mode="HTML")
+        scheduler.send_later(message.from_user.id, 30, message.chat.id, messages.menu_message,
+                             reply_markup=get_main_keyboard(), parse_mode="HTML")
     else:
         # Неробочі години
         await state.set_state(ChatMode.waiting_urgent_help)
@@ -361,35 +673,28 @@ async def start_handler(message: Message, state: FSMContext):
 @router.message(ChatMode.waiting_urgent_help, F.text.casefold() == "так")
 async def handle_urgent_yes(message: Message, state: FSMContext):
     """Обробка термінової допомоги"""
-    user_data = await users_data.get_user_data(str(message.from_user.id))
-    if user_data is not None:
-        if user_access.is_blocked(user_data['uuid']):
-            await message.answer(
-                "❌ <b>На жаль, ваш доступ до бота обмежено.</b>",
-                parse_mode="HTML"
-            )
-            return
-
     await message.answer(messages.help_message_offline_one, parse_mode="HTML", reply_markup=ReplyKeyboardRemove())
-    # Очікуємо 15 секунд
-    await asyncio.sleep(15)
     await state.set_state(ChatMode.waiting_continue_help)
-    await message.answer(messages.help_message_offline_two, reply_markup=get_yes_no_keyboard(), parse_mode="HTML")
+    # Надсилаємо через 15 секунд
+    scheduler.send_later(message.from_user.id, 15, message.chat.id, messages.help_message_offline_two,
+                         reply_markup=get_yes_no_keyboard(), parse_mode="HTML")
     # Запускаем таймер для проверки тайм-аута
-    user_timers[message.from_user.id] = asyncio.create_task(
-        check_timeout(message.from_user.id, state, message)
-    )
+    timeouts.schedule(message.from_user.id, message.chat.id, HELP_TIMEOUT, INACTIVITY_TIMEOUT)
 
 @router.message(ChatMode.waiting_continue_help)
 async def handle_urgent_help(message: Message, state: FSMContext):
+    scheduler.cancel(message.from_user.id)
+    timeouts.cancel(message.from_user.id, HELP_TIMEOUT)
     if message.text.casefold() == "так":
-        await asyncio.sleep(1)
-        await message.answer(messages.main_message_online, parse_mode="HTML", reply_markup=ReplyKeyboardRemove())
-        await asyncio.sleep(15)
-        await message.answer(messages.start_form_message, parse_mode="HTML")
-        await asyncio.sleep(3)
-        await message.answer(messages.ask_name_form_message, parse_mode="HTML", reply_markup=get_back_keyboard())
         await state.set_state(UserForm.waiting_for_name)
+        # Анкета термінового звернення буде першою в ранковому дайджесті
+        await state.update_data(urgent=True)
+        scheduler.send_later(message.from_user.id, 1, message.chat.id, messages.main_message_online,
+                             parse_mode="HTML", reply_markup=ReplyKeyboardRemove())
+        scheduler.send_later(message.from_user.id, 16, message.chat.id, messages.start_form_message,
+                             parse_mode="HTML")
+        scheduler.send_later(message.from_user.id, 19, message.chat.id, messages.ask_name_form_message,
+                             parse_mode="HTML", reply_markup=get_back_keyboard())
     elif message.text.casefold() == "ні":
         await message.answer(
             messages.cancel_waiting_help_message,
@@ -404,83 +709,55 @@ async def handle_urgent_help(message: Message, state: FSMContext):
 @router.message(ChatMode.waiting_urgent_help, F.text.casefold() == "ні")
 async def handle_urgent_no(message: Message, state: FSMContext):
     """Обробка нетермінової допомоги"""
-    user_data = await users_data.get_user_data(str(message.from_user.id))
-    if user_data is not None:
-        if user_access.is_blocked(user_data['uuid']):
-            await message.answer(
-                "❌ <b>На жаль, ваш доступ до бота обмежено.</b>",
-                parse_mode="HTML"
-            )
-            return
-
     await state.set_state(UserForm.waiting_for_name)
     await message.answer(messages.main_message_online, parse_mode="HTML", reply_markup=ReplyKeyboardRemove())
-    await asyncio.sleep(3)
-    await message.answer(messages.start_form_message, parse_mode="HTML")
-    await asyncio.sleep(3)
-    await message.answer(messages.ask_name_form_message, parse_mode="HTML", reply_markup=get_back_keyboard())
+    scheduler.send_later(message.from_user.id, 3, message.chat.id, messages.start_form_message, parse_mode="HTML")
+    scheduler.send_later(message.from_user.id, 6, message.chat.id, messages.ask_name_form_message,
+                         parse_mode="HTML", reply_markup=get_back_keyboard())
 
     # Запускаем таймер для проверки тайм-аута
-    user_timers[message.from_user.id] = asyncio.create_task(
-        check_timeout(message.from_user.id, state, message)
-    )
+    timeouts.schedule(message.from_user.id, message.chat.id, FORM_TIMEOUT, INACTIVITY_TIMEOUT)
 
 
 @router.message(ChatMode.automated)
 async def handle_menu_choice(message: Message, state: FSMContext):
     """Обробка вибору меню та початок форми"""
-    user_data = await users_data.get_user_data(str(message.from_user.id))
-    if user_data is not None:
-        if user_access.is_blocked(user_data['uuid']):
-            await message.answer(
-                "❌ <b>На жаль, ваш доступ до бота обмежено.</b>",
-                parse_mode="HTML"
-            )
-            return
-
     if not message.text:
         await message.answer("❌ <b>Будь ласка, використовуйте текстові повідомлення</b>", parse_mode="HTML")
         return
 
     # Спочатку обробляємо спеціальні опції меню
     if "5️⃣" in message.text:
+        # Користувач вже обрав пункт меню - відкладене меню більше не потрібне
+        scheduler.cancel(message.from_user.id)
         await state.set_state(MediaForm.waiting_for_media)
         await message.answer(messages.media_message, parse_mode="HTML", reply_markup=get_back_keyboard())
         return
     elif "6️⃣" in message.text:
+        scheduler.cancel(message.from_user.id)
         await state.set_state(OtherPeopleHelpForm.waiting_for_other_people_help_message)
         await message.answer(messages.other_people_help_message, parse_mode="HTML", reply_markup=get_back_keyboard())
         return
 
     # Починаємо форму тільки для опцій меню 1-4
     if any(num in message.text for num in ["1️⃣", "2️⃣", "3️⃣", "4️⃣"]):
+        scheduler.cancel(message.from_user.id)
         await state.set_state(UserForm.waiting_for_name)
         await message.answer(messages.start_form_message, parse_mode="HTML", reply_markup=ReplyKeyboardRemove())
-        # Очікуємо 10 секунд
-        await asyncio.sleep(10)
-        await message.answer(messages.ask_name_form_message, parse_mode="HTML", reply_markup=get_back_keyboard())
+        # Надсилаємо через 10 секунд
+        scheduler.send_later(message.from_user.id, 10, message.chat.id, messages.ask_name_form_message,
+                             parse_mode="HTML", reply_markup=get_back_keyboard())
 
         # Запускаємо таймер для перевірки тайм-ауту
-        user_timers[message.from_user.id] = asyncio.create_task(
-            check_timeout(message.from_user.id, state, message)
-        )
+        timeouts.schedule(message.from_user.id, message.chat.id, FORM_TIMEOUT, INACTIVITY_TIMEOUT)
     else:
         await message.answer("❌ <b>Будь ласка, використовуйте кнопки меню</b>", parse_mode="HTML")
 
 
 
 @router.message(UserForm.waiting_for_name)
-async def process_name(message: Message, state: FSMContext):
+async def process_name(message: Message, state: FSMContext, user_record: Optional[Dict[str, Any]]):
     """Обробка імені користувача"""
-    user_data = await users_data.get_user_data(str(message.from_user.id))
-    if user_data is not None:
-        if user_access.is_blocked(user_data['uuid']):
-            await message.answer(
-                "❌ <b>На жаль, ваш доступ до бота обмежено.</b>",
-                parse_mode="HTML"
-            )
-            return
-
     if not message.text:
         await message.answer("❌ <b>Будь ласка, введіть ваше ім'я текстом</b>", parse_mode="HTML")
         return
@@ -490,36 +767,24 @@ async def process_name(message: Message, state: FSMContext):
         await state.set_state(ChatMode.automated)
         await message.answer(messages.menu_message, reply_markup=get_main_keyboard(), parse_mode="HTML")
         return
-    # Скасуємо попередній таймер
-    if message.from_user.id in user_timers:
-        user_timers[message.from_user.id].cancel()
+    # Скасуємо попередній таймер та невідправлені питання
+    timeouts.cancel(message.from_user.id, FORM_TIMEOUT)
+    scheduler.cancel(message.from_user.id)
 
     await state.update_data(name=message.text)
-    await state.update_data(uuid=user_data['uuid'])
+    await state.update_data(uuid=user_record['uuid'])
     await users_data.update_user_data(message.from_user.id, "name", message.text)
     await state.set_state(UserForm.waiting_for_age)
-    # очікуємо 3 секунд
-    await asyncio.sleep(3)
-    await message.answer(messages.ask_age_form_message, parse_mode="HTML")
+    # надсилаємо наступне питання через 3 секунди
+    scheduler.send_later(message.from_user.id, 3, message.chat.id, messages.ask_age_form_message, parse_mode="HTML")
 
     # Запускаємо новий таймер
-    user_timers[message.from_user.id] = asyncio.create_task(
-        check_timeout(message.from_user.id, state, message)
-    )
+    timeouts.schedule(message.from_user.id, message.chat.id, FORM_TIMEOUT, INACTIVITY_TIMEOUT)
 
 
 @router.message(UserForm.waiting_for_age)
 async def process_age(message: Message, state: FSMContext):
     """Обробка віку користувача"""
-    user_data = await users_data.get_user_data(str(message.from_user.id))
-    if user_data is not None:
-        if user_access.is_blocked(user_data['uuid']):
-            await message.answer(
-                "❌ <b>На жаль, ваш доступ до бота обмежено.</b>",
-                parse_mode="HTML"
-            )
-            return
-
     if not message.text:
         await message.answer("❌ <b>Будь ласка, введіть ваш вік числом</b>", parse_mode="HTML")
         return
@@ -534,21 +799,19 @@ async def process_age(message: Message, state: FSMContext):
         if age < 1 or age > 120:
             raise ValueError("Invalid age range")
 
-        # Скасуємо попередній таймер
-        if message.from_user.id in user_timers:
-            user_timers[message.from_user.id].cancel()
+        # Скасуємо попередній таймер та невідправлені питання
+        timeouts.cancel(message.from_user.id, FORM_TIMEOUT)
+        scheduler.cancel(message.from_user.id)
 
         await state.update_data(age=age)
         await users_data.update_user_data(message.from_user.id, "age", age)
-        # очікуємо 3 секунд
-        await asyncio.sleep(3)
         await state.set_state(UserForm.waiting_for_location)
-        await message.answer(messages.ask_geo_form_message, parse_mode="HTML")
+        # надсилаємо наступне питання через 3 секунди
+        scheduler.send_later(message.from_user.id, 3, message.chat.id, messages.ask_geo_form_message,
+                             parse_mode="HTML")
 
         # Запускаємо новий таймер
-        user_timers[message.from_user.id] = asyncio.create_task(
-            check_timeout(message.from_user.id, state, message)
-        )
+        timeouts.schedule(message.from_user.id, message.chat.id, FORM_TIMEOUT, INACTIVITY_TIMEOUT)
     except ValueError:
         await message.answer("❌ <b>Будь ласка, введіть коректний вік числом</b>", parse_mode="HTML")
 
@@ -556,15 +819,6 @@ async def process_age(message: Message, state: FSMContext):
 @router.message(UserForm.waiting_for_location)
 async def process_location(message: Message, state: FSMContext):
     """Обробка місцезнаходження користувача"""
-    user_data = await users_data.get_user_data(str(message.from_user.id))
-    if user_data is not None:
-        if user_access.is_blocked(user_data['uuid']):
-            await message.answer(
-                "❌ <b>На жаль, ваш доступ до бота обмежено.</b>",
-                parse_mode="HTML"
-            )
-            return
-
     if not message.text:
         await message.answer("❌ <b>Будь ласка, введіть ваше місцезнаходження текстом</b>", parse_mode="HTML")
         return
@@ -573,35 +827,24 @@ async def process_location(message: Message, state: FSMContext):
         await state.set_state(ChatMode.automated)
         await message.answer(messages.menu_message, reply_markup=get_main_keyboard(), parse_mode="HTML")
         return
-    # Скасуємо попередній таймер
-    if message.from_user.id in user_timers:
-        user_timers[message.from_user.id].cancel()
+    # Скасуємо попередній таймер та невідправлені питання
+    timeouts.cancel(message.from_user.id, FORM_TIMEOUT)
+    scheduler.cancel(message.from_user.id)
 
     await state.update_data(location=message.text)
     await users_data.update_user_data(message.from_user.id, "location", message.text)
     await state.set_state(UserForm.waiting_for_event_details)
-    # очікуємо 3 секунд
-    await asyncio.sleep(3)
-    await message.answer(messages.ask_where_form_message, parse_mode="HTML")
+    # надсилаємо наступне питання через 3 секунди
+    scheduler.send_later(message.from_user.id, 3, message.chat.id, messages.ask_where_form_message,
+                         parse_mode="HTML")
 
     # Запускаємо новий таймер
-    user_timers[message.from_user.id] = asyncio.create_task(
-        check_timeout(message.from_user.id, state, message)
-    )
+    timeouts.schedule(message.from_user.id, message.chat.id, FORM_TIMEOUT, INACTIVITY_TIMEOUT)
 
 
 @router.message(UserForm.waiting_for_event_details)
 async def process_event_details(message: Message, state: FSMContext):
     """Обробка деталей події"""
-    user_data = await users_data.get_user_data(str(message.from_user.id))
-    if user_data is not None:
-        if user_access.is_blocked(user_data['uuid']):
-            await message.answer(
-                "❌ <b>На жаль, ваш доступ до бота обмежено.</b>",
-                parse_mode="HTML"
-            )
-            return
-
     if not message.text:
         await message.answer("❌ <b>Будь ласка, опишіть деталі події текстом</b>", parse_mode="HTML")
         return
@@ -610,35 +853,24 @@ async def process_event_details(message: Message, state: FSMContext):
         await state.set_state(ChatMode.automated)
         await message.answer(messages.menu_message, reply_markup=get_main_keyboard(), parse_mode="HTML")
         return
-    # Скасуємо попередній таймер
-    if message.from_user.id in user_timers:
-        user_timers[message.from_user.id].cancel()
+    # Скасуємо попередній таймер та невідправлені питання
+    timeouts.cancel(message.from_user.id, FORM_TIMEOUT)
+    scheduler.cancel(message.from_user.id)
 
     await state.update_data(event_details=message.text)
     await users_data.update_user_data(message.from_user.id, "event_details", message.text)
     await state.set_state(UserForm.waiting_for_help_type)
-    # очікуємо 3 секунд
-    await asyncio.sleep(3)
-    await message.answer(messages.ask_what_form_message, parse_mode="HTML")
+    # надсилаємо наступне питання через 3 секунди
+    scheduler.send_later(message.from_user.id, 3, message.chat.id, messages.ask_what_form_message,
+                         parse_mode="HTML")
 
     # Запускаємо новий таймер
-    user_timers[message.from_user.id] = asyncio.create_task(
-        check_timeout(message.from_user.id, state, message)
-    )
+    timeouts.schedule(message.from_user.id, message.chat.id, FORM_TIMEOUT, INACTIVITY_TIMEOUT)
 
 
 @router.message(UserForm.waiting_for_help_type)
-async def process_help_type(message: Message, state: FSMContext):
+async def process_help_type(message: Message, state: FSMContext, config: Dict[str, Any]):
     """Обробка типу допомоги"""
-    user_data = await users_data.get_user_data(str(message.from_user.id))
-    if user_data is not None:
-        if user_access.is_blocked(user_data['uuid']):
-            await message.answer(
-                "❌ <b>На жаль, ваш доступ до бота обмежено.</b>",
-                parse_mode="HTML"
-            )
-            return
-
     if not message.text:
         await message.answer("❌ <b>Будь ласка, опишіть потрібну допомогу текстом</b>", parse_mode="HTML")
         return
@@ -647,27 +879,18 @@ async def process_help_type(message: Message, state: FSMContext):
         await state.set_state(ChatMode.automated)
         await message.answer(messages.menu_message, reply_markup=get_main_keyboard(), parse_mode="HTML")
         return
-    # Скасуємо попередній таймер
-    if message.from_user.id in user_timers:
-        user_timers[message.from_user.id].cancel()
+    # Скасуємо попередній таймер та невідправлені питання
+    timeouts.cancel(message.from_user.id, FORM_TIMEOUT)
+    scheduler.cancel(message.from_user.id)
 
     await state.update_data(help_type=message.text)
     await users_data.update_user_data(message.from_user.id, "help_type", message.text)
 
-    await process_description(message, state)
+    await process_description(message, state, config)
 
 
-async def process_description(message: Message, state: FSMContext):
+async def process_description(message: Message, state: FSMContext, config: Dict[str, Any]):
     """Обробка опису та завершення форми"""
-    user_data = await users_data.get_user_data(str(message.from_user.id))
-    if user_data is not None:
-        if user_access.is_blocked(user_data['uuid']):
-            await message.answer(
-                "❌ <b>На жаль, ваш доступ до бота обмежено.</b>",
-                parse_mode="HTML"
-            )
-            return
-
     if not message.text:
         await message.answer("❌ <b>Будь ласка, надайте опис текстом</b>", parse_mode="HTML")
         return
@@ -677,13 +900,13 @@ async def process_description(message: Message, state: FSMContext):
         await message.answer(messages.menu_message, reply_markup=get_main_keyboard(), parse_mode="HTML")
         return
     # Скасуємо таймер при завершенні форми
-    if message.from_user.id in user_timers:
-        user_timers[message.from_user.id].cancel()
-        del user_timers[message.from_user.id]
+    timeouts.cancel(message.from_user.id, FORM_TIMEOUT)
 
     user_data = await state.get_data()
     await state.update_data(description=message.text)
     await users_data.update_user_data(message.from_user.id, "description", message.text)
+    # Форма завершена - записуємо всі відповіді одразу
+    await users_data.flush()
     # Надсилаємо сповіщення про завершення форми операторам
     notification = (
         f"📋 <b>Форма заповнена:</b>\n\n"
@@ -695,11 +918,11 @@ async def process_description(message: Message, state: FSMContext):
         f"🆘 <b>Тип допомоги:</b> {user_data['help_type']}"
     )
 
-    for operator_id in get_operator_ids():
-        try:
-            await message.bot.send_message(operator_id, notification, parse_mode="HTML")
-        except Exception as e:
-            logging.error(f"Помилка при надсиланні сповіщення оператору {operator_id}: {e}")
+    if is_working_hours():
+        await notify_operators(message.bot, message.from_user.id, await ticket_recipients(message), notification)
+    else:
+        # Оператори не на зміні - анкета потрапить у дайджест на початку зміни
+        await inbox.add(message.from_user.id, user_data.get('urgent', False))
 
     # Встановлюємо ручний режим чату та надсилаємо фінальне повідомлення
     await state.set_state(ChatMode.manual)
@@ -707,17 +930,9 @@ async def process_description(message: Message, state: FSMContext):
 
 
 @router.message(MediaForm.waiting_for_media)
-async def process_media(message: Message, state: FSMContext):
+async def process_media(message: Message, state: FSMContext, config: Dict[str, Any],
+                        user_record: Optional[Dict[str, Any]]):
     """Обробка повідомленнь від представників організацій та медіа"""
-    user_data = await users_data.get_user_data(str(message.from_user.id))
-    if user_data is not None:
-        if user_access.is_blocked(user_data['uuid']):
-            await message.answer(
-                "❌ <b>На жаль, ваш доступ до бота обмежено.</b>",
-                parse_mode="HTML",
-                reply_markup=get_back_keyboard()
-            )
-            return
     print(message.text)
     if "🔙" in message.text:
         await state.clear()
@@ -725,7 +940,7 @@ async def process_media(message: Message, state: FSMContext):
         await message.answer(messages.menu_message, reply_markup=get_main_keyboard(), parse_mode="HTML")
         return
     # Пересилаємо заяву операторам
-    await forward_to_operators(message, "Представкник організації/медіа")
+    await forward_to_operators(message, await ticket_recipients(message), "Представкник організації/медіа", user_record)
 
     # Встановлюємо ручний режим для подальшого спілкування
     await state.set_state(ChatMode.manual)
@@ -738,17 +953,9 @@ async def process_media(message: Message, state: FSMContext):
 
 
 @router.message(OtherPeopleHelpForm.waiting_for_other_people_help_message)
-async def process_other_people_help(message: Message, state: FSMContext):
+async def process_other_people_help(message: Message, state: FSMContext, config: Dict[str, Any],
+                                    user_record: Optional[Dict[str, Any]]):
     """Обробка повідомлення про допомогу іншим"""
-    user_data = await users_data.get_user_data(str(message.from_user.id))
-    if user_data is not None:
-        if user_access.is_blocked(user_data['uuid']):
-            await message.answer(
-                "❌ <b>На жаль, ваш доступ до бота обмежено.</b>",
-                parse_mode="HTML"
-            )
-            return
-
     if not message.text:
         await message.answer(
             "❌ <b>Будь ласка, опишіть ситуацію текстовим повідомленням</b>",
@@ -765,8 +972,8 @@ async def process_other_people_help(message: Message, state: FSMContext):
 
 
     # Пересилаємо повідомлення операторам
-    if message.from_user.id not in get_operator_ids():
-        await forward_to_operators(message, "Допомога іншим")
+    if message.from_user.id not in config["OPERATOR_IDS"]:
+        await forward_to_operators(message, await ticket_recipients(message), "Допомога іншим", user_record)
         await message.answer(
             "✅ <b>Ваше повідомлення передано координатору.</b>\nОчікуйте на відповідь.",
             parse_mode="HTML",
@@ -774,21 +981,20 @@ async def process_other_people_help(message: Message, state: FSMContext):
         )
 
 
-@router.message(lambda message: message.text and message.from_user.id in user_timers)
-async def handle_continue_response(message: Message, state: FSMContext):
+@router.message(StateFilter("waiting_continue"), F.text)
+async def handle_continue_response(message: Message, state: FSMContext, config: Dict[str, Any],
+                                   user_record: Optional[Dict[str, Any]]):
     """Обробка відповіді на запитання щодо продовження заповнення форми"""
     current_state = await state.get_state()
 
     if current_state == "waiting_continue":
         if message.text.lower() == "ні":
             # Якщо відповідь "Ні", скасовуємо форму
-            if message.from_user.id in user_timers:
-                user_timers[message.from_user.id].cancel()
-                del user_timers[message.from_user.id]
+            timeouts.cancel(message.from_user.id, FORM_TIMEOUT)
             await state.clear()
             await message.answer(messages.cancel_form_message, parse_mode="HTML", reply_markup=get_back_keyboard())
-            await asyncio.sleep(2)
-            await message.answer(
+            scheduler.send_later(
+                message.from_user.id, 2, message.chat.id,
                 "❌ <b>Заповнення форми скасовано.</b>\n"
                 "Щоб почати спочатку, використайте команду /start або через кнопку повернення",
                 parse_mode="HTML",
@@ -819,14 +1025,12 @@ async def handle_continue_response(message: Message, state: FSMContext):
                                      reply_markup=get_back_keyboard())
 
             # Запускаємо новий таймер
-            user_timers[message.from_user.id] = asyncio.create_task(
-                check_timeout(message.from_user.id, state, message)
-            )
+            timeouts.schedule(message.from_user.id, message.chat.id, FORM_TIMEOUT, INACTIVITY_TIMEOUT)
         else:
             # якщо відповіть не "так" чи "ні" записуємо її в анкету
             user_data = await state.get_data()
             if 'name' not in user_data:
-                await process_name(message, state)
+                await process_name(message, state, user_record)
             elif 'age' not in user_data:
                 await process_age(message, state)
             elif 'location' not in user_data:
@@ -834,38 +1038,27 @@ async def handle_continue_response(message: Message, state: FSMContext):
             elif 'event_details' not in user_data:
                 await process_event_details(message, state)
             elif 'help_type' not in user_data:
-                await process_help_type(message, state)
+                await process_help_type(message, state, config)
 
 
 
 
 
 @router.message(ChatMode.manual)
-async def handle_manual_mode(message: Message):
+async def handle_manual_mode(message: Message, config: Dict[str, Any],
+                             user_record: Optional[Dict[str, Any]]):
     """Обробка повідомлень в ручному режимі"""
-    user_data = await users_data.get_user_data(str(message.from_user.id))
-    if user_data is not None:
-        if user_access.is_blocked(user_data['uuid']):
-            await message.answer(
-                "❌ <b>На жаль, ваш доступ до бота обмежено.</b>",
-                parse_mode="HTML"
-            )
-            return
-
-    if message.from_user.id not in get_operator_ids():
+    if message.from_user.id not in config["OPERATOR_IDS"]:
         # Якщо повідомлення від користувача, пересилаємо його операторам
-        await forward_to_operators(message, "Повідомлення з ручного режиму")
+        await forward_to_operators(message, await ticket_recipients(message), "Повідомлення з ручного режиму", user_record)
 
 
 # Обробник для відповідей операторів
-@router.message(lambda message: message.from_user.id in get_operator_ids() and message.reply_to_message is not None)
+@router.message(lambda message, config: message.from_user.id in config["OPERATOR_IDS"] and message.reply_to_message is not None)
 async def handle_operator_reply(message: Message):
     """Обробка відповідей операторів на повідомлення"""
     # Отримуємо ID користувача з оригінального повідомлення
-    try:
-        user_id, user_uuid = await extract_user_id(message.reply_to_message)
-    except TypeError:
-        user_id = await extract_user_id(message.reply_to_message)
+    user_id, user_uuid = await extract_user_id(message.reply_to_message)
 
     if user_id:
         # Пересилаємо відповідь користувачу
@@ -875,26 +1068,16 @@ async def handle_operator_reply(message: Message):
             parse_mode="HTML"
         )
     else:
-        await message.answer(
-            "❌ <b>Не вдалося визначити ID користувача для відповіді</b>",
-            parse_mode="HTML"
-        )
+        await message.answer(REPLY_TARGET_UNKNOWN, parse_mode="HTML")
 
 
 # Обробник для нетекстових повідомлень
 @router.message(lambda message: not message.text)
-async def handle_non_text(message: Message):
+async def handle_non_text(message: Message, config: Dict[str, Any],
+                          user_record: Optional[Dict[str, Any]]):
     """Обробка нетекстових повідомлень"""
-    user_data = await users_data.get_user_data(str(message.from_user.id))
-    if user_access.is_blocked(user_data['uuid']):
-        await message.answer(
-            "❌ <b>На жаль, ваш доступ до бота обмежено.</b>",
-            parse_mode="HTML"
-        )
-        return
-
     # Якщо повідомлення від оператора і це відповідь
-    if message.from_user.id in get_operator_ids() and message.reply_to_message:
+    if message.from_user.id in config["OPERATOR_IDS"] and message.reply_to_message:
         user_id, user_uuid = await extract_user_id(message.reply_to_message)
         if user_id:
             await forward_to_user(message, user_id)
@@ -902,11 +1085,13 @@ async def handle_non_text(message: Message):
                 f"✅ <b>Медіа надіслано користувачу</b> <code>{user_uuid}</code>",
                 parse_mode="HTML"
             )
-            return
+        else:
+            await message.answer(REPLY_TARGET_UNKNOWN, parse_mode="HTML")
+        return
 
     # Для звичайних користувачів
-    if message.from_user.id not in get_operator_ids():
-        await forward_to_operators(message, "Медіа повідомлення")
+    if message.from_user.id not in config["OPERATOR_IDS"]:
+        await forward_to_operators(message, await ticket_recipients(message), "Медіа повідомлення", user_record)
         await message.answer(
             "✅ <b>Ваше медіа повідомлення передано координатору</b>",
             parse_mode="HTML"
@@ -0,0 +1,146 @@
+import html
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.types import Message
+
+from .users_data import UsersData
+from .write_behind import WriteBehind
+
+
+# Напрямки повідомлень в історії
+INCOMING = "in"   # користувач -> оператори
+OUTGOING = "out"  # оператор -> користувач
+
+# Максимальна довжина одного повідомлення на сторінці історії
+HISTORY_TEXT_LIMIT = 300
+
+
+def build_search_query(text: str) -> str:
+    """
+    Перетворення тексту оператора на запит FTS5
+
+    Кожне слово береться в лапки, тому спецсимволи FTS5 не інтерпретуються.
+    Слово з * в кінці шукається за префіксом (різні закінчення слова),
+    інші - точно: точний пошук читає індекс від найновіших повідомлень
+    і зупиняється на першій сторінці, пошук за префіксом об'єднує всі слова з цим префіксом.
+
+    :param text: текст пошуку
+    :return: запит FTS5 або порожній рядок
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word.strip('"'):
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return " ".join(terms)
+
+
+class MessageHistory:
+    """
+    Історія переписки користувачів з операторами
+
+    Повідомлення накопичуються в буфері та записуються в таблицю messages
+    пакетом (з інтервалом або при заповненні буфера), тому пересилання
+    не чекає на запис у базу. Текст індексується FTS5 тригерами в базі.
+    """
+
+    def __init__(self, users_data: UsersData) -> None:
+        """
+        Ініціалізація
+
+        Використовує змінні середовища:
+        HISTORY_FLUSH_INTERVAL: Інтервал пакетного запису історії у секундах (за замовчуванням 1)
+        HISTORY_BATCH_SIZE: Кількість повідомлень у буфері, після якої пакет записується одразу (за замовчуванням 500)
+        HISTORY_PAGE_SIZE: Кількість повідомлень на сторінці /history та /search (за замовчуванням 10)
+
+        :param users_data: сховище історії
+        """
+        self.users_data = users_data
+        self.flush_interval = float(os.getenv('HISTORY_FLUSH_INTERVAL', 1))
+        self.batch_size = int(os.getenv('HISTORY_BATCH_SIZE', 500))
+        self.page_size = int(os.getenv('HISTORY_PAGE_SIZE', 10))
+        self._buffer: List[Tuple[str, str, Optional[int], str, Optional[str], float]] = []
+        self._write_behind = WriteBehind(self.flush, self.flush_interval)
+
+    def add(self, telegram_user_id, message: Message, direction: str, operator_id: Optional[int] = None) -> None:
+        """
+        Додавання повідомлення в історію (запис у базу відбувається пакетом)
+
+        :param telegram_user_id: ID користувача
+        :param message: повідомлення
+        :param direction: INCOMING або OUTGOING
+        :param operator_id: ID оператора для відповідей операторів
+        """
+        self._buffer.append((
+            str(telegram_user_id), direction, operator_id, message.content_type.value,
+            message.text or message.caption, time.time(),
+        ))
+        if len(self._buffer) >= self.batch_size:
+            self._write_behind.flush_soon()
+        else:
+            self._write_behind.schedule()
+
+    async def flush(self) -> None:
+        """Запис усіх накопичених повідомлень однією транзакцією"""
+        if not self._buffer:
+            return
+        rows, self._buffer = self._buffer, []
+        if not await self.users_data.add_messages(rows):
+            # повертаємо пакет у буфер, порядок повідомлень зберігається
+            self._buffer = rows + self._buffer
+            self._write_behind.schedule()
+
+    async def close(self) -> None:
+        """Запис буфера перед зупинкою бота (після завершення записів, що вже виконуються)"""
+        await self._write_behind.close()
+
+    async def page(self, telegram_user_id, page: int) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Сторінка історії користувача
+
+        :param telegram_user_id: ID користувача
+        :param page: номер сторінки, починаючи з 1 (1 - найновіші повідомлення)
+        :return: кількість сторінок та повідомлення сторінки
+        """
+        await self.flush()
+        total, rows = await self.users_data.get_messages(
+            str(telegram_user_id), self.page_size, (page - 1) * self.page_size
+        )
+        return max(1, -(-total // self.page_size)), rows
+
+    async def search(self, text: str, page: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Пошук в історії всіх користувачів
+
+        :param text: текст пошуку
+        :param page: номер сторінки, починаючи з 1
+        :return: знайдені повідомлення та ознака наступної сторінки
+        """
+        query = build_search_query(text)
+        if not query:
+            return [], False
+        await self.flush()
+        # одне зайве повідомлення показує, чи є наступна сторінка, без підрахунку всіх збігів
+        rows = await self.users_data.search_messages(query, self.page_size + 1, (page - 1) * self.page_size)
+        return rows[:self.page_size], len(rows) > self.page_size
+
+    @staticmethod
+    def format_entry(entry: Dict[str, Any], with_uuid: bool = False) -> str:
+        """Форматування одного повідомлення історії"""
+        created = datetime.fromtimestamp(entry['created_at']).strftime('%d.%m %H:%M')
+        if entry['direction'] == OUTGOING:
+            author = f"🎧 <code>{entry['operator_id']}</code>"
+        else:
+            author = "👤"
+        text = entry['text'] or ''
+        if len(text) > HISTORY_TEXT_LIMIT:
+            text = text[:HISTORY_TEXT_LIMIT] + "…"
+        text = html.escape(text)
+        if entry['content_type'] != 'text':
+            text = f"<i>[{entry['content_type']}]</i> {text}".rstrip()
+        uuid = f" <code>{entry.get('uuid') or '—'}</code>" if with_uuid else ""
+        return f"{created}{uuid} {author} {text}"
@@ -0,0 +1,183 @@
+import asyncio
+import html
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot
+
+from .fanout import fanout
+from .middleware import OperatorRegistry
+from .users_data import UsersData
+
+
+# Робочі години координаторів
+WORK_HOURS_START = 9
+WORK_HOURS_END = 20
+# Зміщення годинника сервера відносно київського часу
+TIMEZONE_OFFSET = 2
+
+# Максимальна довжина сторінки дайджесту (ліміт Telegram - 4096 символів)
+DIGEST_PAGE_LENGTH = 3500
+# Сторінка дайджесту містить анкети різних користувачів, тому відповідь на неї не пересилається
+DIGEST_FOOTER = (
+    "\n\n↩️ <i>Відповідь на дайджест не надсилається користувачу: "
+    "відкрийте анкету командою /form ID і відповідайте на неї</i>"
+)
+
+
+def is_working_hours(now: Optional[datetime] = None) -> bool:
+    """
+    Перевірка робочих годин координаторів
+
+    :param now: поточний час сервера
+    :return: True якщо зараз робочі години
+    """
+    hour = (now or datetime.now()).hour
+    return WORK_HOURS_START <= hour + TIMEZONE_OFFSET <= WORK_HOURS_END
+
+
+class OffHoursInbox:
+    """
+    Вхідні анкети, заповнені в неробочий час
+
+    Замість окремого сповіщення кожному оператору вночі анкета зберігається
+    в таблиці inbox. На початку зміни кожен оператор отримує один дайджест
+    (розбитий на сторінки) з усіма анкетами, що очікують: спочатку термінові,
+    потім за часом створення. Дайджест будується одним запитом.
+    """
+
+    def __init__(self, users_data: UsersData) -> None:
+        """
+        Ініціалізація
+
+        Використовує змінні середовища:
+        INBOX_CHECK_INTERVAL: Інтервал перевірки початку зміни у секундах (за замовчуванням 60)
+        DIGEST_PAGE_SIZE: Кількість анкет на одній сторінці дайджесту (за замовчуванням 10)
+
+        :param users_data: сховище анкет
+        """
+        self.users_data = users_data
+        self.check_interval = float(os.getenv('INBOX_CHECK_INTERVAL', 60))
+        self.page_size = int(os.getenv('DIGEST_PAGE_SIZE', 10))
+        # Кількість недоставлених анкет, щоб не звертатися до бази, поки їх немає
+        self.pending = 0
+        self._runner: Optional[asyncio.Task] = None
+
+    async def load(self) -> None:
+        """Підрахунок недоставлених анкет (викликається при запуску бота)"""
+        self.pending = len(await self.users_data.get_pending_inbox())
+
+    def start(self, bot: Bot, operators: OperatorRegistry) -> None:
+        """
+        Запуск фонової задачі доставки дайджестів
+
+        :param bot: бот для надсилання
+        :param operators: реєстр операторів
+        """
+        self._runner = asyncio.create_task(self._run(bot, operators))
+
+    async def stop(self) -> None:
+        """Зупинка фонової задачі"""
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+
+    async def add(self, telegram_user_id, urgent: bool) -> None:
+        """
+        Збереження анкети до початку зміни
+
+        :param telegram_user_id: ID користувача
+        :param urgent: користувач просив термінову допомогу
+        """
+        await self.users_data.add_inbox_entry(telegram_user_id, urgent)
+        self.pending += 1
+
+    async def _run(self, bot: Bot, operators: OperatorRegistry) -> None:
+        """Фонова задача: доставка дайджесту, коли починаються робочі години"""
+        while True:
+            if self.pending and is_working_hours():
+                try:
+                    await self.deliver(bot, operators)
+                except Exception as e:
+                    logging.error(f"Помилка при надсиланні дайджесту: {e}")
+            await asyncio.sleep(self.check_interval)
+
+    async def deliver(self, bot: Bot, operators: OperatorRegistry) -> int:
+        """
+        Надсилання дайджесту всім операторам та позначення анкет доставленими
+
+        :param bot: бот для надсилання
+        :param operators: реєстр операторів
+        :return: кількість доставлених анкет
+        """
+        entries = await self.users_data.get_pending_inbox()
+        if not entries:
+            self.pending = 0
+            return 0
+        pages = self.build_pages(entries)
+
+        async def send(operator_id: int):
+            for page in pages:
+                await bot.send_message(operator_id, page, parse_mode="HTML")
+            return True
+
+        results = await fanout.send(operators, send)
+        if not any(results.values()):
+            # жоден оператор не отримав дайджест - спробуємо пізніше
+            return 0
+        await self.users_data.mark_inbox_delivered([entry['id'] for entry in entries])
+        self.pending = max(0, self.pending - len(entries))
+        logging.info(f"Дайджест з {len(entries)} анкет надіслано {sum(1 for r in results.values() if r)} операторам")
+        return len(entries)
+
+    def build_pages(self, entries: List[Dict[str, Any]]) -> List[str]:
+        """
+        Розбиття анкет на сторінки дайджесту
+
+        :param entries: анкети у порядку пріоритету
+        :return: тексти сторінок
+        """
+        blocks = [self._format_entry(number, entry) for number, entry in enumerate(entries, start=1)]
+        chunks: List[List[str]] = [[]]
+        length = 0
+        for block in blocks:
+            if chunks[-1] and (len(chunks[-1]) >= self.page_size or length + len(block) > DIGEST_PAGE_LENGTH):
+                chunks.append([])
+                length = 0
+            chunks[-1].append(block)
+            length += len(block)
+
+        urgent = sum(1 for entry in entries if entry['urgent'])
+        pages = []
+        for index, chunk in enumerate(chunks, start=1):
+            header = (
+                f"🌙 <b>Анкети за неробочий час</b> (сторінка {index}/{len(chunks)})\n"
+                f"📋 <b>Всього:</b> {len(entries)}, 🆘 <b>термінових:</b> {urgent}\n\n"
+            )
+            pages.append(header + "\n\n".join(chunk) + DIGEST_FOOTER)
+        return pages
+
+    @staticmethod
+    def _format_entry(number: int, entry: Dict[str, Any]) -> str:
+        """Форматування однієї анкети для дайджесту"""
+        def field(name: str, limit: int = 300) -> str:
+            value = str(entry.get(name) or '—')
+            if len(value) > limit:
+                value = value[:limit] + "…"
+            return html.escape(value)
+
+        created = datetime.fromtimestamp(entry['created_at']).strftime('%d.%m %H:%M')
+        marker = "🆘 <b>ТЕРМІНОВО</b> " if entry['urgent'] else ""
+        return (
+            f"{number}. {marker}📌 <b>Анкета</b> <code>{field('uuid')}</code> ({created})\n"
+            f"👤 {field('name', 100)}, 📅 {field('age')}, 📍 {field('location', 100)}\n"
+            f"🔍 {field('event_details')}\n"
+            f"🆘 {field('help_type', 100)}\n"
+            f"📝 {field('description')}"
+        )
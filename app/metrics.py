@@ -0,0 +1,272 @@
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import Message, Update
+from aiogram.types.update import UpdateTypeLookupError
+from aiohttp import web
+
+
+# Межі кошиків гістограм затримки у секундах
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Гістограма з наперед виділеними кошиками"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        # останній кошик - значення більші за всі межі (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """
+        Облік одного значення
+
+        :param value: значення (секунди)
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Оцінка квантиля за кошиками (верхня межа кошика)
+
+        :param q: квантиль від 0 до 1
+        :return: межа кошика у секундах (inf, якщо значення більше за всі межі)
+        """
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+
+class HistogramFamily:
+    """Набір гістограм з однією міткою (наприклад, по одній на обробник)"""
+
+    def __init__(self, name: str, help_text: str, label: str) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        # значення мітки -> гістограма, створюється один раз при першому значенні
+        self._children: Dict[str, Histogram] = {}
+
+    def observe(self, label_value: str, value: float) -> None:
+        """
+        Облік значення для мітки
+
+        :param label_value: значення мітки
+        :param value: значення (секунди)
+        """
+        histogram = self._children.get(label_value)
+        if histogram is None:
+            histogram = self._children[label_value] = Histogram()
+        histogram.observe(value)
+
+    def get(self, label_value: str) -> Optional[Histogram]:
+        """
+        Гістограма для мітки
+
+        :param label_value: значення мітки
+        :return: гістограма або None, якщо значень ще не було
+        """
+        return self._children.get(label_value)
+
+    def render(self) -> List[str]:
+        """Текст у форматі Prometheus"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_value, histogram in sorted(self._children.items()):
+            label = f'{self.label}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {histogram.count}')
+            lines.append(f"{self.name}_sum{{{label}}} {histogram.sum}")
+            lines.append(f"{self.name}_count{{{label}}} {histogram.count}")
+        return lines
+
+
+class CounterFamily:
+    """Набір лічильників з однією міткою"""
+
+    def __init__(self, name: str, help_text: str, label: str) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values: Dict[str, int] = {}
+
+    def inc(self, label_value: str) -> None:
+        """
+        Збільшення лічильника
+
+        :param label_value: значення мітки
+        """
+        self._values[label_value] = self._values.get(label_value, 0) + 1
+
+    def render(self) -> List[str]:
+        """Текст у форматі Prometheus"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_value, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{{{self.label}="{_escape(label_value)}"}} {value}')
+        return lines
+
+
+def _escape(value: str) -> str:
+    """Екранування значення мітки"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """
+    Метрики бота
+
+    Гістограми затримки оновлень, обробників, станів FSM, запитів до бази,
+    запитів до Bot API та очікування в черзі вихідних повідомлень. Показники інших компонентів (черги, кеші)
+    реєструються як gauge і читаються лише під час запиту /metrics.
+    """
+
+    def __init__(self) -> None:
+        self.updates = HistogramFamily(
+            "bot_update_duration_seconds", "Час обробки оновлення", "type")
+        self.handlers = HistogramFamily(
+            "bot_handler_duration_seconds", "Час роботи обробника повідомлень", "handler")
+        self.states = HistogramFamily(
+            "bot_state_duration_seconds", "Час обробки повідомлення в стані FSM", "state")
+        self.db = HistogramFamily(
+            "bot_db_query_duration_seconds", "Час запиту до бази данних", "operation")
+        self.api = HistogramFamily(
+            "bot_api_request_duration_seconds", "Час запиту до Bot API", "method")
+        self.outbound_wait = HistogramFamily(
+            "bot_outbound_wait_seconds", "Час очікування запиту в черзі вихідних повідомлень", "lane")
+        self.api_errors = CounterFamily(
+            "bot_api_errors_total", "Кількість помилок запитів до Bot API", "method")
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+        self._gauge_groups: Dict[str, Tuple[str, Callable[[], Dict[str, float]]]] = {}
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float]) -> None:
+        """
+        Реєстрація показника, що читається під час запиту метрик
+
+        :param name: назва метрики
+        :param help_text: опис
+        :param read: функція, що повертає поточне значення
+        """
+        self._gauges[name] = (help_text, read)
+
+    def gauges(self, prefix: str, help_text: str, read: Callable[[], Dict[str, float]]) -> None:
+        """
+        Реєстрація групи показників з одного словника статистики (наприклад, stats() компонента)
+
+        :param prefix: префікс назв метрик, ключ словника додається через "_"
+        :param help_text: опис
+        :param read: функція, що повертає словник поточних значень
+        """
+        self._gauge_groups[prefix] = (help_text, read)
+
+    def render(self) -> str:
+        """
+        Усі метрики у текстовому форматі Prometheus
+
+        :return: текст для відповіді /metrics
+        """
+        lines: List[str] = []
+        for family in (self.updates, self.handlers, self.states, self.db, self.api, self.outbound_wait,
+                       self.api_errors):
+            lines.extend(family.render())
+        gauges = [(name, help_text, read()) for name, (help_text, read) in self._gauges.items()]
+        for prefix, (help_text, read) in self._gauge_groups.items():
+            gauges.extend((f"{prefix}_{key}", help_text, value) for key, value in read().items())
+        for name, help_text, value in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Обробник HTTP запиту метрик"""
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Час обробки кожного оновлення (зовнішній middleware оновлень)"""
+
+    def __init__(self, registry: Metrics) -> None:
+        self.registry = registry
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            try:
+                update_type = event.event_type
+            except UpdateTypeLookupError:
+                update_type = "unknown"
+            self.registry.updates.observe(update_type, time.perf_counter() - started)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Час роботи обробника та стану FSM (внутрішній middleware повідомлень)"""
+
+    def __init__(self, registry: Metrics) -> None:
+        self.registry = registry
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any]
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.registry.handlers.observe(data["handler"].callback.__name__, elapsed)
+            self.registry.states.observe(data.get("raw_state") or "none", elapsed)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Час запитів до Bot API (middleware сесії бота)"""
+
+    def __init__(self, registry: Metrics) -> None:
+        self.registry = registry
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            self.registry.api_errors.inc(name)
+            raise
+        finally:
+            self.registry.api.observe(name, time.perf_counter() - started)
+
+
+# Створюємо глобальний екземпляр метрик
+metrics = Metrics()
@@ -1,41 +1,185 @@
-from typing import Any, Awaitable, Callable, Dict, List
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Iterator, List, Optional, Tuple
+from collections import OrderedDict
 from aiogram import BaseMiddleware
 from aiogram.types import Message
-from cachetools import TTLCache
 from datetime import datetime
+import asyncio
+import logging
 import os
+import time
 
-def get_operator_ids() -> List[int]:
+from .user_access import UserAccess
+from .users_data import UsersData
+
+def parse_operator_ids(operator_ids_str: str) -> List[int]:
     """
-    Отримання списку ID операторів з змінної середовища
-    
-    Формат OPERATOR_IDS: "id1,id2,id3" (через кому)
+    Розбір списку ID операторів
+
+    Формат: "id1,id2,id3" (через кому або з нового рядка)
     """
-    operator_ids_str = os.getenv('OPERATOR_IDS', '')
-    if not operator_ids_str:
-        return []
     try:
-        return [int(op_id.strip()) for op_id in operator_ids_str.split(',') if op_id.strip()]
+        return [int(op_id.strip()) for op_id in operator_ids_str.replace('\n', ',').split(',') if op_id.strip()]
     except ValueError:
         return []
 
+
+class OperatorRegistry:
+    """
+    Реєстр операторів, створюється один раз при запуску
+
+    ID операторів зберігаються у frozenset для перевірки за O(1).
+    Якщо задано OPERATOR_IDS_FILE, список читається з файлу та
+    перечитується при зміні часу модифікації файлу.
+    """
+
+    def __init__(self, config_file: Optional[str] = None) -> None:
+        """
+        Ініціалізація реєстру
+
+        Використовує змінні середовища:
+        OPERATOR_IDS: ID операторів через кому
+        OPERATOR_IDS_FILE: Файл з ID операторів (має пріоритет над OPERATOR_IDS)
+        OPERATOR_IDS_POLL_INTERVAL: Інтервал перевірки змін файлу у секундах (за замовчуванням 30)
+
+        :param config_file: шлях до файлу з ID операторів
+        """
+        self.config_file = config_file or os.getenv('OPERATOR_IDS_FILE')
+        self.poll_interval = int(os.getenv('OPERATOR_IDS_POLL_INTERVAL', 30))
+        self._ids: FrozenSet[int] = frozenset(parse_operator_ids(os.getenv('OPERATOR_IDS', '')))
+        self._ordered: tuple = tuple(sorted(self._ids))
+        self._mtime: Optional[float] = None
+        self.reload_if_changed()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._ids
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._ordered)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def reload_if_changed(self) -> bool:
+        """
+        Перечитування файлу з ID операторів, якщо він змінився
+
+        :return: True якщо список операторів оновлено
+        """
+        if not self.config_file:
+            return False
+        try:
+            mtime = os.stat(self.config_file).st_mtime
+            if mtime == self._mtime:
+                return False
+            with open(self.config_file, 'r') as f:
+                operator_ids = parse_operator_ids(f.read())
+        except OSError as e:
+            logging.error(f"Помилка при читанні файлу операторів {self.config_file}: {e}")
+            return False
+        self._mtime = mtime
+        if not operator_ids:
+            logging.error(f"Файл операторів {self.config_file} не містить жодного коректного ID")
+            return False
+        self._ids = frozenset(operator_ids)
+        self._ordered = tuple(sorted(self._ids))
+        logging.info(f"Список операторів оновлено: {len(self._ids)}")
+        return True
+
+    async def watch(self) -> None:
+        """Фонова перевірка змін файлу операторів"""
+        if not self.config_file:
+            return
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            self.reload_if_changed()
+
 class RateLimitMiddleware(BaseMiddleware):
     def __init__(self) -> None:
         """
         Ініціалізація middleware для обмеження частоти повідомлень
+
+        Для кожного користувача зберігається token bucket: (токени, час оновлення, кінець вікна попередження).
+        Токени поповнюються рівномірно, тому постійний флуд не скидає ліміт, а пауза поступово його відновлює.
         
         Використовує змінні середовища:
         RATE_LIMIT_MESSAGES: Максимальна кількість повідомлень за період (за замовчуванням 20)
         RATE_LIMIT_PERIOD: Період скидання обмежень у секундах (за замовчуванням 60)
+        RATE_LIMIT_MANUAL_MESSAGES: Ліміт повідомлень за період у ручному режимі (за замовчуванням 10)
+        RATE_LIMIT_MAX_USERS: Максимальна кількість користувачів, для яких зберігається стан (за замовчуванням 100000)
         """
         # Отримуємо значення з змінних середовища або використовуємо значення за замовчуванням
         self.rate_limit = int(os.getenv('RATE_LIMIT_MESSAGES', 20))
         self.ttl_period = int(os.getenv('RATE_LIMIT_PERIOD', 60))
-        
-        # Кеш для зберігання лічильників повідомлень
-        self.cache = TTLCache(maxsize=10000, ttl=self.ttl_period)
+        self.max_users = int(os.getenv('RATE_LIMIT_MAX_USERS', 100000))
+
+        # Ліміти для окремих станів FSM (суворіший у ручному режимі, де повідомлення пересилаються операторам)
+        self.state_limits: Dict[Optional[str], int] = {
+            "ChatMode:manual": int(os.getenv('RATE_LIMIT_MANUAL_MESSAGES', 10)),
+        }
+
+        # Стан лімітів користувачів: user_id -> (токени, час оновлення, кінець вікна попередження)
+        # Порядок словника - від найдавніше активного користувача до найновішого
+        self.buckets: "OrderedDict[int, Tuple[float, float, float]]" = OrderedDict()
         super().__init__()
 
+    def check(self, user_id: int, state: Optional[str], now: float) -> Tuple[bool, bool]:
+        """
+        Перевірка та списання токена
+
+        :param user_id: ID користувача
+        :param state: поточний стан FSM
+        :param now: поточний час
+        :return: (чи дозволено повідомлення, чи потрібно надіслати попередження)
+        """
+        capacity = self.state_limits.get(state, self.rate_limit)
+        refill = capacity / self.ttl_period
+
+        bucket = self.buckets.pop(user_id, None)
+        if bucket is None:
+            tokens, warned_until = capacity, 0.0
+        else:
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill)
+            warned_until = bucket[2]
+
+        allowed = tokens >= 1
+        warn = False
+        if allowed:
+            tokens -= 1
+        elif now >= warned_until:
+            # Попереджаємо не частіше одного разу за період
+            warn = True
+            warned_until = now + self.ttl_period
+
+        self._store(user_id, (tokens, now, warned_until))
+        return allowed, warn
+
+    def warn_once(self, user_id: int, now: float) -> bool:
+        """
+        Перевірка, чи надсилати користувачу попередження, без списання токена
+
+        Використовує те саме вікно попередження, що й check(), тому користувач
+        отримує відповідь не частіше одного разу за період, скільки б не надсилав.
+
+        :param user_id: ID користувача
+        :param now: поточний час
+        :return: чи потрібно надіслати попередження
+        """
+        bucket = self.buckets.pop(user_id, None)
+        tokens, updated, warned_until = bucket if bucket is not None else (self.rate_limit, now, 0.0)
+        warn = now >= warned_until
+        if warn:
+            warned_until = now + self.ttl_period
+        self._store(user_id, (tokens, updated, warned_until))
+        return warn
+
+    def _store(self, user_id: int, bucket: Tuple[float, float, float]) -> None:
+        """Збереження стану користувача з обмеженням кількості записів"""
+        # Переміщуємо користувача в кінець (найновіший)
+        self.buckets[user_id] = bucket
+        if len(self.buckets) > self.max_users:
+            # Видаляємо найдавніше активного користувача: за цей час його ліміт майже або повністю відновився
+            self.buckets.popitem(last=False)
+
     async def __call__(
         self,
         handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
@@ -50,28 +194,67 @@ class RateLimitMiddleware(BaseMiddleware):
         :param data: Додаткові дані
         :return: Результат обробки
         """
-        # Отримуємо список ID операторів
-        operator_ids = get_operator_ids()
-        
+        user_id = event.from_user.id
+
         # Пропускаємо повідомлення від операторів
-        if event.from_user.id in operator_ids:
+        if user_id in data["config"]["OPERATOR_IDS"]:
             return await handler(event, data)
 
-        user_id = event.from_user.id
-        
-        # Отримуємо поточний лічильник повідомлень користувача
-        if user_id in self.cache:
-            self.cache[user_id] += 1
-        else:
-            self.cache[user_id] = 1
+        allowed, warn = self.check(user_id, data.get("raw_state"), time.monotonic())
+        if allowed:
+            return await handler(event, data)
 
-        # Перевіряємо, чи не перевищено ліміт
-        if self.cache[user_id] > self.rate_limit:
+        if warn:
             await event.answer(
                 "⚠️ <b>Ви надіслали забагато повідомлень.</b>\n"
                 f"Будь ласка, зачекайте {self.ttl_period} секунд перед наступним повідомленням.",
                 parse_mode="HTML"
             )
+        return None
+
+
+class AccessMiddleware(BaseMiddleware):
+    """
+    Перевірка доступу користувача один раз на повідомлення
+
+    Реєструється як зовнішній middleware повідомлень, тому працює до вибору
+    обробника: заблоковані користувачі отримують повідомлення про обмеження
+    (не частіше одного разу за період RateLimitMiddleware) і далі не обробляються. Запис користувача отримується один раз і
+    передається в обробники як user_record (None для операторів та нових користувачів).
+    """
+
+    def __init__(self, users_data: UsersData, user_access: UserAccess, rate_limiter: RateLimitMiddleware) -> None:
+        """
+        Ініціалізація
+
+        :param users_data: сховище данних користувачів
+        :param user_access: система контролю доступу
+        :param rate_limiter: обмеження частоти, вікно попередження якого використовується для заблокованих
+        """
+        self.users_data = users_data
+        self.user_access = user_access
+        self.rate_limiter = rate_limiter
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = event.from_user
+        if user is None or user.id in data["config"]["OPERATOR_IDS"]:
+            data["user_record"] = None
+            return await handler(event, data)
+
+        if self.user_access.is_blocked(user.id):
+            # Решта повідомлень відкидається без відповіді, щоб флуд не займав ліміт надсилання інших користувачів
+            if not self.rate_limiter.warn_once(user.id, time.monotonic()):
+                return None
+            await event.answer(
+                "❌ <b>На жаль, ваш доступ до бота обмежено.</b>",
+                parse_mode="HTML"
+            )
             return None
 
+        data["user_record"] = await self.users_data.get_user_data(str(user.id))
         return await handler(event, data)
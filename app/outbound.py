@@ -0,0 +1,222 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, SendChatAction, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from .metrics import metrics
+from .middleware import OperatorRegistry
+
+
+# Смуги пріоритету (менше значення - вищий пріоритет)
+USER_LANE = 0  # відповіді користувачам
+OPERATOR_LANE = 1  # сповіщення операторам
+BACKGROUND_LANE = 2  # статуси "друкує..."
+# Назви смуг у метриках
+LANE_NAMES = ("user", "operator", "background")
+
+# Вікно для підрахунку пропускної здатності у секундах
+THROUGHPUT_WINDOW = 60
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    """
+    Черга вихідних повідомлень з урахуванням обмежень Telegram
+
+    Підключається як middleware сесії бота, тому через неї проходять усі
+    надсилання (message.answer, bot.send_message, message.forward, copy_to).
+    Глобальний token bucket обмежує загальну швидкість, окремо витримується
+    інтервал між повідомленнями в одному чаті. Запити в черзі обслуговуються
+    за пріоритетом: першим надсилається запит найвищої смуги, чат якого вже
+    вільний, тому слот чату не резервується наперед і статуси "друкує..." чи
+    сповіщення не затримують відповіді користувачам. Статуси "друкує..." не
+    займають інтервал чату. При TelegramRetryAfter надсилання призупиняється
+    на вказаний час і запит повторюється.
+    """
+
+    def __init__(self, operators: OperatorRegistry) -> None:
+        """
+        Ініціалізація
+
+        Використовує змінні середовища:
+        OUTBOUND_RATE: Загальна кількість повідомлень на секунду (за замовчуванням 30)
+        OUTBOUND_CHAT_INTERVAL: Мінімальний інтервал між повідомленнями в одному чаті у секундах (за замовчуванням 1)
+        OUTBOUND_MAX_RETRIES: Кількість повторів після RetryAfter (за замовчуванням 3)
+
+        :param operators: реєстр операторів для визначення пріоритету
+        """
+        self.operators = operators
+        self.rate = float(os.getenv('OUTBOUND_RATE', 30))
+        self.chat_interval = float(os.getenv('OUTBOUND_CHAT_INTERVAL', 1))
+        self.max_retries = int(os.getenv('OUTBOUND_MAX_RETRIES', 3))
+        self._tokens = self.rate
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        # Час наступного дозволеного надсилання в кожний чат
+        self._chat_next: Dict[Any, float] = {}
+        # Черга запитів: (смуга, порядковий номер, чат або None без інтервалу чату, future)
+        self._waiters: List[Tuple[int, int, Any, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._pump_task: Optional[asyncio.Task] = None
+        # Пробудження черги при надходженні нового запиту
+        self._wakeup = asyncio.Event()
+        # Метрики
+        self.sent = 0
+        self.retries = 0
+        self._window = [0] * THROUGHPUT_WINDOW
+        self._window_second = 0
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # getMe, getUpdates, setWebhook та інші службові запити
+            return await make_request(bot, method)
+
+        paced = True
+        if isinstance(method, SendChatAction):
+            lane = BACKGROUND_LANE
+            # статус не є повідомленням і не займає інтервал чату
+            paced = False
+        elif chat_id in self.operators:
+            lane = OPERATOR_LANE
+        else:
+            lane = USER_LANE
+
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            await self._acquire(chat_id if paced else None, lane)
+            metrics.outbound_wait.observe(LANE_NAMES[lane], time.perf_counter() - started)
+            try:
+                response = await make_request(bot, method)
+                self._count_sent()
+                return response
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                logging.warning(f"Перевищено ліміт Telegram, повтор через {e.retry_after} с (чат {chat_id})")
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+
+    async def _acquire(self, chat_id: Any, lane: int) -> None:
+        """
+        Очікування дозволу на надсилання
+
+        :param chat_id: ID чату для інтервалу між повідомленнями (None - без інтервалу)
+        :param lane: смуга пріоритету
+        """
+        now = time.monotonic()
+        if not self._waiters and self._chat_ready(chat_id, now) and self._take_token():
+            self._reserve_chat(chat_id, now)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((lane, next(self._counter), chat_id, future))
+        self._wakeup.set()
+        if self._pump_task is None:
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    def _chat_ready(self, chat_id: Any, now: float) -> bool:
+        """Чи минув інтервал з останнього повідомлення в чат"""
+        return chat_id is None or self._chat_next.get(chat_id, 0.0) <= now
+
+    def _reserve_chat(self, chat_id: Any, now: float) -> None:
+        """Початок інтервалу чату після надсилання"""
+        if chat_id is None:
+            return
+        self._chat_next[chat_id] = now + self.chat_interval
+        if len(self._chat_next) > 10000:
+            self._chat_next = {key: value for key, value in self._chat_next.items() if value > now}
+
+    def _refill(self) -> float:
+        """Поповнення токенів, повертає поточний час"""
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return now
+
+    def _take_token(self) -> bool:
+        """Спроба взяти токен без очікування"""
+        now = self._refill()
+        if now < self._paused_until or self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    async def _pump(self) -> None:
+        """Видача токенів запитам у черзі за пріоритетом серед чатів, що вже вільні"""
+        try:
+            while self._waiters:
+                self._wakeup.clear()
+                now = time.monotonic()
+                # скасовані запити прибираємо з черги
+                self._waiters = [waiter for waiter in self._waiters if not waiter[3].done()]
+                ready = None
+                next_ready = None
+                for waiter in self._waiters:
+                    chat_id = waiter[2]
+                    if self._chat_ready(chat_id, now):
+                        if ready is None or waiter < ready:
+                            ready = waiter
+                    elif next_ready is None or self._chat_next[chat_id] < next_ready:
+                        next_ready = self._chat_next[chat_id]
+                if ready is None:
+                    if next_ready is not None:
+                        await self._sleep(next_ready - now)
+                    continue
+                if not self._take_token():
+                    await self._sleep(max(self._paused_until - now, (1 - self._tokens) / self.rate, 0.001))
+                    continue
+                self._waiters.remove(ready)
+                self._reserve_chat(ready[2], now)
+                ready[3].set_result(None)
+        finally:
+            self._pump_task = None
+
+    async def _sleep(self, delay: float) -> None:
+        """Очікування вказаного часу або надходження нового запиту"""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def _count_sent(self) -> None:
+        """Облік надісланого повідомлення для метрик пропускної здатності"""
+        self.sent += 1
+        second = int(time.monotonic())
+        if second != self._window_second:
+            # обнуляємо секунди, що минули з останнього надсилання
+            for skipped in range(max(self._window_second + 1, second - THROUGHPUT_WINDOW + 1), second + 1):
+                self._window[skipped % THROUGHPUT_WINDOW] = 0
+            self._window_second = second
+        self._window[second % THROUGHPUT_WINDOW] += 1
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Метрики черги
+
+        :return: кількість надісланих повідомлень, повторів, глибина черги та швидкість за останню хвилину
+        """
+        second = int(time.monotonic())
+        recent = sum(
+            self._window[s % THROUGHPUT_WINDOW]
+            for s in range(second - THROUGHPUT_WINDOW + 1, second + 1)
+            if s <= self._window_second and s > self._window_second - THROUGHPUT_WINDOW
+        )
+        return {
+            "sent": self.sent,
+            "retries": self.retries,
+            "queue_depth": len(self._waiters),
+            "throughput": recent / THROUGHPUT_WINDOW,
+        }
@@ -0,0 +1,151 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from typing import Any, Dict, List, Optional, Set
+
+from aiogram import Bot
+
+
+# За скільки секунд до відкладеного повідомлення показувати "друкує..."
+TYPING_LEAD = 5
+
+
+class _Job:
+    """Відкладена дія: повідомлення або статус "друкує..." """
+    __slots__ = ("key", "chat_id", "text", "kwargs", "cancelled")
+
+    def __init__(self, key: int, chat_id: int, text: Optional[str], kwargs: Dict[str, Any]):
+        self.key = key
+        self.chat_id = chat_id
+        # text = None означає статус "друкує..."
+        self.text = text
+        self.kwargs = kwargs
+        self.cancelled = False
+
+
+class MessageScheduler:
+    """
+    Планувальник відкладених повідомлень
+
+    Обробники ставлять наступні повідомлення в чергу та одразу завершуються,
+    замість того щоб чекати через asyncio.sleep. Усі відкладені повідомлення
+    зберігаються в одній купі та надсилаються однією фоновою задачею.
+    """
+
+    def __init__(self) -> None:
+        self._bot: Optional[Bot] = None
+        self._heap: List[tuple] = []
+        self._counter = itertools.count()
+        # Активні задачі кожного користувача для скасування
+        self._jobs: Dict[int, List[_Job]] = {}
+        self._runner: Optional[asyncio.Task] = None
+        # Задачі надсилання, що виконуються
+        self._sending: Set[asyncio.Task] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self, bot: Bot) -> None:
+        """Запуск фонової задачі надсилання (викликається при запуску бота)"""
+        self._bot = bot
+        self._wakeup = asyncio.Event()
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Зупинка фонової задачі, невідправлені повідомлення відкидаються, надсилання, що вже почалися, завершуються"""
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+
+    def send_later(self, key: int, delay: float, chat_id: int, text: str, typing: bool = True, **kwargs: Any) -> None:
+        """
+        Запланувати надсилання повідомлення
+
+        :param key: ID користувача, за яким повідомлення можна скасувати
+        :param delay: затримка у секундах
+        :param chat_id: ID чату
+        :param text: текст повідомлення
+        :param typing: показувати "друкує..." перед повідомленням
+        :param kwargs: додаткові параметри send_message (reply_markup, parse_mode)
+        """
+        loop = asyncio.get_running_loop()
+        when = loop.time() + delay
+        if typing and delay > 0:
+            self._push(max(loop.time(), when - TYPING_LEAD), _Job(key, chat_id, None, {}))
+        self._push(when, _Job(key, chat_id, text, kwargs))
+
+    def cancel(self, key: int) -> None:
+        """
+        Скасування всіх відкладених повідомлень користувача
+
+        :param key: ID користувача
+        """
+        for job in self._jobs.pop(key, ()):
+            job.cancelled = True
+
+    def pending(self) -> int:
+        """
+        Кількість запланованих дій у черзі
+
+        :return: розмір черги
+        """
+        return len(self._heap)
+
+    def _push(self, when: float, job: _Job) -> None:
+        """Додавання дії в купу"""
+        heapq.heappush(self._heap, (when, next(self._counter), job))
+        self._jobs.setdefault(job.key, []).append(job)
+        if self._wakeup is not None and self._heap[0][2] is job:
+            self._wakeup.set()
+
+    def _forget(self, job: _Job) -> None:
+        """Видалення виконаної дії зі списку дій користувача"""
+        jobs = self._jobs.get(job.key)
+        if jobs is None:
+            return
+        jobs.remove(job)
+        if not jobs:
+            del self._jobs[job.key]
+
+    async def _run(self) -> None:
+        """Фонова задача: очікування найближчої дії та її виконання"""
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            timeout = self._heap[0][0] - loop.time()
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, job = heapq.heappop(self._heap)
+            if job.cancelled:
+                continue
+            self._forget(job)
+            task = asyncio.create_task(self._execute(job))
+            # посилання на задачу зберігається до її завершення, інакше її може знищити збирач сміття
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _execute(self, job: _Job) -> None:
+        """Надсилання повідомлення або статусу "друкує..." """
+        try:
+            if job.text is None:
+                await self._bot.send_chat_action(job.chat_id, "typing")
+            else:
+                await self._bot.send_message(job.chat_id, job.text, **job.kwargs)
+        except Exception as e:
+            logging.error(f"Помилка при надсиланні відкладеного повідомлення в чат {job.chat_id}: {e}")
+
+
+# Створюємо глобальний екземпляр планувальника
+scheduler = MessageScheduler()
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from cachetools import LRUCache
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Сховище станів FSM у SQLite
+
+    Стани та дані зберігаються в базі одразу при зміні, тому прогрес анкет та
+    ChatMode переживають перезапуск бота. Перед базою працює невеликий LRU кеш
+    гарячих станів, записи читаються з бази лише при першому зверненні
+    (без повного сканування при запуску). Неактивні розмови видаляються пакетами.
+    """
+
+    def __init__(self, db_file: str = "data/fsm_storage.sqlite") -> None:
+        """
+        Ініціалізація сховища
+
+        Використовує змінні середовища:
+        FSM_CACHE_SIZE: Кількість станів у кеші (за замовчуванням 10000)
+        FSM_STATE_TTL: Час неактивності у секундах, після якого стан видаляється (за замовчуванням 7 днів)
+        FSM_EXPIRE_INTERVAL: Інтервал перевірки неактивних станів у секундах (за замовчуванням 600)
+
+        :param db_file: шлях до файлу бази данних
+        """
+        self.db_file = db_file
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.state_ttl = int(os.getenv('FSM_STATE_TTL', 7 * 24 * 3600))
+        self.expire_interval = int(os.getenv('FSM_EXPIRE_INTERVAL', 600))
+        self.expire_batch = 500
+        # Кеш: ключ -> [стан, дані]
+        self._cache = LRUCache(maxsize=int(os.getenv('FSM_CACHE_SIZE', 10000)))
+        self._db: Optional[aiosqlite.Connection] = None
+        self._open_lock: Optional[asyncio.Lock] = None
+        self._expire_task: Optional[asyncio.Task] = None
+
+    async def open(self) -> None:
+        """Відкриття з'єднання та запуск видалення неактивних станів"""
+        if self._open_lock is None:
+            self._open_lock = asyncio.Lock()
+        async with self._open_lock:
+            if self._db is not None:
+                return
+            db = await aiosqlite.connect(self.db_file, cached_statements=64)
+            await db.execute('PRAGMA journal_mode=WAL')
+            await db.execute('PRAGMA synchronous=NORMAL')
+            await db.executescript('''
+                CREATE TABLE IF NOT EXISTS fsm (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL DEFAULT '{}',
+                    updated_at REAL NOT NULL
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_fsm_updated_at ON fsm (updated_at);
+            ''')
+            await db.commit()
+            self._db = db
+            self._expire_task = asyncio.create_task(self._expire_loop())
+
+    async def close(self) -> None:
+        """Зупинка видалення неактивних станів та закриття з'єднання"""
+        if self._expire_task is not None:
+            self._expire_task.cancel()
+            self._expire_task = None
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def _load(self, key: str) -> list:
+        """Отримання запису з кешу або з бази"""
+        record = self._cache.get(key)
+        if record is not None:
+            return record
+        if self._db is None:
+            await self.open()
+        async with self._db.execute('SELECT state, data FROM fsm WHERE key = ?', (key,)) as cursor:
+            row = await cursor.fetchone()
+        record = [row[0], json.loads(row[1])] if row is not None else [None, {}]
+        # запис міг бути змінений, поки ми чекали на базу
+        return self._cache.setdefault(key, record)
+
+    async def _save(self, key: str, record: list) -> None:
+        """Збереження запису в кеш та базу"""
+        self._cache[key] = record
+        state, data = record
+        if state is None and not data:
+            await self._db.execute('DELETE FROM fsm WHERE key = ?', (key,))
+        else:
+            await self._db.execute('''
+                INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+            ''', (key, state, json.dumps(data, ensure_ascii=False), time.time()))
+        await self._db.commit()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        """
+        Встановлення стану
+
+        :param key: ключ сховища
+        :param state: новий стан
+        """
+        storage_key = self.key_builder.build(key)
+        record = await self._load(storage_key)
+        state = state.state if isinstance(state, State) else state
+        await self._save(storage_key, [state, record[1]])
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        """
+        Отримання стану
+
+        :param key: ключ сховища
+        :return: поточний стан
+        """
+        return (await self._load(self.key_builder.build(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        """
+        Встановлення даних
+
+        :param key: ключ сховища
+        :param data: нові дані
+        """
+        storage_key = self.key_builder.build(key)
+        record = await self._load(storage_key)
+        await self._save(storage_key, [record[0], data.copy()])
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        """
+        Отримання даних
+
+        :param key: ключ сховища
+        :return: копія даних
+        """
+        return (await self._load(self.key_builder.build(key)))[1].copy()
+
+    async def expire(self) -> int:
+        """
+        Видалення неактивних розмов пакетами
+
+        :return: кількість видалених станів
+        """
+        if self._db is None:
+            return 0
+        deadline = time.time() - self.state_ttl
+        removed = 0
+        while True:
+            async with self._db.execute('''
+                DELETE FROM fsm WHERE key IN (
+                    SELECT key FROM fsm WHERE updated_at < ? LIMIT ?
+                )
+                RETURNING key
+            ''', (deadline, self.expire_batch)) as cursor:
+                keys = [row[0] for row in await cursor.fetchall()]
+            await self._db.commit()
+            for key in keys:
+                self._cache.pop(key, None)
+            removed += len(keys)
+            if len(keys) < self.expire_batch:
+                return removed
+            # даємо обробити інші запити між пакетами
+            await asyncio.sleep(0)
+
+    async def _expire_loop(self) -> None:
+        """Періодичне видалення неактивних розмов"""
+        while True:
+            await asyncio.sleep(self.expire_interval)
+            try:
+                await self.expire()
+            except aiosqlite.Error as e:
+                print(f"Помилка при видаленні неактивних станів: {e}")
@@ -0,0 +1,194 @@
+import os
+import time
+from typing import Dict, List, Optional
+
+from .middleware import OperatorRegistry
+from .users_data import UsersData
+
+
+class Ticket:
+    """Відкрите звернення користувача"""
+
+    __slots__ = ("id", "telegram_user_id", "operator_id", "created_at")
+
+    def __init__(self, ticket_id: int, telegram_user_id: str, operator_id: Optional[int], created_at: float) -> None:
+        self.id = ticket_id
+        self.telegram_user_id = telegram_user_id
+        self.operator_id = operator_id
+        self.created_at = created_at
+
+
+class TicketManager:
+    """
+    Черга звернень з призначенням операторів
+
+    Кожен користувач у ручному режимі має одне відкрите звернення, призначене
+    одному оператору: тому, хто вже працював з користувачем (якщо він ще оператор
+    і не перевантажений), або найменш завантаженому. Повідомлення призначеного
+    звернення надсилаються лише його оператору, всім операторам - тільки
+    непризначені. Відкриті звернення та навантаження операторів тримаються в пам'яті.
+    """
+
+    def __init__(self, users_data: UsersData) -> None:
+        """
+        Ініціалізація
+
+        Використовує змінні середовища:
+        TICKET_REPLY_TIMEOUT: Час очікування відповіді оператора у секундах, після якого звернення передається іншому (за замовчуванням 600)
+        TICKET_MAX_PER_OPERATOR: Максимальна кількість звернень на одного оператора (за замовчуванням 20)
+
+        :param users_data: сховище звернень
+        """
+        self.users_data = users_data
+        self.reply_timeout = float(os.getenv('TICKET_REPLY_TIMEOUT', 600))
+        self.max_per_operator = int(os.getenv('TICKET_MAX_PER_OPERATOR', 20))
+        self.operators: Optional[OperatorRegistry] = None
+        # telegram_user_id -> відкрите звернення
+        self._open: Dict[str, Ticket] = {}
+        # ID оператора -> кількість призначених звернень
+        self._load: Dict[int, int] = {}
+
+    async def load(self, operators: OperatorRegistry) -> None:
+        """
+        Завантаження відкритих звернень (викликається при запуску бота)
+
+        :param operators: реєстр операторів
+        """
+        self.operators = operators
+        for row in await self.users_data.get_open_tickets():
+            ticket = Ticket(row['id'], row['telegram_user_id'], row['operator_id'], row['created_at'])
+            self._open[ticket.telegram_user_id] = ticket
+            self._add_load(ticket.operator_id, 1)
+
+    def _add_load(self, operator_id: Optional[int], delta: int) -> None:
+        """Зміна навантаження оператора"""
+        if operator_id is not None:
+            self._load[operator_id] = self._load.get(operator_id, 0) + delta
+
+    def _least_loaded(self, exclude: Optional[int] = None) -> Optional[int]:
+        """Найменш завантажений оператор, що може прийняти звернення"""
+        best = None
+        for operator_id in self.operators:
+            load = self._load.get(operator_id, 0)
+            if operator_id == exclude or load >= self.max_per_operator:
+                continue
+            if best is None or load < self._load.get(best, 0):
+                best = operator_id
+        return best
+
+    async def _assign(self, ticket: Ticket, operator_id: Optional[int]) -> None:
+        """Призначення звернення оператору (None - зняття призначення)"""
+        if ticket.operator_id == operator_id:
+            return
+        self._add_load(ticket.operator_id, -1)
+        self._add_load(operator_id, 1)
+        ticket.operator_id = operator_id
+        await self.users_data.update_ticket(ticket.id, operator_id)
+
+    def get(self, telegram_user_id) -> Optional[Ticket]:
+        """
+        Відкрите звернення користувача
+
+        :param telegram_user_id: ID користувача
+        :return: звернення або None
+        """
+        return self._open.get(str(telegram_user_id))
+
+    async def open(self, telegram_user_id) -> Ticket:
+        """
+        Отримання відкритого звернення або створення нового з призначенням оператора
+
+        :param telegram_user_id: ID користувача
+        :return: звернення
+        """
+        telegram_user_id = str(telegram_user_id)
+        ticket = self._open.get(telegram_user_id)
+        if ticket is not None:
+            return ticket
+        # Той самий оператор, що вже працював з користувачем, інакше найменш завантажений
+        operator_id = await self.users_data.get_last_ticket_operator(telegram_user_id)
+        if operator_id not in self.operators or self._load.get(operator_id, 0) >= self.max_per_operator:
+            operator_id = self._least_loaded()
+        ticket = self._open.get(telegram_user_id)
+        if ticket is not None:
+            return ticket
+        ticket_id = await self.users_data.add_ticket(telegram_user_id, operator_id)
+        ticket = Ticket(ticket_id, telegram_user_id, operator_id, time.time())
+        self._open[telegram_user_id] = ticket
+        self._add_load(operator_id, 1)
+        return ticket
+
+    def recipients(self, ticket: Ticket) -> List[int]:
+        """
+        Оператори, яким надсилаються повідомлення звернення
+
+        :param ticket: звернення
+        :return: призначений оператор або всі оператори для непризначеного звернення
+        """
+        if ticket.operator_id is not None and ticket.operator_id in self.operators:
+            return [ticket.operator_id]
+        return list(self.operators)
+
+    async def claim(self, telegram_user_id, operator_id: int) -> Ticket:
+        """
+        Закріплення звернення за оператором, що відповів користувачу
+
+        :param telegram_user_id: ID користувача
+        :param operator_id: ID оператора
+        :return: звернення
+        """
+        ticket = self._open.get(str(telegram_user_id))
+        if ticket is None:
+            ticket_id = await self.users_data.add_ticket(str(telegram_user_id), operator_id)
+            ticket = Ticket(ticket_id, str(telegram_user_id), operator_id, time.time())
+            self._open[ticket.telegram_user_id] = ticket
+            self._add_load(operator_id, 1)
+        else:
+            await self._assign(ticket, operator_id)
+        return ticket
+
+    async def reassign(self, telegram_user_id) -> Optional[Ticket]:
+        """
+        Передача звернення іншому оператору, якщо призначений не відповів вчасно
+
+        :param telegram_user_id: ID користувача
+        :return: звернення (без оператора, якщо вільних операторів немає) або None
+        """
+        ticket = self._open.get(str(telegram_user_id))
+        if ticket is None or ticket.operator_id is None:
+            return None
+        await self._assign(ticket, self._least_loaded(exclude=ticket.operator_id))
+        return ticket
+
+    async def close(self, telegram_user_id) -> Optional[Ticket]:
+        """
+        Закриття звернення
+
+        :param telegram_user_id: ID користувача
+        :return: закрите звернення або None, якщо відкритого звернення немає
+        """
+        ticket = self._open.pop(str(telegram_user_id), None)
+        if ticket is None:
+            return None
+        self._add_load(ticket.operator_id, -1)
+        await self.users_data.update_ticket(ticket.id, ticket.operator_id, 'closed')
+        return ticket
+
+    def load_by_operator(self) -> Dict[int, int]:
+        """
+        Навантаження операторів
+
+        :return: кількість відкритих звернень кожного оператора
+        """
+        return {operator_id: self._load.get(operator_id, 0) for operator_id in self.operators}
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Статистика черги
+
+        :return: кількість відкритих та непризначених звернень
+        """
+        return {
+            "open": len(self._open),
+            "unassigned": sum(1 for ticket in self._open.values() if ticket.operator_id is None),
+        }
@@ -0,0 +1,149 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+
+# Види тайм-аутів
+FORM_TIMEOUT = "form"  # неактивність під час заповнення анкети
+HELP_TIMEOUT = "help"  # очікування відповіді в стані waiting_continue_help
+TICKET_TIMEOUT = "ticket"  # очікування відповіді оператора на звернення
+# Тайм-аути неактивності самого користувача (тайм-аут звернення від них не залежить)
+INACTIVITY_TIMEOUTS = (FORM_TIMEOUT, HELP_TIMEOUT)
+
+TimeoutCallback = Callable[[int, int, str], Awaitable[None]]
+
+
+class TimeoutManager:
+    """
+    Менеджер тайм-аутів неактивності користувачів
+
+    Замість окремої задачі asyncio на кожного користувача зберігає компактні
+    записи (deadline, user_id, chat_id, kind) в одній купі, яку обслуговує
+    одна фонова задача. Перезапуск тайм-ауту лише додає новий запис, старий
+    ігнорується при вилученні з купи.
+    """
+
+    def __init__(self) -> None:
+        self._heap: List[Tuple[float, int, int, int, str]] = []
+        self._counter = itertools.count()
+        # Актуальний запис для кожної пари (user_id, kind)
+        self._live: Dict[Tuple[int, str], int] = {}
+        self._callback: Optional[TimeoutCallback] = None
+        self._runner: Optional[asyncio.Task] = None
+        # Обробники тайм-аутів, що виконуються
+        self._firing: Set[asyncio.Task] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self, callback: TimeoutCallback) -> None:
+        """
+        Запуск фонової задачі (викликається при запуску бота)
+
+        :param callback: корутина (user_id, chat_id, kind), що викликається після тайм-ауту
+        """
+        self._callback = callback
+        self._wakeup = asyncio.Event()
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Зупинка фонової задачі та очікування обробників, що вже виконуються"""
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+        if self._firing:
+            await asyncio.gather(*self._firing, return_exceptions=True)
+
+    def schedule(self, user_id: int, chat_id: int, kind: str, delay: float) -> None:
+        """
+        Запуск або перезапуск тайм-ауту користувача
+
+        :param user_id: ID користувача
+        :param chat_id: ID чату
+        :param kind: вид тайм-ауту
+        :param delay: тайм-аут у секундах
+        """
+        seq = next(self._counter)
+        deadline = asyncio.get_running_loop().time() + delay
+        self._live[(user_id, kind)] = seq
+        heapq.heappush(self._heap, (deadline, seq, user_id, chat_id, kind))
+        self._compact()
+        if self._wakeup is not None and self._heap[0][1] == seq:
+            self._wakeup.set()
+
+    def cancel(self, user_id: int, kind: Optional[str] = None) -> None:
+        """
+        Скасування тайм-ауту користувача
+
+        :param user_id: ID користувача
+        :param kind: вид тайм-ауту, None - усі тайм-аути неактивності користувача (без TICKET_TIMEOUT)
+        """
+        for item in ((kind,) if kind is not None else INACTIVITY_TIMEOUTS):
+            self._live.pop((user_id, item), None)
+
+    def is_active(self, user_id: int, kind: str) -> bool:
+        """
+        Перевірка чи запущений тайм-аут користувача
+
+        :param user_id: ID користувача
+        :param kind: вид тайм-ауту
+        :return: True якщо тайм-аут запущений
+        """
+        return (user_id, kind) in self._live
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Статистика менеджера
+
+        :return: кількість активних тайм-аутів та записів у купі
+        """
+        return {"active": len(self._live), "heap": len(self._heap)}
+
+    def _compact(self) -> None:
+        """Перебудова купи, коли в ній забагато застарілих записів"""
+        if len(self._heap) > 2 * len(self._live) + 64:
+            self._heap = [
+                entry for entry in self._heap
+                if self._live.get((entry[2], entry[4])) == entry[1]
+            ]
+            heapq.heapify(self._heap)
+
+    async def _run(self) -> None:
+        """Фонова задача: очікування найближчого тайм-ауту"""
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            timeout = self._heap[0][0] - loop.time()
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, seq, user_id, chat_id, kind = heapq.heappop(self._heap)
+            if self._live.get((user_id, kind)) != seq:
+                # запис скасовано або перезапущено
+                continue
+            del self._live[(user_id, kind)]
+            task = asyncio.create_task(self._fire(user_id, chat_id, kind))
+            # посилання на задачу зберігається до її завершення, інакше її може знищити збирач сміття
+            self._firing.add(task)
+            task.add_done_callback(self._firing.discard)
+
+    async def _fire(self, user_id: int, chat_id: int, kind: str) -> None:
+        """Виклик обробника тайм-ауту"""
+        try:
+            await self._callback(user_id, chat_id, kind)
+        except Exception as e:
+            logging.error(f"Помилка при обробці тайм-ауту користувача {user_id}: {e}")
+
+
+# Створюємо глобальний екземпляр менеджера тайм-аутів
+timeouts = TimeoutManager()
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from .users_data import UsersData
+
+
+# Ключ у таблиці bot_state для останнього обробленого update_id
+HIGH_WATER_MARK_KEY = "last_update_id"
+
+
+class UpdateTracker(BaseMiddleware):
+    """
+    Облік оновлень для запуску без втрати накопичених повідомлень
+
+    - пропускає оновлення з update_id, що вже були оброблені до перезапуску
+      (останній оброблений update_id зберігається в базі) або щойно отримані повторно
+    - обробляє накопичені за час простою оновлення з обмеженою швидкістю
+    - рахує оновлення в обробці, щоб при зупинці дочекатися їх завершення
+    """
+
+    def __init__(self, users_data: UsersData) -> None:
+        """
+        Ініціалізація
+
+        Використовує змінні середовища:
+        BACKLOG_RATE: Кількість накопичених оновлень, що обробляються за секунду (за замовчуванням 20)
+        UPDATE_STATE_INTERVAL: Інтервал збереження останнього update_id у секундах (за замовчуванням 5)
+
+        :param users_data: сховище для збереження останнього update_id
+        """
+        self.users_data = users_data
+        self.backlog_rate = float(os.getenv('BACKLOG_RATE', 20))
+        self.persist_interval = float(os.getenv('UPDATE_STATE_INTERVAL', 5))
+        self.started_at = datetime.now(timezone.utc)
+        # update_id, оброблені до перезапуску
+        self.persisted_update_id = 0
+        self.last_update_id = 0
+        self._saved_update_id = 0
+        self._last_persist = 0.0
+        self._persist_task: Optional[asyncio.Task] = None
+        # Нещодавно отримані update_id для відкидання повторів
+        self._recent = deque(maxlen=1000)
+        self._recent_set = set()
+        self._backlog_next = 0.0
+        self.in_flight = 0
+        self._idle: Optional[asyncio.Event] = None
+        self.skipped = 0
+        self.backlog = 0
+
+    async def load(self) -> None:
+        """Завантаження останнього обробленого update_id (викликається при запуску бота)"""
+        self.started_at = datetime.now(timezone.utc)
+        value = await self.users_data.get_bot_state(HIGH_WATER_MARK_KEY)
+        self.persisted_update_id = self.last_update_id = self._saved_update_id = int(value) if value else 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        logging.info(f"Останній оброблений update_id: {self.persisted_update_id}")
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        update_id = event.update_id
+        if update_id <= self.persisted_update_id or update_id in self._recent_set:
+            self.skipped += 1
+            return None
+        if len(self._recent) == self._recent.maxlen:
+            self._recent_set.discard(self._recent[0])
+        self._recent.append(update_id)
+        self._recent_set.add(update_id)
+
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            # Оновлення, надіслані до запуску бота, обробляємо з обмеженою швидкістю
+            date = event.message.date if event.message is not None else None
+            if date is not None and date < self.started_at:
+                self.backlog += 1
+                await self._backlog_slot()
+            return await handler(event, data)
+        finally:
+            self.in_flight -= 1
+            if not self.in_flight:
+                self._idle.set()
+            self.last_update_id = max(self.last_update_id, update_id)
+            now = time.monotonic()
+            if now - self._last_persist >= self.persist_interval and self._persist_task is None:
+                self._last_persist = now
+                self._persist_task = asyncio.create_task(self.persist())
+
+    async def _backlog_slot(self) -> None:
+        """Рівномірний розподіл накопичених оновлень у часі"""
+        now = time.monotonic()
+        slot = max(now, self._backlog_next)
+        self._backlog_next = slot + 1 / self.backlog_rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def persist(self) -> None:
+        """Збереження останнього обробленого update_id"""
+        task = self._persist_task
+        if task is not None and task is not asyncio.current_task():
+            # дочікуємося фонового збереження, щоб не писати в базу після її закриття
+            await task
+        try:
+            update_id = self.last_update_id
+            if update_id > self._saved_update_id:
+                await self.users_data.set_bot_state(HIGH_WATER_MARK_KEY, str(update_id))
+                self._saved_update_id = update_id
+        finally:
+            self._persist_task = None
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Очікування завершення оновлень, що обробляються
+
+        :param timeout: максимальний час очікування у секундах
+        :return: True якщо всі оновлення оброблено
+        """
+        if self._idle is None or self._idle.is_set():
+            return True
+        logging.info(f"Очікування завершення {self.in_flight} оновлень...")
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logging.warning(f"Не завершено {self.in_flight} оновлень за {timeout} с")
+            return False
+
+
+class UserSerializer(BaseMiddleware):
+    """
+    Послідовна обробка оновлень кожного користувача
+
+    Оновлення різних користувачів обробляються паралельно, а оновлення одного
+    користувача - строго по черзі в порядку надходження, тому друге швидке
+    повідомлення не обробляється, поки перше ще змінює його FSMContext.
+    Черга користувача (asyncio.Lock з лічильником) існує лише поки в ній є
+    оновлення, тому кількість черг обмежена кількістю активних користувачів.
+    """
+
+    def __init__(self) -> None:
+        """
+        Ініціалізація
+
+        Використовує змінні середовища:
+        USER_QUEUE_DEPTH: Максимальна кількість оновлень у черзі одного користувача (за замовчуванням 50)
+        """
+        self.max_depth = int(os.getenv('USER_QUEUE_DEPTH', 50))
+        # ID користувача -> [блокування, кількість оновлень у черзі]
+        self._queues: Dict[int, list] = {}
+        # Метрики
+        self.peak_depth = 0
+        self.dropped = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        queue = self._queues.get(user.id)
+        if queue is None:
+            queue = self._queues[user.id] = [asyncio.Lock(), 0]
+        if queue[1] >= self.max_depth:
+            self.dropped += 1
+            logging.warning(f"Черга оновлень користувача {user.id} переповнена, оновлення {event.update_id} пропущено")
+            return None
+        queue[1] += 1
+        self.peak_depth = max(self.peak_depth, queue[1])
+        try:
+            async with queue[0]:
+                state = data.get("state")
+                if state is not None:
+                    # стан завантажено до блокування і він міг змінитися, поки оновлення
+                    # чекало в черзі або на обробку накопичених оновлень (читання з LRU кешу сховища)
+                    data["raw_state"] = await state.get_state()
+                return await handler(event, data)
+        finally:
+            queue[1] -= 1
+            if not queue[1] and self._queues.get(user.id) is queue:
+                del self._queues[user.id]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Метрики черг
+
+        :return: кількість активних черг, оновлень у чергах, максимальна глибина черги та кількість пропущених оновлень
+        """
+        return {
+            "queues": len(self._queues),
+            "queued": sum(queue[1] for queue in self._queues.values()),
+            "peak_depth": self.peak_depth,
+            "dropped": self.dropped,
+        }
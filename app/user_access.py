@@ -1,78 +1,103 @@
-from typing import Set
-import os
+from typing import Dict, Optional, Set
+import asyncio
 import json
 from pathlib import Path
 
+from .users_data import UsersData
+
+# Ключ у таблиці bot_state, що позначає імпорт старого файлу блокувань
+BLOCKLIST_IMPORTED_KEY = "blocked_users_imported"
+
+
 class UserAccess:
-    def __init__(self):
-        """Ініціалізація системи контролю доступу користувачів"""
+    """
+    Контроль доступу користувачів
+
+    Блокування зберігається в колонці users.blocked, у пам'яті тримається множина
+    telegram_user_id заблокованих користувачів, тому перевірка не потребує
+    запиту до бази. Зміни записуються однією транзакцією через з'єднання для запису.
+    """
+
+    def __init__(self, users_data: UsersData):
+        """
+        Ініціалізація системи контролю доступу користувачів
+
+        :param users_data: сховище данних користувачів
+        """
+        self.users_data = users_data
+        # Старий файл зі списком uuid, імпортується в базу один раз
         self.blocked_users_file = Path("data/blocked_users.json")
         self._blocked_users: Set[str] = set()
-        self._load_blocked_users()
+        # uuid -> telegram_user_id заблокованих користувачів
+        self._blocked_uuids: Dict[str, str] = {}
 
-    def _load_blocked_users(self) -> None:
-        """Завантаження списку заблокованих користувачів з файлу"""
-        try:
-            if not self.blocked_users_file.exists():
-                self.blocked_users_file.parent.mkdir(parents=True, exist_ok=True)
-                self._save_blocked_users()
-            else:
-                with open(self.blocked_users_file, 'r') as f:
-                    self._blocked_users = set(json.load(f))
-        except Exception as e:
-            print(f"Помилка при завантаженні списку заблокованих користувачів: {e}")
-            self._blocked_users = set()
+    async def load(self) -> None:
+        """Завантаження списку заблокованих користувачів з бази (викликається при запуску бота)"""
+        await self._import_blocked_users_file()
+        for telegram_user_id, uuid in await self.users_data.get_blocked_users():
+            self._blocked_users.add(telegram_user_id)
+            self._blocked_uuids[uuid] = telegram_user_id
 
-    def _save_blocked_users(self) -> None:
-        """Збереження списку заблокованих користувачів у файл"""
+    async def _import_blocked_users_file(self) -> None:
+        """Одноразовий імпорт списку заблокованих користувачів з JSON файлу"""
+        if await self.users_data.get_bot_state(BLOCKLIST_IMPORTED_KEY):
+            return
         try:
-            with open(self.blocked_users_file, 'w') as f:
-                json.dump(list(self._blocked_users), f)
+            if self.blocked_users_file.exists():
+                text = await asyncio.to_thread(self.blocked_users_file.read_text)
+                uuids = [str(uuid) for uuid in json.loads(text)]
+                imported = 0
+                for uuid in uuids:
+                    if await self.users_data.set_blocked(uuid, True) is not None:
+                        imported += 1
+                print(f"Імпортовано {imported} з {len(uuids)} заблокованих користувачів з {self.blocked_users_file}")
         except Exception as e:
-            print(f"Помилка при збереженні списку заблокованих користувачів: {e}")
+            print(f"Помилка при імпорті списку заблокованих користувачів: {e}")
+            return
+        await self.users_data.set_bot_state(BLOCKLIST_IMPORTED_KEY, "1")
 
-    def block_user(self, user_uuid: str) -> bool:
+    async def block_user(self, user_uuid: str) -> Optional[bool]:
         """
         Блокування користувача
-        
-        :param user_id: ID користувача для блокування
-        :return: True якщо користувача заблоковано, False якщо вже був заблокований
+
+        :param user_uuid: uuid користувача для блокування
+        :return: True якщо користувача заблоковано, False якщо вже був заблокований, None якщо користувача не знайдено
         """
-        if user_uuid in self._blocked_users:
+        if user_uuid in self._blocked_uuids:
             return False
-        self._blocked_users.add(user_uuid)
-        self._save_blocked_users()
+        telegram_user_id = await self.users_data.set_blocked(user_uuid, True)
+        if telegram_user_id is None:
+            return None if await self.users_data.get_user_data_by_uuid(user_uuid) is None else False
+        self._blocked_users.add(telegram_user_id)
+        self._blocked_uuids[user_uuid] = telegram_user_id
         return True
 
-    def unblock_user(self, user_uuid: str) -> bool:
+    async def unblock_user(self, user_uuid: str) -> bool:
         """
         Розблокування користувача
-        
-        :param user_id: ID користувача для розблокування
+
+        :param user_uuid: uuid користувача для розблокування
         :return: True якщо користувача розблоковано, False якщо не був заблокований
         """
-        if user_uuid not in self._blocked_users:
+        if user_uuid not in self._blocked_uuids:
             return False
-        self._blocked_users.remove(user_uuid)
-        self._save_blocked_users()
-        return True
+        telegram_user_id = await self.users_data.set_blocked(user_uuid, False)
+        self._blocked_users.discard(self._blocked_uuids.pop(user_uuid))
+        return telegram_user_id is not None
 
-    def is_blocked(self, user_uuid: str) -> bool:
+    def is_blocked(self, telegram_user_id) -> bool:
         """
         Перевірка чи заблокований користувач
-        
-        :param user_id: ID користувача для перевірки
+
+        :param telegram_user_id: Telegram ID користувача для перевірки
         :return: True якщо користувач заблокований, False якщо ні
         """
-        return user_uuid in self._blocked_users
+        return str(telegram_user_id) in self._blocked_users
 
-    def get_blocked_users(self) -> Set[int]:
+    def get_blocked_users(self) -> Set[str]:
         """
         Отримання списку всіх заблокованих користувачів
-        
-        :return: Множина ID заблокованих користувачів
-        """
-        return self._blocked_users.copy()
 
-# Створюємо глобальний екземпляр для контролю доступу
-user_access = UserAccess()
+        :return: Множина uuid заблокованих користувачів
+        """
+        return set(self._blocked_uuids)
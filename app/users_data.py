@@ -2,61 +2,432 @@ from datetime import datetime
 
 import aiosqlite
 import json
-from typing import Dict, Any, Callable, Coroutine
+import os
+from cachetools import LRUCache, TTLCache
+from contextlib import asynccontextmanager
+from typing import Dict, Any, AsyncIterator, Callable, Coroutine, Iterable, List, Optional, Tuple
 from functools import lru_cache
 import asyncio
+import time
+
+from .metrics import metrics
+from .write_behind import WriteBehind
+
+
+# Міграції схеми бази данних, номер міграції = індекс у списку + 1
+MIGRATIONS = [
+    # 1: початкова схема
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telegram_user_id TEXT NOT NULL,
+        date_created TEXT,
+        uuid TEXT,
+        name TEXT,
+        age INTEGER,
+        location TEXT,
+        event_details TEXT,
+        help_type TEXT,
+        description TEXT,
+        blocked BOOLEAN DEFAULT 0
+    );
+    ''',
+    # 2: UNIQUE для telegram_user_id та унікальний індекс для uuid
+    # (SQLite не вміє додавати обмеження до таблиці, тому таблиця перебудовується,
+    # дублікати telegram_user_id відкидаються, залишається найперший запис)
+    '''
+    CREATE TABLE users_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telegram_user_id TEXT NOT NULL UNIQUE,
+        date_created TEXT,
+        uuid TEXT,
+        name TEXT,
+        age INTEGER,
+        location TEXT,
+        event_details TEXT,
+        help_type TEXT,
+        description TEXT,
+        blocked BOOLEAN DEFAULT 0
+    );
+    INSERT INTO users_new
+        SELECT * FROM users
+        WHERE id IN (SELECT MIN(id) FROM users GROUP BY telegram_user_id);
+    UPDATE sqlite_sequence
+        SET seq = (SELECT MAX(seq) FROM sqlite_sequence WHERE name IN ('users', 'users_new'))
+        WHERE name = 'users_new';
+    DROP TABLE users;
+    ALTER TABLE users_new RENAME TO users;
+    CREATE UNIQUE INDEX idx_users_uuid ON users (uuid);
+    ''',
+    # 3: службові значення бота (наприклад, останній оброблений update_id)
+    '''
+    CREATE TABLE bot_state (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    ''',
+    # 4: частковий індекс заблокованих користувачів
+    '''
+    CREATE INDEX idx_users_blocked ON users (telegram_user_id) WHERE blocked = 1;
+    ''',
+    # 5: відповідність повідомлень у чатах операторів користувачам
+    '''
+    CREATE TABLE message_routes (
+        operator_chat_id INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        telegram_user_id TEXT NOT NULL,
+        PRIMARY KEY (operator_chat_id, message_id)
+    ) WITHOUT ROWID;
+    ''',
+    # 6: звернення користувачів, призначені операторам
+    '''
+    CREATE TABLE tickets (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telegram_user_id TEXT NOT NULL,
+        operator_id INTEGER,
+        status TEXT NOT NULL DEFAULT 'open',
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE UNIQUE INDEX idx_tickets_open ON tickets (telegram_user_id) WHERE status = 'open';
+    CREATE INDEX idx_tickets_user ON tickets (telegram_user_id, id);
+    ''',
+    # 7: анкети, заповнені в неробочий час, до доставки операторам
+    '''
+    CREATE TABLE inbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telegram_user_id TEXT NOT NULL,
+        urgent INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        delivered_at REAL
+    );
+    CREATE INDEX idx_inbox_pending ON inbox (urgent DESC, created_at) WHERE delivered_at IS NULL;
+    ''',
+    # 8: історія переписки користувачів з операторами з повнотекстовим індексом FTS5
+    # (messages_fts зберігає лише індекс, текст читається з messages, індекс оновлюють тригери)
+    '''
+    CREATE TABLE messages (
+        id INTEGER PRIMARY KEY,
+        telegram_user_id TEXT NOT NULL,
+        direction TEXT NOT NULL,
+        operator_id INTEGER,
+        content_type TEXT NOT NULL,
+        text TEXT,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX idx_messages_user ON messages (telegram_user_id, id);
+    CREATE VIRTUAL TABLE messages_fts USING fts5(
+        text, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    );
+    CREATE TRIGGER messages_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+    END;
+    CREATE TRIGGER messages_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END;
+    CREATE TRIGGER messages_au AFTER UPDATE OF text ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+    END;
+    ''',
+    # 9: індекс за датою створення (date_created зберігається як день/місяць/рік,
+    # тому індексується вираз у форматі РРРРММДД, див. DATE_KEY)
+    '''
+    CREATE INDEX idx_users_date_key ON users (
+        substr(date_created, 7, 4) || substr(date_created, 4, 2) || substr(date_created, 1, 2)
+    );
+    ''',
+    # 10: час збереження відповідності для прогріву найновіших записів та видалення старих
+    # (існуючі записи отримують час міграції, щоб не видалити їх одразу)
+    '''
+    ALTER TABLE message_routes ADD COLUMN created_at REAL NOT NULL DEFAULT 0;
+    UPDATE message_routes SET created_at = CAST(strftime('%s', 'now') AS REAL);
+    CREATE INDEX idx_message_routes_created ON message_routes (created_at);
+    ''',
+]
+
+# Дата створення у форматі РРРРММДД з date_created (день/місяць/рік) для фільтрів за датою
+DATE_KEY = "substr(date_created, 7, 4) || substr(date_created, 4, 2) || substr(date_created, 1, 2)"
+
+# Поля, які можна оновлювати через update_user_data
+USER_FIELDS = frozenset({
+    "uuid", "name", "age", "location", "event_details", "help_type", "description", "blocked",
+})
+
+# Інтервал видалення застарілих відповідностей повідомлень під час роботи у секундах
+ROUTES_PRUNE_INTERVAL = 3600
+
+# Позначка відсутнього запису в кеші (None означає, що користувача немає в базі)
+_MISSING = object()
 
 
 class UsersData:
     """Клас для роботи з данними користувачів"""
 
-    def __init__(self, db_file: str = "data/users_data.sqlite"):
-        """Ініціалізація системи збереження данних користувачів"""
+    def __init__(self, db_file: str = "data/users_data.sqlite", readers: int = None):
+        """
+        Ініціалізація системи збереження данних користувачів
+
+        Використовує змінні середовища:
+        DB_READERS: Кількість з'єднань для читання у пулі (за замовчуванням 4)
+        USERS_CACHE_SIZE: Максимальна кількість записів у кеші (за замовчуванням 10000)
+        USERS_CACHE_TTL: Час життя запису в кеші у секундах (за замовчуванням 600)
+        DB_FLUSH_INTERVAL: Інтервал пакетного запису змін полів у секундах (за замовчуванням 1)
+        ROUTES_CACHE_SIZE: Кількість повідомлень операторів у кеші відповідностей (за замовчуванням 10000)
+        ROUTES_RETENTION_DAYS: Скільки днів зберігаються відповідності повідомлень операторів (за замовчуванням 30)
+
+        :param db_file: шлях до файлу бази данних
+        :param readers: кількість з'єднань для читання
+        """
         self.db_file = db_file
-        asyncio.run(self._initialize_db())
+        self.readers = readers or int(os.getenv('DB_READERS', 4))
+        # Пул з'єднань: одне з'єднання для запису та декілька для читання
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._writer_lock: Optional[asyncio.Lock] = None
+        self._readers: Optional[asyncio.Queue] = None
+        self._reader_connections: List[aiosqlite.Connection] = []
+        self._open_lock: Optional[asyncio.Lock] = None
+        # Кеш записів користувачів: telegram_user_id -> запис (або None, якщо користувача немає)
+        cache_size = int(os.getenv('USERS_CACHE_SIZE', 10000))
+        cache_ttl = int(os.getenv('USERS_CACHE_TTL', 600))
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        # Індекс кешу: uuid -> telegram_user_id
+        self._uuid_index = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        # Лічильник записів, щоб не покласти в кеш дані, прочитані до останнього запису
+        self._write_epoch = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Буфер відкладеного запису: telegram_user_id -> {поле: значення}
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        # Буфери, які зараз записуються в базу
+        self._flushing: List[Dict[str, Dict[str, Any]]] = []
+        self.flush_interval = float(os.getenv('DB_FLUSH_INTERVAL', 1))
+        self._write_behind = WriteBehind(self.flush, self.flush_interval)
+        # Кеш відповідностей: (operator_chat_id, message_id) -> telegram_user_id
+        self._routes = LRUCache(maxsize=int(os.getenv('ROUTES_CACHE_SIZE', 10000)))
+        self.routes_retention = float(os.getenv('ROUTES_RETENTION_DAYS', 30)) * 86400
+        self._routes_pruned = 0.0
 
-    async def _initialize_db(self) -> None:
-        """Ініціалізація бази данних, якщо таблиці не існує
+    async def _migrate(self, db: aiosqlite.Connection) -> None:
+        """
+        Застосування міграцій схеми, версія зберігається в PRAGMA user_version
         date_created = день/місяць/рік
         uuid = date_created + id
+        :param db: з'єднання з базою данних
+        """
+        async with db.execute('PRAGMA user_version') as cursor:
+            version = (await cursor.fetchone())[0]
+        for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            # Кожна міграція виконується в окремій транзакції разом з оновленням версії
+            await db.executescript(f'BEGIN;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;')
+            print(f"Застосовано міграцію бази данних {number}")
+
+    async def _connect(self, readonly: bool = False) -> aiosqlite.Connection:
+        """
+        Відкриття довготривалого з'єднання з базою данних
+        :param readonly: з'єднання тільки для читання
+        :return: з'єднання
+        """
+        # cached_statements - кеш підготовлених запитів sqlite3 для кожного з'єднання
+        db = await aiosqlite.connect(self.db_file, cached_statements=256)
+        db.row_factory = aiosqlite.Row
+        await db.execute('PRAGMA journal_mode=WAL')
+        await db.execute('PRAGMA synchronous=NORMAL')
+        await db.execute('PRAGMA busy_timeout=5000')
+        if readonly:
+            await db.execute('PRAGMA query_only=1')
+        return db
+
+    async def open(self) -> None:
+        """
+        Відкриття пулу з'єднань та застосування міграцій (викликається при запуску бота)
+        Запити, що надійшли до завершення відкриття, чекають на нього
+        """
+        if self._open_lock is None:
+            self._open_lock = asyncio.Lock()
+        async with self._open_lock:
+            if self._writer is not None:
+                return
+            # Міграції виконуються через з'єднання для запису до відкриття з'єднань для читання
+            writer = await self._connect()
+            await self._migrate(writer)
+            self._reader_connections = list(await asyncio.gather(
+                *(self._connect(readonly=True) for _ in range(self.readers))
+            ))
+            self._writer_lock = asyncio.Lock()
+            self._readers = asyncio.Queue()
+            for db in self._reader_connections:
+                self._readers.put_nowait(db)
+            self._writer = writer
+
+    async def warm_up(self) -> None:
         """
+        Прогрів кешів після запуску: останні відповідності повідомлень операторів
+        та записи користувачів з відкритими зверненнями (застарілі відповідності видаляються)
+        """
+        try:
+            async with self._write() as db:
+                await self._prune_routes(db)
+            async with self._reader() as db:
+                async with db.execute('''
+                    SELECT operator_chat_id, message_id, telegram_user_id FROM message_routes
+                    ORDER BY created_at DESC LIMIT ?
+                ''', (self._routes.maxsize,)) as cursor:
+                    routes = await cursor.fetchall()
+                async with db.execute('''
+                    SELECT users.* FROM tickets
+                    JOIN users ON users.telegram_user_id = tickets.telegram_user_id
+                    WHERE tickets.status = 'open'
+                    LIMIT ?
+                ''', (self._cache.maxsize,)) as cursor:
+                    users = await cursor.fetchall()
+        except aiosqlite.Error as e:
+            print(f"Помилка при прогріві кешу: {e}")
+            return
+        # Найновіші відповідності додаються останніми, щоб кеш першими витісняв старіші
+        for operator_chat_id, message_id, telegram_user_id in reversed(routes):
+            self._routes[(operator_chat_id, message_id)] = telegram_user_id
+        for user_data in users:
+            self._cache_put(user_data['telegram_user_id'], dict(user_data))
+
+    async def close(self) -> None:
+        """Запис буфера змін та закриття пулу з'єднань (викликається при зупинці бота)"""
+        # дочікуємось записів, що вже виконуються, та записуємо залишок буфера
+        await self._write_behind.close()
+        if self._writer is None:
+            return
+        async with self._writer_lock:
+            for db in self._reader_connections:
+                await db.close()
+            await self._writer.close()
+        self._reader_connections = []
+        self._readers = None
+        self._writer = None
+
+    @asynccontextmanager
+    async def _reader(self, operation: str = "read") -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Отримання з'єднання для читання з пулу
+        :param operation: назва операції в метриках (довгі читання обліковуються окремо)
+        """
+        if self._writer is None:
+            await self.open()
+        started = time.perf_counter()
+        db = await self._readers.get()
+        try:
+            yield db
+        finally:
+            self._readers.put_nowait(db)
+            metrics.db.observe(operation, time.perf_counter() - started)
 
-        async with aiosqlite.connect(self.db_file) as db:
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_user_id TEXT NOT NULL,
-                    date_created TEXT,
-                    uuid TEXT,
-                    name TEXT,
-                    age INTEGER,
-                    location TEXT,
-                    event_details TEXT,
-                    help_type TEXT,
-                    description TEXT,
-                    blocked BOOLEAN DEFAULT 0
-                )
-            ''')
-            await db.commit()
+    @asynccontextmanager
+    async def _write(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Отримання з'єднання для запису, транзакція фіксується при виході"""
+        if self._writer is None:
+            await self.open()
+        started = time.perf_counter()
+        async with self._writer_lock:
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            finally:
+                metrics.db.observe("write", time.perf_counter() - started)
+
+    def _cache_put(self, telegram_user_id: str, user_data: Optional[Dict[str, Any]]) -> None:
+        """Збереження запису користувача в кеш"""
+        self._cache[telegram_user_id] = user_data
+        if user_data is not None and user_data.get('uuid'):
+            self._uuid_index[user_data['uuid']] = telegram_user_id
+
+    def _cache_get(self, telegram_user_id: str) -> Any:
+        """Отримання копії запису з кешу або _MISSING"""
+        user_data = self._cache.get(telegram_user_id, _MISSING)
+        if user_data is _MISSING:
+            self.cache_misses += 1
+            return _MISSING
+        self.cache_hits += 1
+        return None if user_data is None else dict(user_data)
+
+    def invalidate(self, telegram_user_id: str) -> None:
+        """Видалення запису користувача з кешу"""
+        self._write_epoch += 1
+        user_data = self._cache.pop(str(telegram_user_id), None)
+        if user_data is not None and user_data.get('uuid'):
+            self._uuid_index.pop(user_data['uuid'], None)
+
+    def cache_stats(self) -> Dict[str, int]:
+        """
+        Статистика кешу записів
+        :return: кількість влучань, промахів та записів у кеші
+        """
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "size": len(self._cache),
+        }
 
     async def update_user_data(self, telegram_user_id: int, field: str, value: Any) -> None:
         """
         Оновлення певного поля у користувача
+        Зміни накопичуються в буфері та записуються пакетом (див. flush)
         :param telegram_user_id: ID користувача
         :param field: поле для оновлення
         :param value: значення для оновлення
         """
+        if field not in USER_FIELDS:
+            raise ValueError(f"Невідоме поле користувача: {field}")
+        telegram_user_id = str(telegram_user_id)
+        self._pending.setdefault(telegram_user_id, {})[field] = value
+        # Оновлюємо запис у кеші одразу, щоб читання бачили нове значення
+        self._write_epoch += 1
+        user_data = self._cache.get(telegram_user_id)
+        if user_data is not None:
+            user_data[field] = value
+            self._cache_put(telegram_user_id, user_data)
+        self._write_behind.schedule()
+
+    async def flush(self) -> None:
+        """Запис усіх накопичених змін полів однією транзакцією"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self._flushing.append(pending)
+        # Групуємо користувачів за набором полів, щоб використати executemany
+        batches: Dict[tuple, list] = {}
+        for telegram_user_id, fields in pending.items():
+            columns = tuple(sorted(fields))
+            batches.setdefault(columns, []).append(
+                tuple(fields[column] for column in columns) + (telegram_user_id,)
+            )
         try:
-            async with aiosqlite.connect(self.db_file) as db:
-                await db.execute(f'''
-                    UPDATE users
-                    SET {field} = ?
-                    WHERE telegram_user_id = ?
-                ''', (value, telegram_user_id))
-                await db.commit()
+            async with self._write() as db:
+                for columns, rows in batches.items():
+                    assignments = ", ".join(f"{column} = ?" for column in columns)
+                    await db.executemany(f'''
+                        UPDATE users
+                        SET {assignments}
+                        WHERE telegram_user_id = ?
+                    ''', rows)
         except aiosqlite.Error as e:
-            print(f"Помилка при оновленні данних користувача: {e}")
+            # Повертаємо зміни в буфер, не перезаписуючи новіші значення
+            for telegram_user_id, fields in pending.items():
+                fields.update(self._pending.get(telegram_user_id, {}))
+                self._pending[telegram_user_id] = fields
+            self._write_behind.schedule()
+            print(f"Помилка при оновленні данних користувачів: {e}")
+        finally:
+            self._flushing = [item for item in self._flushing if item is not pending]
 
+    def _apply_pending(self, user_data: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Накладання ще не записаних змін на запис, прочитаний з бази"""
+        if user_data is not None:
+            # спочатку зміни, що записуються зараз, потім новіші з буфера
+            for pending in self._flushing + [self._pending]:
+                user_data.update(pending.get(user_data['telegram_user_id'], {}))
+        return user_data
 
     async def get_user_data(self, telegram_user_id: str) -> Dict[str, Any]:
         """
@@ -64,17 +435,24 @@ class UsersData:
         :param telegram_user_id: ID користувача
         :return: дані користувача
         """
+        telegram_user_id = str(telegram_user_id)
+        user_data = self._cache_get(telegram_user_id)
+        if user_data is not _MISSING:
+            return user_data
         try:
-            async with aiosqlite.connect(self.db_file) as db:
+            epoch = self._write_epoch
+            async with self._reader() as db:
                 async with db.execute('''
                     SELECT * FROM users
                     WHERE telegram_user_id = ?
                 ''', (telegram_user_id,)) as cursor:
                     # робимо словник з даних користувача
                     user_data = await cursor.fetchone()
-                    if user_data is None:
-                        return None
-                    return {cursor.description[i][0]: user_data[i] for i in range(len(cursor.description))}
+                    if user_data is not None:
+                        user_data = self._apply_pending(dict(user_data))
+            if epoch == self._write_epoch:
+                self._cache_put(telegram_user_id, user_data)
+            return None if user_data is None else dict(user_data)
         except aiosqlite.Error as e:
             print(f"Помилка при отриманні данних користувача: {e}")
             return None
@@ -86,8 +464,16 @@ class UsersData:
         :param uuid: uuid користувача
         :return: дані користувача
         """
+        telegram_user_id = self._uuid_index.get(uuid)
+        if telegram_user_id is not None:
+            user_data = self._cache_get(telegram_user_id)
+            if user_data is not _MISSING and user_data is not None:
+                return user_data
+        else:
+            self.cache_misses += 1
         try:
-            async with aiosqlite.connect(self.db_file) as db:
+            epoch = self._write_epoch
+            async with self._reader() as db:
                 async with db.execute('''
                     SELECT * FROM users
                     WHERE uuid = ?
@@ -96,46 +482,417 @@ class UsersData:
                     user_data = await cursor.fetchone()
                     if user_data is None:
                         return None
-                    return {cursor.description[i][0]: user_data[i] for i in range(len(cursor.description))}
+                    user_data = self._apply_pending(dict(user_data))
+            if epoch == self._write_epoch:
+                self._cache_put(user_data['telegram_user_id'], user_data)
+            return dict(user_data)
         except aiosqlite.Error as e:
             print(f"Помилка при отриманні данних користувача: {e}")
 
-    async def get_all_users_data(self) -> Dict[int, Dict[str, Any]]:
+    async def get_bot_state(self, key: str) -> Optional[str]:
         """
-        Отримання всіх данних користувачів
-        :return: дані користувачів
+        Отримання службового значення бота
+        :param key: ключ
+        :return: значення або None
+        """
+        try:
+            async with self._reader() as db:
+                async with db.execute('SELECT value FROM bot_state WHERE key = ?', (key,)) as cursor:
+                    row = await cursor.fetchone()
+                    return row[0] if row is not None else None
+        except aiosqlite.Error as e:
+            print(f"Помилка при отриманні службового значення {key}: {e}")
+            return None
+
+    async def set_bot_state(self, key: str, value: str) -> None:
+        """
+        Збереження службового значення бота
+        :param key: ключ
+        :param value: значення
+        """
+        try:
+            async with self._write() as db:
+                await db.execute('''
+                    INSERT INTO bot_state (key, value) VALUES (?, ?)
+                    ON CONFLICT (key) DO UPDATE SET value = excluded.value
+                ''', (key, value))
+        except aiosqlite.Error as e:
+            print(f"Помилка при збереженні службового значення {key}: {e}")
+
+    async def set_blocked(self, uuid: str, blocked: bool) -> Optional[str]:
+        """
+        Зміна статусу блокування користувача
+        :param uuid: uuid користувача
+        :param blocked: True - заблокувати, False - розблокувати
+        :return: telegram_user_id користувача, або None якщо користувача не знайдено чи статус вже був таким
         """
         try:
-            async with aiosqlite.connect(self.db_file) as db:
+            async with self._write() as db:
                 async with db.execute('''
-                    SELECT * FROM users
+                    UPDATE users SET blocked = ?1
+                    WHERE uuid = ?2 AND blocked IS NOT ?1
+                    RETURNING telegram_user_id
+                ''', (int(blocked), uuid)) as cursor:
+                    row = await cursor.fetchone()
+            if row is None:
+                return None
+            self.invalidate(row[0])
+            return row[0]
+        except aiosqlite.Error as e:
+            print(f"Помилка при зміні статусу блокування користувача: {e}")
+            return None
+
+    async def get_blocked_users(self) -> List[tuple]:
+        """
+        Отримання заблокованих користувачів
+        :return: список пар (telegram_user_id, uuid)
+        """
+        try:
+            async with self._reader() as db:
+                async with db.execute('''
+                    SELECT telegram_user_id, uuid FROM users WHERE blocked = 1
                 ''') as cursor:
-                    return {user['telegram_user_id']: user for user in await cursor.fetchall()}
+                    return [(row[0], row[1]) for row in await cursor.fetchall()]
         except aiosqlite.Error as e:
-            print(f"Помилка при отриманні всіх данних користувачів: {e}")
-            return {}
+            print(f"Помилка при отриманні заблокованих користувачів: {e}")
+            return []
 
-    async def add_user(self, telegram_user_id: str) -> bool:
+    async def add_message_routes(self, telegram_user_id: str, messages: Iterable[Tuple[int, int]]) -> None:
         """
-        Додавання користувача
+        Збереження відповідності повідомлень операторів користувачу
         :param telegram_user_id: ID користувача
-        :return: True якщо користувача успішно додано, False якщо користувач вже існує
+        :param messages: пари (operator_chat_id, message_id)
+        """
+        telegram_user_id = str(telegram_user_id)
+        now = time.time()
+        rows = [(chat_id, message_id, telegram_user_id, now) for chat_id, message_id in messages]
+        if not rows:
+            return
+        for chat_id, message_id, _, _ in rows:
+            self._routes[(chat_id, message_id)] = telegram_user_id
+        try:
+            async with self._write() as db:
+                await db.executemany('''
+                    INSERT OR REPLACE INTO message_routes (operator_chat_id, message_id, telegram_user_id, created_at)
+                    VALUES (?, ?, ?, ?)
+                ''', rows)
+                if now - self._routes_pruned >= ROUTES_PRUNE_INTERVAL:
+                    await self._prune_routes(db)
+        except aiosqlite.Error as e:
+            print(f"Помилка при збереженні відповідності повідомлень: {e}")
 
+    async def _prune_routes(self, db: aiosqlite.Connection) -> None:
         """
+        Видалення відповідностей, старших за ROUTES_RETENTION_DAYS (у транзакції запису)
+        :param db: з'єднання для запису
+        """
+        self._routes_pruned = time.time()
+        await db.execute(
+            'DELETE FROM message_routes WHERE created_at < ?',
+            (self._routes_pruned - self.routes_retention,)
+        )
+
+    async def get_message_route(self, operator_chat_id: int, message_id: int) -> Optional[str]:
+        """
+        Отримання користувача, якому відповідає повідомлення в чаті оператора
+        :param operator_chat_id: ID чату оператора
+        :param message_id: ID повідомлення
+        :return: telegram_user_id або None
+        """
+        telegram_user_id = self._routes.get((operator_chat_id, message_id))
+        if telegram_user_id is not None:
+            return telegram_user_id
         try:
-            # перевірка чи користувач вже існує
-            if await self.get_user_data(telegram_user_id) is not None:
-                return False
-            date_created = datetime.now().strftime('%d/%m/%Y')
-            async with aiosqlite.connect(self.db_file) as db:
+            async with self._reader() as db:
+                async with db.execute('''
+                    SELECT telegram_user_id FROM message_routes
+                    WHERE operator_chat_id = ? AND message_id = ?
+                ''', (operator_chat_id, message_id)) as cursor:
+                    row = await cursor.fetchone()
+            if row is None:
+                return None
+            self._routes[(operator_chat_id, message_id)] = row[0]
+            return row[0]
+        except aiosqlite.Error as e:
+            print(f"Помилка при отриманні відповідності повідомлення: {e}")
+            return None
+
+    async def add_ticket(self, telegram_user_id: str, operator_id: Optional[int]) -> Optional[int]:
+        """
+        Створення звернення користувача
+        :param telegram_user_id: ID користувача
+        :param operator_id: ID оператора або None, якщо звернення не призначене
+        :return: ID звернення (існуючого, якщо відкрите звернення вже є)
+        """
+        telegram_user_id = str(telegram_user_id)
+        now = time.time()
+        try:
+            async with self._write() as db:
+                async with db.execute('''
+                    INSERT INTO tickets (telegram_user_id, operator_id, created_at, updated_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT DO NOTHING
+                    RETURNING id
+                ''', (telegram_user_id, operator_id, now, now)) as cursor:
+                    row = await cursor.fetchone()
+                if row is None:
+                    async with db.execute('''
+                        SELECT id FROM tickets WHERE telegram_user_id = ? AND status = 'open'
+                    ''', (telegram_user_id,)) as cursor:
+                        row = await cursor.fetchone()
+            return row[0] if row is not None else None
+        except aiosqlite.Error as e:
+            print(f"Помилка при створенні звернення: {e}")
+            return None
+
+    async def update_ticket(self, ticket_id: int, operator_id: Optional[int] = None, status: str = 'open') -> None:
+        """
+        Зміна оператора або статусу звернення
+        :param ticket_id: ID звернення
+        :param operator_id: ID оператора або None
+        :param status: статус звернення (open або closed)
+        """
+        try:
+            async with self._write() as db:
                 await db.execute('''
-                    INSERT INTO users (telegram_user_id, date_created)
-                    VALUES (?, ?)
-                ''', (str(telegram_user_id), str(date_created)))
-                await db.commit()
-            user_data = await self.get_user_data(telegram_user_id)
-            await self.update_user_data(telegram_user_id, 'uuid', f'{date_created} {user_data["id"]}')
+                    UPDATE tickets SET operator_id = ?, status = ?, updated_at = ? WHERE id = ?
+                ''', (operator_id, status, time.time(), ticket_id))
+        except aiosqlite.Error as e:
+            print(f"Помилка при оновленні звернення: {e}")
+
+    async def get_open_tickets(self) -> List[Dict[str, Any]]:
+        """
+        Отримання всіх відкритих звернень
+        :return: звернення з uuid користувачів у порядку створення
+        """
+        try:
+            async with self._reader() as db:
+                async with db.execute('''
+                    SELECT tickets.id, tickets.telegram_user_id, tickets.operator_id,
+                           tickets.created_at, users.uuid
+                    FROM tickets LEFT JOIN users ON users.telegram_user_id = tickets.telegram_user_id
+                    WHERE tickets.status = 'open'
+                    ORDER BY tickets.id
+                ''') as cursor:
+                    return [dict(row) for row in await cursor.fetchall()]
+        except aiosqlite.Error as e:
+            print(f"Помилка при отриманні відкритих звернень: {e}")
+            return []
+
+    async def get_last_ticket_operator(self, telegram_user_id: str) -> Optional[int]:
+        """
+        Отримання оператора останнього звернення користувача
+        :param telegram_user_id: ID користувача
+        :return: ID оператора або None
+        """
+        try:
+            async with self._reader() as db:
+                async with db.execute('''
+                    SELECT operator_id FROM tickets
+                    WHERE telegram_user_id = ? AND operator_id IS NOT NULL
+                    ORDER BY id DESC LIMIT 1
+                ''', (str(telegram_user_id),)) as cursor:
+                    row = await cursor.fetchone()
+                    return row[0] if row is not None else None
+        except aiosqlite.Error as e:
+            print(f"Помилка при отриманні оператора звернення: {e}")
+            return None
+
+    async def add_inbox_entry(self, telegram_user_id: str, urgent: bool) -> None:
+        """
+        Збереження анкети, заповненої в неробочий час
+        :param telegram_user_id: ID користувача
+        :param urgent: користувач просив термінову допомогу
+        """
+        try:
+            async with self._write() as db:
+                await db.execute('''
+                    INSERT INTO inbox (telegram_user_id, urgent, created_at) VALUES (?, ?, ?)
+                ''', (str(telegram_user_id), int(urgent), time.time()))
+        except aiosqlite.Error as e:
+            print(f"Помилка при збереженні анкети у вхідні: {e}")
+
+    async def get_pending_inbox(self) -> List[Dict[str, Any]]:
+        """
+        Отримання недоставлених анкет разом з даними користувачів одним запитом
+        :return: анкети за пріоритетом: спочатку термінові, потім за часом створення
+        """
+        try:
+            async with self._reader() as db:
+                async with db.execute('''
+                    SELECT inbox.id, inbox.telegram_user_id, inbox.urgent, inbox.created_at,
+                           users.uuid, users.name, users.age, users.location,
+                           users.event_details, users.help_type, users.description
+                    FROM inbox LEFT JOIN users ON users.telegram_user_id = inbox.telegram_user_id
+                    WHERE inbox.delivered_at IS NULL
+                    ORDER BY inbox.urgent DESC, inbox.created_at
+                ''') as cursor:
+                    return [dict(row) for row in await cursor.fetchall()]
+        except aiosqlite.Error as e:
+            print(f"Помилка при отриманні вхідних анкет: {e}")
+            return []
+
+    async def mark_inbox_delivered(self, entry_ids: List[int]) -> None:
+        """
+        Позначення анкет доставленими
+        :param entry_ids: ID записів
+        """
+        try:
+            async with self._write() as db:
+                await db.executemany('''
+                    UPDATE inbox SET delivered_at = ? WHERE id = ?
+                ''', [(time.time(), entry_id) for entry_id in entry_ids])
+        except aiosqlite.Error as e:
+            print(f"Помилка при позначенні анкет доставленими: {e}")
+
+    async def add_messages(self, rows: List[Tuple[str, str, Optional[int], str, Optional[str], float]]) -> bool:
+        """
+        Збереження пакета повідомлень в історію переписки
+        :param rows: (telegram_user_id, direction, operator_id, content_type, text, created_at)
+        :return: True якщо пакет записано
+        """
+        try:
+            async with self._write() as db:
+                await db.executemany('''
+                    INSERT INTO messages (telegram_user_id, direction, operator_id, content_type, text, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', rows)
             return True
+        except aiosqlite.Error as e:
+            print(f"Помилка при збереженні історії повідомлень: {e}")
+            return False
+
+    async def get_messages(self, telegram_user_id: str, limit: int, offset: int = 0) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Отримання сторінки історії переписки користувача, новіші повідомлення першими
+        :param telegram_user_id: ID користувача
+        :param limit: кількість повідомлень на сторінці
+        :param offset: кількість пропущених повідомлень
+        :return: загальна кількість повідомлень користувача та повідомлення сторінки
+        """
+        try:
+            async with self._reader() as db:
+                async with db.execute('''
+                    SELECT COUNT(*) FROM messages WHERE telegram_user_id = ?
+                ''', (str(telegram_user_id),)) as cursor:
+                    total = (await cursor.fetchone())[0]
+                async with db.execute('''
+                    SELECT * FROM messages
+                    WHERE telegram_user_id = ?
+                    ORDER BY id DESC
+                    LIMIT ? OFFSET ?
+                ''', (str(telegram_user_id), limit, offset)) as cursor:
+                    return total, [dict(row) for row in await cursor.fetchall()]
+        except aiosqlite.Error as e:
+            print(f"Помилка при отриманні історії повідомлень: {e}")
+            return 0, []
+
+    async def search_messages(self, query: str, limit: int, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Повнотекстовий пошук в історії переписки, новіші повідомлення першими
+        :param query: запит FTS5
+        :param limit: кількість повідомлень на сторінці
+        :param offset: кількість пропущених повідомлень
+        :return: знайдені повідомлення з uuid користувачів
+        """
+        try:
+            async with self._reader() as db:
+                async with db.execute('''
+                    SELECT messages.*, users.uuid
+                    FROM messages_fts
+                    JOIN messages ON messages.id = messages_fts.rowid
+                    LEFT JOIN users ON users.telegram_user_id = messages.telegram_user_id
+                    WHERE messages_fts MATCH ?
+                    ORDER BY messages_fts.rowid DESC
+                    LIMIT ? OFFSET ?
+                ''', (query, limit, offset)) as cursor:
+                    return [dict(row) for row in await cursor.fetchall()]
+        except aiosqlite.Error as e:
+            print(f"Помилка при пошуку в історії повідомлень: {e}")
+            return []
+
+    async def get_all_users_data(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Отримання всіх данних користувачів
+        Для великих таблиць використовуйте iter_users, щоб не тримати всі записи в пам'яті
+        :return: дані користувачів за telegram_user_id
+        """
+        users = {}
+        async for chunk in self.iter_users():
+            for user in chunk:
+                users[user['telegram_user_id']] = user
+        return users
+
+    async def iter_users(
+        self,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        chunk_size: int = 500,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Потокове читання користувачів пакетами (курсор читається через fetchmany)
+        :param date_from: перша дата створення у форматі РРРРММДД (включно)
+        :param date_to: остання дата створення у форматі РРРРММДД (включно)
+        :param chunk_size: кількість записів у пакеті
+        :return: асинхронний ітератор пакетів записів
+        :raises aiosqlite.Error: при помилці читання (неповний експорт не повинен виглядати як повний)
+        """
+        if date_from is None and date_to is None:
+            # без фільтра - за первинним ключем
+            query, params = 'SELECT * FROM users ORDER BY id', ()
+        else:
+            # той самий вираз, що й в індексі idx_users_date_key, тому діапазон читається за індексом
+            query = f'''
+                SELECT * FROM users
+                WHERE {DATE_KEY} BETWEEN ? AND ?
+                ORDER BY {DATE_KEY}, id
+            '''
+            params = (date_from or '00000000', date_to or '99999999')
+        async with self._reader("export") as db:
+            async with db.execute(query, params) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield [self._apply_pending(dict(row)) for row in rows]
+
+    async def add_user(self, telegram_user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Додавання користувача однією транзакцією (INSERT ... ON CONFLICT ... RETURNING)
+        uuid обчислюється в тому ж запиті з наступного значення AUTOINCREMENT
+        :param telegram_user_id: ID користувача
+        :return: дані нового користувача, або None якщо користувач вже існує
+
+        """
+        telegram_user_id = str(telegram_user_id)
+        # користувач вже є в кеші - запит до бази не потрібен
+        if self._cache.get(telegram_user_id) is not None:
+            return None
+        try:
+            date_created = datetime.now().strftime('%d/%m/%Y')
+            async with self._write() as db:
+                async with db.execute('''
+                    INSERT INTO users (telegram_user_id, date_created, uuid)
+                    SELECT ?1, ?2, ?2 || ' ' || (
+                        COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'users'), 0) + 1
+                    )
+                    -- без цієї перевірки конфлікт все одно витрачає значення AUTOINCREMENT
+                    WHERE NOT EXISTS (SELECT 1 FROM users WHERE telegram_user_id = ?1)
+                    ON CONFLICT (telegram_user_id) DO NOTHING
+                    RETURNING *
+                ''', (telegram_user_id, date_created)) as cursor:
+                    user_data = await cursor.fetchone()
+                if user_data is None:
+                    return None
+                user_data = dict(user_data)
+                # запобіжник: uuid має відповідати фактичному id
+                uuid = f'{date_created} {user_data["id"]}'
+                if user_data['uuid'] != uuid:
+                    await db.execute('UPDATE users SET uuid = ? WHERE id = ?', (uuid, user_data['id']))
+                    user_data['uuid'] = uuid
+            self._write_epoch += 1
+            self._cache_put(telegram_user_id, user_data)
+            return dict(user_data)
 
         except aiosqlite.Error as e:
             print(f"Помилка при додаванні користувача: {e}")
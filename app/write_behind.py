@@ -0,0 +1,65 @@
+import asyncio
+from typing import Awaitable, Callable, Optional, Set
+
+
+class WriteBehind:
+    """
+    Планування відкладеного запису буфера в базу
+
+    Власник буфера передає корутину flush, яка забирає накопичені дані та
+    записує їх. Запис виконується через інтервал після першої зміни або
+    одразу (наприклад, при заповненні буфера). Усі запущені записи
+    відстежуються, тому close() дочікується записів, що вже виконуються,
+    і лише потім записує залишок буфера.
+    """
+
+    def __init__(self, flush: Callable[[], Awaitable[None]], interval: float) -> None:
+        """
+        Ініціалізація
+
+        :param flush: корутина запису буфера
+        :param interval: затримка відкладеного запису у секундах
+        """
+        self._flush = flush
+        self.interval = interval
+        # Задача, що чекає інтервал перед записом (None - запис не заплановано)
+        self._timer: Optional[asyncio.Task] = None
+        # Усі задачі запису, включно з тими, що вже пишуть у базу
+        self._tasks: Set[asyncio.Task] = set()
+        self._closing = False
+
+    def schedule(self) -> None:
+        """Запланувати запис через інтервал, якщо він ще не запланований"""
+        if self._timer is None and not self._closing:
+            self._timer = self._spawn(self._flush_later())
+
+    def flush_soon(self) -> None:
+        """Запустити запис одразу у фоні"""
+        if not self._closing:
+            self._spawn(self._flush())
+
+    def _spawn(self, coro: Awaitable[None]) -> asyncio.Task:
+        """Створення задачі із збереженням посилання до її завершення"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_later(self) -> None:
+        """Запис буфера після інтервалу"""
+        try:
+            await asyncio.sleep(self.interval)
+        finally:
+            # новий запис можна планувати вже під час цього запису
+            self._timer = None
+        await self._flush()
+
+    async def close(self) -> None:
+        """Скасування очікування, завершення записів, що виконуються, та запис залишку буфера"""
+        self._closing = True
+        if self._timer is not None:
+            # таймер ще чекає інтервал - запис буде виконано нижче
+            self._timer.cancel()
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._flush()
@@ -0,0 +1,95 @@
+"""
+Бенчмарк історії переписки: пакетний запис, сторінки /history та пошук FTS5 /search
+
+Запуск: python -m benchmarks.bench_history [кількість_повідомлень] [кількість_користувачів]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from itertools import accumulate
+
+from app.history import build_search_query
+from app.users_data import UsersData
+
+
+SYLLABLES = "ба ве ги до жу за ки ло ми но по ру се ти фу ха це чи ша юр як мо ль ні ра ст пр".split()
+
+
+def vocabulary(size: int):
+    """Синтетичний словник з розподілом частот слів за законом Ципфа, як у живій мові"""
+    rng = random.Random(1)
+    words = list(dict.fromkeys(
+        "".join(rng.choices(SYLLABLES, k=rng.randint(2, 5))) for _ in range(size * 2)
+    ))[:size]
+    cum_weights = list(accumulate(1 / rank for rank in range(1, len(words) + 1)))
+    return words, cum_weights
+
+
+WORDS, CUM_WEIGHTS = vocabulary(20000)
+
+
+def random_words(k: int):
+    """Випадкові слова з урахуванням частоти"""
+    return random.choices(WORDS, cum_weights=CUM_WEIGHTS, k=k)
+
+
+def message_rows(count: int, users: int, batch: int):
+    """Синтетичні повідомлення пакетами"""
+    now = time.time()
+    rows = []
+    for i in range(count):
+        text = " ".join(random_words(random.randint(3, 12)))
+        rows.append((str(1000000 + i % users), "in" if i % 3 else "out", None if i % 3 else 900,
+                     "text", text, now + i / 1000))
+        if len(rows) == batch:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
+
+async def measure(name: str, queries: int, query) -> None:
+    """Середня та максимальна затримка запиту"""
+    timings = []
+    for i in range(queries):
+        started = time.perf_counter()
+        await query(i)
+        timings.append(time.perf_counter() - started)
+    print(f"  {name:<32} середня {sum(timings) / len(timings) * 1000:>7.2f} мс, "
+          f"максимальна {max(timings) * 1000:>7.2f} мс")
+
+
+async def run(db_file: str, count: int, users: int) -> None:
+    users_data = UsersData(db_file)
+    await users_data.open()
+
+    started = time.perf_counter()
+    for rows in message_rows(count, users, 500):
+        await users_data.add_messages(rows)
+    elapsed = time.perf_counter() - started
+    print(f"Запис {count} повідомлень пакетами по 500: {elapsed:.1f} с ({count / elapsed:.0f} повідомлень/с)")
+
+    print(f"Запити ({users} користувачів):")
+    await measure("/history, сторінка 1", 200,
+                  lambda i: users_data.get_messages(str(1000000 + random.randrange(users)), 10))
+    await measure("/history, сторінка 5", 200,
+                  lambda i: users_data.get_messages(str(1000000 + random.randrange(users)), 10, 40))
+    await measure("/search одне слово", 200,
+                  lambda i: users_data.search_messages(build_search_query(random_words(1)[0]), 11))
+    await measure("/search найчастіше слово", 200,
+                  lambda i: users_data.search_messages(build_search_query(WORDS[0]), 11))
+    await measure("/search два слова, сторінка 10", 200,
+                  lambda i: users_data.search_messages(build_search_query(" ".join(random_words(2))), 11, 90))
+    await measure("/search префікс (слово*)", 200,
+                  lambda i: users_data.search_messages(build_search_query(random_words(1)[0] + "*"), 11))
+    await users_data.close()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "bench.sqlite"), count, users))
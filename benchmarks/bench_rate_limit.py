@@ -0,0 +1,54 @@
+"""
+Мікробенчмарк накладних витрат RateLimitMiddleware на одне оновлення
+
+Запуск: python -m benchmarks.bench_rate_limit [кількість_оновлень] [кількість_користувачів]
+"""
+import asyncio
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from app.middleware import RateLimitMiddleware
+
+
+async def handler(event, data):
+    return None
+
+
+async def answer(*args, **kwargs):
+    return None
+
+
+async def run(updates: int, users: int) -> None:
+    middleware = RateLimitMiddleware()
+    events = [SimpleNamespace(from_user=SimpleNamespace(id=i), answer=answer) for i in range(users)]
+    data = {"config": {"OPERATOR_IDS": frozenset()}, "raw_state": None}
+
+    started = time.perf_counter()
+    for i in range(updates):
+        await handler(events[i % users], data)
+    baseline = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for i in range(updates):
+        await middleware(handler, events[i % users], data)
+    elapsed = time.perf_counter() - started
+
+    # Пам'ять стану вимірюємо окремо, tracemalloc сповільнює виконання
+    middleware = RateLimitMiddleware()
+    tracemalloc.start()
+    for i in range(users):
+        await middleware(handler, events[i], data)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"оновлень: {updates}, користувачів: {users}")
+    print(f"накладні витрати middleware: {(elapsed - baseline) / updates * 1e6:.2f} мкс/оновлення")
+    print(f"користувачів у стані: {len(middleware.buckets)}, пам'ять: {memory / 1024 / 1024:.1f} МБ")
+
+
+if __name__ == '__main__':
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    asyncio.run(run(updates, users))
@@ -0,0 +1,59 @@
+"""
+Бенчмарк запитів UsersData: з'єднання на кожен виклик проти пулу з'єднань та кешу
+
+Запуск: python -m benchmarks.bench_users_data [кількість_запитів] [паралельність]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import aiosqlite
+
+from app.users_data import UsersData
+
+
+async def get_user_data_connect_per_call(db_file: str, telegram_user_id: str):
+    """Старий спосіб: нове з'єднання на кожен запит"""
+    async with aiosqlite.connect(db_file) as db:
+        async with db.execute('SELECT * FROM users WHERE telegram_user_id = ?', (telegram_user_id,)) as cursor:
+            return await cursor.fetchone()
+
+
+async def run(users_data: UsersData, queries: int, concurrency: int) -> None:
+    db_file = users_data.db_file
+    await users_data.open()
+    for i in range(1000):
+        await users_data.add_user(str(i))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def measure(name, query):
+        async def one(i):
+            async with semaphore:
+                await query(str(i % 1000))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(queries)))
+        elapsed = time.perf_counter() - started
+        print(f"{name:<20} {queries / elapsed:>10.0f} запитів/с")
+
+    await measure("connect-per-call", lambda uid: get_user_data_connect_per_call(db_file, uid))
+
+    async def get_user_data_uncached(uid):
+        users_data.invalidate(uid)
+        return await users_data.get_user_data(uid)
+
+    await measure("пул з'єднань", get_user_data_uncached)
+    await measure("пул + кеш", users_data.get_user_data)
+    print(f"статистика кешу: {users_data.cache_stats()}")
+    await users_data.close()
+
+
+if __name__ == '__main__':
+    queries = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    with tempfile.TemporaryDirectory() as tmp:
+        users_data = UsersData(os.path.join(tmp, "bench.sqlite"))
+        asyncio.run(run(users_data, queries, concurrency))
@@ -0,0 +1,65 @@
+"""
+Бенчмарк пошуку користувачів до та після міграції з індексами
+
+Запуск: python -m benchmarks.bench_users_index [кількість_рядків] [кількість_запитів]
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from app.users_data import MIGRATIONS, UsersData
+
+
+def measure(db_file: str, lookups: int, rows: int) -> None:
+    """Вимірювання швидкості пошуку за telegram_user_id та uuid"""
+    db = sqlite3.connect(db_file)
+    ids = [random.randint(1, rows) for _ in range(lookups)]
+    for column, key in (("telegram_user_id", lambda i: str(1000000 + i)),
+                        ("uuid", lambda i: f"01/01/2025 {i}")):
+        started = time.perf_counter()
+        for i in ids:
+            db.execute(f'SELECT * FROM users WHERE {column} = ?', (key(i),)).fetchone()
+        elapsed = time.perf_counter() - started
+        print(f"  {column:<18} {lookups / elapsed:>10.0f} запитів/с")
+    db.close()
+
+
+async def migrate(db_file: str) -> None:
+    """Застосування міграцій так само, як при запуску бота"""
+    users_data = UsersData(db_file)
+    await users_data.open()
+    await users_data.close()
+
+
+def main(rows: int, lookups: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "bench.sqlite")
+        # База зі старою схемою без індексів (версія 1)
+        db = sqlite3.connect(db_file)
+        db.executescript(MIGRATIONS[0] + 'PRAGMA user_version = 1;')
+        db.executemany(
+            'INSERT INTO users (telegram_user_id, date_created, uuid) VALUES (?, ?, ?)',
+            ((str(1000000 + i), "01/01/2025", f"01/01/2025 {i}") for i in range(1, rows + 1))
+        )
+        db.commit()
+        db.close()
+
+        print(f"До міграції ({rows} рядків):")
+        measure(db_file, lookups, rows)
+
+        started = time.perf_counter()
+        asyncio.run(migrate(db_file))
+        print(f"Міграція: {time.perf_counter() - started:.2f} с")
+
+        print(f"Після міграції ({rows} рядків):")
+        measure(db_file, lookups, rows)
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    main(rows, lookups)
@@ -0,0 +1,372 @@
+"""
+Навантажувальний тест бота з локальним фейковим сервером Telegram Bot API
+
+Бот запускається повністю (app.bot.main) у тимчасовій директорії з окремими
+базами даних, а запити до Bot API надсилаються на локальний aiohttp сервер,
+що імітує sendMessage, forwardMessage, copyMessage, getUpdates та setWebhook.
+Синтетичні користувачі проходять сценарій /start -> меню -> анкета UserForm ->
+ручний режим, після чого оператор відповідає на повідомлення користувача.
+Кожен користувач надсилає наступне повідомлення лише після обробки попереднього.
+
+Профіль production (за замовчуванням) залишає обмеження черги вихідних
+повідомлень як у робочому боті (OUTBOUND_RATE, OUTBOUND_CHAT_INTERVAL), тому
+тест показує затримки, спричинені чергою; час очікування в черзі виводиться
+окремо для кожної смуги. Профіль unlimited вимикає ці обмеження і вимірює
+лише обробку оновлень.
+
+Запуск: python -m benchmarks.loadtest [користувачів] [одночасно] [polling|webhook] [production|unlimited]
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import resource
+import signal
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from itertools import count
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+
+# Сценарій користувача: (крок, текст повідомлення)
+SCRIPT = [
+    ("start", "/start"),
+    ("menu", "2️⃣ Психологічна допомога"),
+    ("form", "Тарас"),
+    ("form", "34"),
+    ("form", "Київ"),
+    ("form", "Обстріл будинку"),
+    ("form", "Консультація психолога"),
+    ("manual", "Доброго дня, коли можна поговорити?"),
+    ("manual", "Я можу після 18:00"),
+    ("manual", "Дякую"),
+]
+# Кількість операторів, між якими розподіляються звернення
+OPERATORS = 20
+OPERATOR_BASE_ID = 9_000_000
+# Username синтетичного користувача в заголовку повідомлення операторам
+USERNAME = re.compile(r"@user(\d+)\b")
+# Профілі тесту
+PROFILES = ("production", "unlimited")
+# Максимальний час очікування обробки одного оновлення у секундах
+UPDATE_TIMEOUT = 30
+
+
+def free_port() -> int:
+    """Вільний TCP порт на localhost"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль відсортованого списку"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, math.ceil(q * len(values)) - 1)]
+
+
+class FakeBotAPI:
+    """Локальна заміна Telegram Bot API"""
+
+    def __init__(self) -> None:
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+        self.ready = asyncio.Event()
+        self.calls: Counter = Counter()
+        # Оновлення, що очікують на getUpdates
+        self.updates: List[Dict[str, Any]] = []
+        self._updates_event = asyncio.Event()
+        # Час видачі оновлення боту, update_id -> perf_counter
+        self.served: Dict[int, float] = {}
+        # Останнє повідомлення користувача в чаті оператора: user_id -> (чат оператора, message_id)
+        self.forwarded: Dict[int, Tuple[int, int]] = {}
+        # Сигнал першої доставки повідомлення користувача оператору: user_id -> подія
+        self.delivered: Dict[int, asyncio.Event] = defaultdict(asyncio.Event)
+        self._message_ids = count(1)
+
+    def stop(self) -> None:
+        """Завершення очікуючих запитів getUpdates"""
+        self._updates_event.set()
+
+    def push_update(self, update: Dict[str, Any]) -> None:
+        """Додавання оновлення в чергу getUpdates"""
+        self.updates.append(update)
+        self._updates_event.set()
+
+    def _message(self, chat_id: int, text: Optional[str] = None) -> Dict[str, Any]:
+        """Повідомлення бота у відповіді API"""
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "loadtest"},
+        }
+        if text is not None:
+            message["text"] = text
+        return message
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await request.post()
+        self.calls[method] += 1
+
+        if method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method in ("sendMessage", "sendPhoto", "sendDocument"):
+            result = self._message(int(params["chat_id"]), params.get("text"))
+            # повідомлення користувача приходять операторам разом із заголовком, де є username
+            mention = USERNAME.search(params.get("text") or "")
+            if mention is not None and result["chat"]["id"] >= OPERATOR_BASE_ID:
+                self.forwarded[int(mention.group(1))] = (result["chat"]["id"], result["message_id"])
+                self.delivered[int(mention.group(1))].set()
+        elif method == "forwardMessage":
+            result = self._message(int(params["chat_id"]))
+            self.forwarded[int(params["from_chat_id"])] = (result["chat"]["id"], result["message_id"])
+            self.delivered[int(params["from_chat_id"])].set()
+        elif method == "copyMessage":
+            result = {"message_id": next(self._message_ids)}
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "loadtest", "username": "loadtest_bot"}
+        else:
+            # sendChatAction, deleteWebhook, setWebhook та інші службові запити
+            if method == "setWebhook":
+                self.ready.set()
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params) -> List[Dict[str, Any]]:
+        """Long polling: видача оновлень після offset"""
+        self.ready.set()
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 100))
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates:
+            self._updates_event.clear()
+            try:
+                await asyncio.wait_for(self._updates_event.wait(), float(params.get("timeout", 10)))
+            except asyncio.TimeoutError:
+                return []
+        batch = self.updates[:limit]
+        now = time.perf_counter()
+        for update in batch:
+            self.served.setdefault(update["update_id"], now)
+        return batch
+
+
+class LoadTest:
+    """Відтворення сценарію синтетичних користувачів"""
+
+    def __init__(self, api: FakeBotAPI, mode: str, webhook_url: str, webhook_secret: str) -> None:
+        self.api = api
+        self.mode = mode
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._update_ids = count(1)
+        self._message_ids = count(1)
+        # update_id -> (крок сценарію, future завершення обробки)
+        self._pending: Dict[int, Tuple[str, asyncio.Future]] = {}
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.lost = 0
+        # Користувачі, повідомлення яких не дійшли до операторів за UPDATE_TIMEOUT
+        self.undelivered = 0
+
+    async def middleware(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any]
+    ) -> Any:
+        """Зовнішній middleware оновлень: фіксує завершення обробки"""
+        try:
+            return await handler(event, data)
+        finally:
+            pending = self._pending.pop(event.update_id, None)
+            if pending is not None:
+                step, future = pending
+                self.latencies[step].append(time.perf_counter() - self.api.served[event.update_id])
+                future.set_result(None)
+
+    def _update(self, user_id: int, text: str, reply_to: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Оновлення з текстовим повідомленням користувача"""
+        message = {
+            "message_id": next(self._message_ids),
+            # дата в секундах, як у Telegram: округлюємо вгору, щоб оновлення
+            # не вважалися накопиченими до запуску бота
+            "date": math.ceil(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"},
+            "text": text,
+        }
+        if reply_to is not None:
+            message["reply_to_message"] = reply_to
+        return {"update_id": next(self._update_ids), "message": message}
+
+    async def send(self, step: str, update: Dict[str, Any]) -> None:
+        """Надсилання оновлення боту та очікування завершення його обробки"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending[update["update_id"]] = (step, future)
+        if self.mode == "webhook":
+            self.api.served[update["update_id"]] = time.perf_counter()
+            async with self.session.post(
+                self.webhook_url, json=update,
+                headers={"X-Telegram-Bot-Api-Secret-Token": self.webhook_secret},
+            ) as response:
+                response.raise_for_status()
+        else:
+            self.api.push_update(update)
+        try:
+            await asyncio.wait_for(future, UPDATE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._pending.pop(update["update_id"], None)
+            self.lost += 1
+
+    async def user(self, user_id: int) -> None:
+        """Сценарій одного користувача"""
+        for step, text in SCRIPT:
+            await self.send(step, self._update(user_id, text))
+        # Повідомлення операторам надсилаються у фоні, тому чекаємо доставку перед відповіддю оператора
+        try:
+            await asyncio.wait_for(self.api.delivered[user_id].wait(), UPDATE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.undelivered += 1
+        # Оператор відповідає на останнє повідомлення користувача у своєму чаті
+        forwarded = self.api.forwarded.get(user_id)
+        if forwarded is not None:
+            operator_id, message_id = forwarded
+            reply_to = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": operator_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "loadtest"},
+                "text": "Дякую",
+            }
+            await self.send("operator", self._update(operator_id, "Добрий день! Зателефонуємо о 18:00", reply_to))
+
+    async def run(self, users: int, concurrency: int) -> float:
+        """
+        Відтворення сценарію для всіх користувачів
+
+        :return: тривалість у секундах
+        """
+        user_ids = iter(range(1, users + 1))
+
+        async def worker():
+            for user_id in user_ids:
+                await self.user(user_id)
+
+        self.session = aiohttp.ClientSession()
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            return time.perf_counter() - started
+        finally:
+            await self.session.close()
+
+
+def configure(mode: str, profile: str, api_port: int, webhook_port: int) -> None:
+    """Змінні середовища бота (до імпорту app.bot)"""
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "123456:loadtest",
+        "OPERATOR_IDS": ",".join(str(OPERATOR_BASE_ID + i) for i in range(OPERATORS)),
+        "BOT_MODE": mode,
+        "WEBHOOK_URL": f"http://127.0.0.1:{webhook_port}",
+        "WEBHOOK_SECRET": "loadtest",
+        "WEBHOOK_HOST": "127.0.0.1",
+        "PORT": str(webhook_port),
+    })
+    # Захист від спаму не є предметом вимірювання, але його можна повернути, задавши змінні явно
+    limits = {
+        "RATE_LIMIT_MESSAGES": "1000000",
+        "RATE_LIMIT_MANUAL_MESSAGES": "1000000",
+        "USER_QUEUE_DEPTH": "1000000",
+    }
+    if profile == "unlimited":
+        # обмеження Telegram на швидкість надсилання
+        limits.update({"OUTBOUND_RATE": "1000000", "OUTBOUND_CHAT_INTERVAL": "0"})
+    for name, value in limits.items():
+        os.environ.setdefault(name, value)
+
+
+async def main(users: int, concurrency: int, mode: str, profile: str, api_port: int, webhook_port: int) -> None:
+    import app.bot as bot_module
+    from app import inbox
+    from app.metrics import metrics
+    from app.outbound import LANE_NAMES
+
+    # Сценарій перевіряє робочі години (сповіщення операторів, а не дайджест)
+    inbox.WORK_HOURS_START, inbox.WORK_HOURS_END = 0, 23 + inbox.TIMEZONE_OFFSET
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+
+    api = FakeBotAPI()
+    runner = web.AppRunner(api.app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", api_port).start()
+    bot_module.bot.session.api = TelegramAPIServer.from_base(f"http://127.0.0.1:{api_port}")
+
+    load_test = LoadTest(api, mode, f"http://127.0.0.1:{webhook_port}{bot_module.WEBHOOK_PATH}",
+                         os.environ["WEBHOOK_SECRET"])
+    bot_module.dp.update.outer_middleware(load_test.middleware)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    bot_task = asyncio.create_task(bot_module.main())
+    await asyncio.wait_for(api.ready.wait(), 60)
+    elapsed = await load_test.run(users, concurrency)
+
+    # Зупинка бота так само, як при Ctrl+C
+    os.kill(os.getpid(), signal.SIGINT)
+    await bot_task
+    api.stop()
+    await runner.cleanup()
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    total = sorted(value for values in load_test.latencies.values() for value in values)
+    print(f"\nрежим: {mode}, профіль: {profile}, користувачів: {users}, одночасно: {concurrency}")
+    print(f"черга вихідних: {bot_module.outbound.rate:g} повідомлень/с, "
+          f"інтервал у чаті {bot_module.outbound.chat_interval:g} с")
+    print(f"запуск бота: {bot_module.startup_seconds * 1000:.0f} мс")
+    print(f"оновлень: {len(total)} за {elapsed:.1f} с, {len(total) / elapsed:.0f} оновлень/с, не оброблено: {load_test.lost}, "
+          f"не доставлено операторам: {load_test.undelivered}")
+    print(f"{'крок':<10} {'кількість':>10} {'p50, мс':>10} {'p99, мс':>10} {'max, мс':>10}")
+    for step in ("start", "menu", "form", "manual", "operator", "усього"):
+        values = total if step == "усього" else sorted(load_test.latencies.get(step, []))
+        print(f"{step:<10} {len(values):>10} {percentile(values, 0.5) * 1000:>10.1f} "
+              f"{percentile(values, 0.99) * 1000:>10.1f} {(values[-1] if values else 0) * 1000:>10.1f}")
+    print(f"{'черга':<10} {'запитів':>10} {'сер., мс':>10} {'p50, мс':>10} {'p99, мс':>10}")
+    for lane in LANE_NAMES:
+        wait = metrics.outbound_wait.get(lane)
+        if wait is None:
+            continue
+        # перцентилі - верхні межі кошиків гістограми
+        print(f"{lane:<10} {wait.count:>10} {wait.sum / wait.count * 1000:>10.1f} "
+              f"{f'<= {wait.quantile(0.5) * 1000:g}':>10} {f'<= {wait.quantile(0.99) * 1000:g}':>10}")
+    print(f"запити до Bot API: {json.dumps(dict(api.calls.most_common()), ensure_ascii=False)}")
+    print(f"пікова пам'ять (RSS, разом з фейковим сервером): {rss_peak / 1024:.0f} МБ "
+          f"(до запуску бота {rss_before / 1024:.0f} МБ)")
+
+
+if __name__ == '__main__':
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    mode = sys.argv[3] if len(sys.argv) > 3 else "polling"
+    profile = sys.argv[4] if len(sys.argv) > 4 else "production"
+    if profile not in PROFILES:
+        sys.exit(f"Невідомий профіль {profile}, доступні: {', '.join(PROFILES)}")
+    api_port, webhook_port = free_port(), free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        # бот працює з відносними шляхами data/..., тому запускаємо його в тимчасовій директорії
+        os.chdir(tmp)
+        os.makedirs("data")
+        configure(mode, profile, api_port, webhook_port)
+        asyncio.run(main(users, concurrency, mode, profile, api_port, webhook_port))
@@ -0,0 +1,45 @@
+import asyncio
+import csv
+import io
+
+import aiosqlite
+import pytest
+
+from app.export import write_export
+from app.users_data import UsersData
+
+
+def test_csv_escapes_formulas(tmp_path):
+    """Текст користувача, схожий на формулу, експортується як текст"""
+    async def scenario():
+        users_data = UsersData(str(tmp_path / 'users_data.sqlite'))
+        await users_data.open()
+        try:
+            for number, name in enumerate(('=HYPERLINK("x")', '+380', '-1', '@user', 'Олена')):
+                await users_data.add_user(str(number))
+                await users_data.update_user_data(number, 'name', name)
+            output = io.StringIO()
+            await write_export(users_data, output)
+            return output.getvalue()
+        finally:
+            await users_data.close()
+
+    rows = list(csv.DictReader(io.StringIO(asyncio.run(scenario()))))
+    assert [row['name'] for row in rows] == ['\'=HYPERLINK("x")', "'+380", "'-1", "'@user", 'Олена']
+
+
+def test_export_read_error_propagates(tmp_path):
+    """Помилка читання бази не перетворюється на обрізаний експорт"""
+    async def scenario():
+        users_data = UsersData(str(tmp_path / 'users_data.sqlite'))
+        await users_data.open()
+        try:
+            await users_data.add_user('1')
+            async with users_data._write() as db:
+                await db.execute('DROP TABLE users')
+            await write_export(users_data, io.StringIO())
+        finally:
+            await users_data.close()
+
+    with pytest.raises(aiosqlite.Error):
+        asyncio.run(scenario())
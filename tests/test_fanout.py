@@ -0,0 +1,26 @@
+import asyncio
+
+from app.fanout import OperatorFanout
+
+
+def test_drain_cancels_unfinished_sends():
+    """Надсилання, що не завершились за час зупинки, скасовуються і не обробляють результати"""
+    fanout = OperatorFanout()
+    results = []
+
+    async def send(operator_id):
+        if operator_id == 2:
+            await asyncio.sleep(60)
+        return operator_id
+
+    async def done(sent):
+        results.append(sent)
+
+    async def scenario():
+        fanout.submit([1], send, done)
+        fanout.submit([2], send, done)
+        await fanout.drain(0.1)
+        return fanout.stats()["background"]
+
+    assert asyncio.run(scenario()) == 0
+    assert results == [{1: 1}]
@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import ForwardMessage, SendMessage
+from aiogram.types import Chat, Message, User
+
+from app import handlers
+
+
+OPERATOR_ID = 900
+
+
+class FakeSession(BaseSession):
+    """Сесія без мережі: запам'ятовує запити, об'єднане повідомлення з заголовком відхиляє за потреби"""
+
+    def __init__(self, reject_combined: bool = False) -> None:
+        super().__init__()
+        self.reject_combined = reject_combined
+        self.requests = []
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b''
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests.append(method)
+        if self.reject_combined and isinstance(method, SendMessage) and 'привіт' in method.text:
+            raise TelegramBadRequest(method, "Bad Request: can't parse entities")
+        return Message(
+            message_id=len(self.requests), date=datetime.now(), chat=Chat(id=method.chat_id, type='private')
+        )
+
+
+def forward(session: FakeSession, monkeypatch):
+    """Пересилання повідомлення користувача з ім'ям, що містить HTML-символи"""
+    routes = []
+
+    async def record_routes(user_id, results):
+        routes.extend((operator_id, len(result)) for operator_id, result in results.items() if result is not None)
+
+    monkeypatch.setattr(handlers, 'record_routes', record_routes)
+    monkeypatch.setattr(handlers.history, 'add', lambda *args, **kwargs: None)
+
+    async def scenario():
+        bot = Bot('123:abc', session=session)
+        message = Message(
+            message_id=1, date=datetime.now(), chat=Chat(id=1, type='private'), text='привіт',
+            from_user=User(id=1, is_bot=False, first_name='Olena <3 & co', username='olena'),
+        ).as_(bot)
+        await handlers.forward_to_operators(message, [OPERATOR_ID], 'Запит <b>', {'uuid': 'abc'})
+        await handlers.fanout.drain(5)
+
+    asyncio.run(scenario())
+    return routes
+
+
+def test_forward_escapes_user_name(monkeypatch):
+    """Ім'я та контекст користувача екрануються в HTML заголовку"""
+    session = FakeSession()
+    routes = forward(session, monkeypatch)
+
+    [request] = session.requests
+    assert 'Olena &lt;3 &amp; co' in request.text
+    assert 'Запит &lt;b&gt;' in request.text
+    assert routes == [(OPERATOR_ID, 1)]
+
+
+def test_forward_falls_back_when_combined_rejected(monkeypatch):
+    """Якщо Telegram відхиляє об'єднане повідомлення, воно пересилається з окремим заголовком"""
+    session = FakeSession(reject_combined=True)
+    routes = forward(session, monkeypatch)
+
+    assert [type(request) for request in session.requests] == [SendMessage, ForwardMessage, SendMessage]
+    assert routes == [(OPERATOR_ID, 2)]
@@ -0,0 +1,89 @@
+import asyncio
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message, User
+
+from app.middleware import AccessMiddleware, RateLimitMiddleware
+from app.user_access import UserAccess
+from app.users_data import UsersData
+
+
+class FakeSession(BaseSession):
+    """Сесія без мережі, що запам'ятовує запити"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.requests = []
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b''
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests.append(method)
+        return Message(message_id=len(self.requests), date=datetime.now(), chat=Chat(id=method.chat_id, type='private'))
+
+
+def test_rate_limit_refills_gradually(monkeypatch):
+    """Після вичерпання ліміту токени відновлюються рівномірно, попередження - одне на період"""
+    monkeypatch.setenv('RATE_LIMIT_MESSAGES', '3')
+    monkeypatch.setenv('RATE_LIMIT_PERIOD', '30')
+    middleware = RateLimitMiddleware()
+
+    assert [middleware.check(1, None, 0.0) for _ in range(5)] == [
+        (True, False), (True, False), (True, False), (False, True), (False, False),
+    ]
+    # один токен відновлюється за 10 секунд
+    assert middleware.check(1, None, 9.0) == (False, False)
+    assert middleware.check(1, None, 10.0) == (True, False)
+    # інші користувачі мають власний ліміт
+    assert middleware.check(2, None, 10.0) == (True, False)
+
+
+def test_rate_limit_state_limit(monkeypatch):
+    """У ручному режимі діє окремий, суворіший ліміт"""
+    monkeypatch.setenv('RATE_LIMIT_MESSAGES', '5')
+    monkeypatch.setenv('RATE_LIMIT_MANUAL_MESSAGES', '2')
+    middleware = RateLimitMiddleware()
+
+    allowed = [middleware.check(1, "ChatMode:manual", 0.0)[0] for _ in range(3)]
+    assert allowed == [True, True, False]
+
+
+def test_blocked_user_notified_once_per_period(tmp_path, monkeypatch):
+    """Заблокований користувач отримує повідомлення про обмеження не частіше одного разу за період"""
+    monkeypatch.setenv('RATE_LIMIT_PERIOD', '60')
+
+    async def scenario():
+        users_data = UsersData(str(tmp_path / 'users_data.sqlite'))
+        await users_data.open()
+        try:
+            user = await users_data.add_user('1')
+            user_access = UserAccess(users_data)
+            await user_access.block_user(user['uuid'])
+
+            session = FakeSession()
+            bot = Bot('123:abc', session=session)
+            middleware = AccessMiddleware(users_data, user_access, RateLimitMiddleware())
+            handled = []
+
+            async def handler(event, data):
+                handled.append(event)
+
+            for number in range(20):
+                message = Message(
+                    message_id=number, date=datetime.now(), chat=Chat(id=1, type='private'), text='спам',
+                    from_user=User(id=1, is_bot=False, first_name='u1'),
+                ).as_(bot)
+                await middleware(handler, message, {"config": {"OPERATOR_IDS": frozenset()}})
+            return handled, session.requests
+        finally:
+            await users_data.close()
+
+    handled, requests = asyncio.run(scenario())
+    assert handled == []
+    assert len(requests) == 1
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+from aiogram.methods import SendChatAction, SendMessage
+
+from app.middleware import OperatorRegistry
+from app.outbound import OutboundLimiter
+
+
+OPERATOR_ID = 900
+
+
+def limiter(monkeypatch, rate: int = 30, chat_interval: float = 1) -> OutboundLimiter:
+    """Черга вихідних повідомлень з одним оператором"""
+    monkeypatch.setenv('OPERATOR_IDS', str(OPERATOR_ID))
+    monkeypatch.delenv('OPERATOR_IDS_FILE', raising=False)
+    monkeypatch.setenv('OUTBOUND_RATE', str(rate))
+    monkeypatch.setenv('OUTBOUND_CHAT_INTERVAL', str(chat_interval))
+    return OutboundLimiter(OperatorRegistry())
+
+
+async def send(outbound: OutboundLimiter, method, sent: list) -> float:
+    """Надсилання через чергу, повертає час очікування"""
+    started = time.monotonic()
+
+    async def make_request(bot, request):
+        sent.append(request)
+        return True
+
+    await outbound(make_request, None, method)
+    return time.monotonic() - started
+
+
+def test_chat_action_does_not_delay_reply(monkeypatch):
+    """Статус "друкує..." не займає інтервал чату, відповідь надсилається одразу"""
+    outbound = limiter(monkeypatch)
+
+    async def scenario():
+        sent = []
+        await send(outbound, SendChatAction(chat_id=1, action='typing'), sent)
+        return await send(outbound, SendMessage(chat_id=1, text='відповідь'), sent)
+
+    assert asyncio.run(scenario()) < 0.1
+
+
+def test_chat_interval(monkeypatch):
+    """Друге повідомлення в той самий чат чекає інтервал, в інший чат - ні"""
+    outbound = limiter(monkeypatch, chat_interval=0.3)
+
+    async def scenario():
+        sent = []
+        await send(outbound, SendMessage(chat_id=1, text='перше'), sent)
+        return await asyncio.gather(
+            send(outbound, SendMessage(chat_id=1, text='друге'), sent),
+            send(outbound, SendMessage(chat_id=2, text='інший чат'), sent),
+        )
+
+    same_chat, other_chat = asyncio.run(scenario())
+    assert same_chat >= 0.25
+    assert other_chat < 0.1
+
+
+def test_lane_priority(monkeypatch):
+    """Без вільних токенів першими надсилаються відповіді користувачам, потім сповіщення операторам, потім статуси"""
+    outbound = limiter(monkeypatch, rate=50)
+
+    async def scenario():
+        sent = []
+        outbound._tokens = 0
+        await asyncio.gather(
+            send(outbound, SendChatAction(chat_id=3, action='typing'), sent),
+            send(outbound, SendMessage(chat_id=OPERATOR_ID, text='сповіщення'), sent),
+            send(outbound, SendMessage(chat_id=2, text='відповідь'), sent),
+        )
+        return [type(request).__name__ + ':' + str(request.chat_id) for request in sent]
+
+    assert asyncio.run(scenario()) == ['SendMessage:2', f'SendMessage:{OPERATOR_ID}', 'SendChatAction:3']
+
+
+def test_higher_lane_takes_free_chat_first(monkeypatch):
+    """Запит, що чекає на інтервал свого чату, не затримує запити нижчих смуг в інші чати"""
+    outbound = limiter(monkeypatch, chat_interval=0.3)
+
+    async def scenario():
+        sent = []
+        await send(outbound, SendMessage(chat_id=1, text='перше'), sent)
+        await asyncio.gather(
+            send(outbound, SendMessage(chat_id=1, text='друге'), sent),
+            send(outbound, SendMessage(chat_id=OPERATOR_ID, text='сповіщення'), sent),
+        )
+        return [request.text for request in sent]
+
+    assert asyncio.run(scenario()) == ['перше', 'сповіщення', 'друге']
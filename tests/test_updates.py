@@ -0,0 +1,83 @@
+import asyncio
+
+from aiogram.types import Update, User
+
+from app.updates import UserSerializer
+
+
+def user(user_id: int) -> User:
+    return User(id=user_id, is_bot=False, first_name=f'u{user_id}')
+
+
+def test_same_user_updates_run_in_order():
+    """Оновлення одного користувача обробляються по черзі, різних - паралельно"""
+    serializer = UserSerializer()
+    events = []
+
+    async def handler(event, data):
+        events.append(('start', event.update_id))
+        await asyncio.sleep(0.01)
+        events.append(('end', event.update_id))
+
+    async def scenario():
+        await asyncio.gather(*(
+            serializer(handler, Update(update_id=update_id), {"event_from_user": user(user_id)})
+            for update_id, user_id in ((1, 1), (2, 1), (3, 2))
+        ))
+
+    asyncio.run(scenario())
+    # оновлення 2 починається лише після завершення 1, оновлення 3 іншого користувача - паралельно з 1
+    assert events.index(('end', 1)) < events.index(('start', 2))
+    assert events.index(('start', 3)) < events.index(('end', 1))
+    assert serializer.stats()["queues"] == 0
+
+
+def test_queue_depth_limit(monkeypatch):
+    """Оновлення понад USER_QUEUE_DEPTH пропускаються"""
+    monkeypatch.setenv('USER_QUEUE_DEPTH', '2')
+    serializer = UserSerializer()
+    handled = []
+
+    async def handler(event, data):
+        await asyncio.sleep(0.01)
+        handled.append(event.update_id)
+
+    async def scenario():
+        await asyncio.gather(*(
+            serializer(handler, Update(update_id=update_id), {"event_from_user": user(1)})
+            for update_id in range(1, 5)
+        ))
+
+    asyncio.run(scenario())
+    assert handled == [1, 2]
+    assert serializer.stats()["dropped"] == 2
+
+
+def test_state_reloaded_after_lock():
+    """Стан FSM перечитується після отримання черги, а не береться з моменту надходження"""
+    serializer = UserSerializer()
+    seen = []
+
+    class State:
+        value = 'form:name'
+
+        async def get_state(self):
+            return self.value
+
+    state = State()
+
+    async def first(event, data):
+        await asyncio.sleep(0.01)
+        state.value = 'ChatMode:manual'
+
+    async def second(event, data):
+        seen.append(data["raw_state"])
+
+    async def scenario():
+        await asyncio.gather(
+            serializer(first, Update(update_id=1), {"event_from_user": user(1), "state": state, "raw_state": 'form:name'}),
+            serializer(second, Update(update_id=2), {"event_from_user": user(1), "state": state, "raw_state": 'form:name'}),
+        )
+
+    asyncio.run(scenario())
+    assert seen == ['ChatMode:manual']
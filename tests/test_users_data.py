@@ -0,0 +1,70 @@
+import asyncio
+from datetime import datetime
+
+from aiogram.types import Chat, Message
+
+from app.history import INCOMING, MessageHistory
+from app.users_data import UsersData
+
+
+USERS = 2000
+
+
+def test_close_waits_for_running_flush(tmp_path, monkeypatch):
+    """close() під час пакетного запису не втрачає відкладені зміни"""
+    monkeypatch.setenv('DB_FLUSH_INTERVAL', '0')
+    db_file = str(tmp_path / 'users_data.sqlite')
+
+    async def scenario():
+        users_data = UsersData(db_file)
+        await users_data.open()
+        for telegram_user_id in range(USERS):
+            await users_data.add_user(str(telegram_user_id))
+        for telegram_user_id in range(USERS):
+            await users_data.update_user_data(telegram_user_id, 'name', f'user {telegram_user_id}')
+        # чекаємо, поки відкладений запис забере буфер і почне транзакцію
+        while not users_data._flushing:
+            await asyncio.sleep(0)
+        await users_data.close()
+
+        reopened = UsersData(db_file)
+        try:
+            users = await reopened.get_all_users_data()
+        finally:
+            await reopened.close()
+        return users
+
+    users = asyncio.run(scenario())
+    assert len(users) == USERS
+    assert all(user['name'] == f'user {telegram_user_id}' for telegram_user_id, user in users.items())
+
+
+def test_history_close_waits_for_running_flush(tmp_path, monkeypatch):
+    """close() історії під час відкладеного запису не втрачає повідомлення"""
+    monkeypatch.setenv('HISTORY_FLUSH_INTERVAL', '0')
+    # увесь буфер пишеться відкладеним записом, а не повним пакетом
+    monkeypatch.setenv('HISTORY_BATCH_SIZE', '100000')
+    db_file = str(tmp_path / 'users_data.sqlite')
+
+    async def scenario():
+        users_data = UsersData(db_file)
+        await users_data.open()
+        history = MessageHistory(users_data)
+        for number in range(USERS):
+            message = Message(
+                message_id=number, date=datetime.now(), chat=Chat(id=1, type='private'), text=f'повідомлення {number}'
+            )
+            history.add(1, message, INCOMING)
+        # чекаємо, поки відкладений запис забере буфер і почне транзакцію
+        while history._buffer:
+            await asyncio.sleep(0)
+        await history.close()
+        # після close() усі повідомлення вже записані в базу
+        try:
+            return await users_data.get_messages('1', USERS + 1)
+        finally:
+            await users_data.close()
+
+    total, rows = asyncio.run(scenario())
+    assert total == USERS
+    assert rows[0]['text'] == f'повідомлення {USERS - 1}'